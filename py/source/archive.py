@@ -0,0 +1,135 @@
+import os
+import urllib
+import hashlib
+import logging
+import threading
+
+log = logging.getLogger('paste')
+
+from .files import makedirs, write_atomic
+
+
+class PrimedArchive(object):
+    def __init__(self, directory):
+        """
+        an append-only on-disk archive of each module version's primed content, so that a uri pinned to an old
+        version is served the bytes it was published with. contents are stored once per digest and each
+        (name, version) points at a digest; neither is ever rewritten.
+
+        :param directory:
+        """
+        super(PrimedArchive, self).__init__()
+
+        self.directory = os.path.abspath(directory)
+        self.hits = 0
+        self.misses = 0
+
+        # (name, version) -> digest, or None when the version isn't archived
+        self._digests = {}
+        self._lock = threading.Lock()
+
+        makedirs(self.directory)
+
+    @classmethod
+    def _version_key(cls, version):
+        # 7, 7.0 and '7.0' are the same version
+        try:
+            return repr(float(version))
+        except (TypeError, ValueError):
+            return str(version)
+
+    def _version_path(self, name, version):
+        return os.path.join(self.directory, 'versions', urllib.quote(name, safe=''), self._version_key(version))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, 'blobs', digest[:2], digest)
+
+    def _digest(self, name, version):
+        key = (name, self._version_key(version))
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+        try:
+            with open(self._version_path(name, version), 'rb') as f:
+                digest = f.read().strip() or None
+        except IOError:
+            # not cached: the version may be archived later
+            return None
+        with self._lock:
+            self._digests[key] = digest
+        return digest
+
+    def has(self, name, version):
+        return self._digest(name, version) is not None
+
+    def put(self, name, version, content):
+        """
+        archive a version's primed content; a version that is already archived is left as it is
+
+        :param name:
+        :param version:
+        :param content:
+        :return: True if the version was added
+        """
+        if version is None or self.has(name, version):
+            return False
+
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        digest = hashlib.sha1(content).hexdigest()
+
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            write_atomic(blob_path, content)
+        write_atomic(self._version_path(name, version), digest)
+
+        with self._lock:
+            self._digests[(name, self._version_key(version))] = digest
+        return True
+
+    def read(self, name, version):
+        """
+
+        :param name:
+        :param version:
+        :return: the archived content, or None when the version isn't archived
+        """
+        digest = self._digest(name, version)
+        if digest is None:
+            self.misses += 1
+            return None
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                content = f.read()
+        except IOError as e:
+            log.warning('archived %s version %s is missing its content: %s' % (name, version, e))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def archive_manifest(self, content_type_manifest, names=None):
+        """
+        archive the current version of each module, so that it is still servable once it has been superseded
+
+        :param content_type_manifest:
+        :param names: limit archiving to these modules
+        :return: the number of versions added
+        """
+        primer = content_type_manifest.primer
+        manifest = content_type_manifest.manifest
+        added = 0
+        for (name, path, version) in content_type_manifest.sorted_deps:
+            if names is not None and name not in names:
+                continue
+            module = manifest.get(name)
+            if module is None or module.removed or self.has(name, version):
+                continue
+            try:
+                content = primer.read_primed(module.path)
+            except (IOError, OSError) as e:
+                log.warning('could not archive %s version %s: %s' % (name, version, e))
+                continue
+            if self.put(name, version, content):
+                added += 1
+        return added
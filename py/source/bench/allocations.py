@@ -0,0 +1,111 @@
+"""
+measure the objects and bytes each Jammer construction allocates and keeps
+
+    python -m paste.source.bench.allocations --modules 5000 --size 300
+
+python 2 has no tracemalloc, so allocations are counted as gc-tracked objects and sys.getsizeof bytes still alive
+while the jammers are held.
+"""
+import gc
+import sys
+import time
+import optparse
+
+from .suite import stand_in
+from .synthetic import generate_manifest
+
+
+class LegacyModuleDependency(object):
+    # the dependency record as it was before __slots__, for comparison
+    def __init__(self, name, version=None):
+        super(LegacyModuleDependency, self).__init__()
+
+        self.name = name.strip()
+        self.version = float(version.strip()) if version else None
+        self._last_modified = None
+        self._latest_lm = None
+        self._removed = None
+        self._version_mismatch = None
+        self._source_path = None
+
+
+def _record_bytes(record):
+    return sys.getsizeof(record) + (sys.getsizeof(record.__dict__) if hasattr(record, '__dict__') else 0)
+
+
+def _dependencies_bytes(jammer):
+    dependencies = jammer.dependencies
+    return sys.getsizeof(dependencies) + sum(_record_bytes(d) for d in dependencies.itervalues())
+
+
+def measure(construct, count):
+    """
+
+    :param construct: builds one jammer
+    :param count:
+    :return: (microseconds, gc-tracked objects, dependency bytes) per construction
+    """
+    construct()
+    gc.collect()
+    gc.disable()
+    try:
+        objects_before = len(gc.get_objects())
+        start = time.time()
+        jammers = [construct() for _ in xrange(count)]
+        seconds = time.time() - start
+        objects = len(gc.get_objects()) - objects_before - 1
+        dependency_bytes = sum(_dependencies_bytes(jammer) for jammer in jammers)
+    finally:
+        gc.enable()
+    return seconds / count * 1e6, float(objects) / count, float(dependency_bytes) / count
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--modules', type='int', default=5000)
+    parser.add_option('--size', type='int', default=300, help='modules per bundle')
+    parser.add_option('--count', type='int', default=200, help='jammers constructed per measurement')
+    options, args = parser.parse_args(argv)
+
+    content_type_manifest = generate_manifest(options.modules, fan_out=0)
+    names = [name for (name, path, version) in content_type_manifest.sorted_deps][:options.size]
+
+    with stand_in(content_type_manifest):
+        from ..jammer import Jammer, _ModuleDependency, resolution_cache
+        from ...util import content_type_helper
+
+        content_type = content_type_helper.filename_to_content_type('.js')
+        dependencies = ','.join(names)
+        uri = Jammer(dependencies=dependencies, content_type=content_type).uri
+        loaded = set(names[::2])
+
+        def require():
+            return Jammer(dependencies=dependencies, content_type=content_type)
+
+        def uri_request():
+            resolution_cache.clear()
+            jammer = Jammer(request_path=uri)
+            jammer.dependency_last_modifieds
+            return jammer
+
+        def filtered():
+            jammer = Jammer(dependencies=dependencies, content_type=content_type)
+            jammer.filter_loaded(loaded)
+            return jammer
+
+        print 'modules: %d; bundle: %d modules' % (options.modules, len(names))
+        for label, construct in (('require', require), ('uri (unmemoized)', uri_request),
+                                 ('require + filter_loaded', filtered)):
+            microseconds, objects, dependency_bytes = measure(construct, options.count)
+            print '%-24s %9.1f us  %8.1f objects  %9.0f dependency bytes per jammer' % (
+                label, microseconds, objects, dependency_bytes)
+
+        legacy = _record_bytes(LegacyModuleDependency(names[0], '1'))
+        slotted = _record_bytes(_ModuleDependency(names[0], '1'))
+        print 'dependency record: %d bytes with __slots__, %d with a __dict__ (%.0f%% smaller)' % (
+            slotted, legacy, 100.0 * (legacy - slotted) / legacy)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
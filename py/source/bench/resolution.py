@@ -0,0 +1,84 @@
+"""
+compare require-style dependency resolution against the precomputed DependencyIndex
+
+    python -m paste.source.bench.resolution --modules 5000
+"""
+import sys
+import time
+import optparse
+
+from ..index import DependencyIndex
+from .synthetic import generate_manifest, sample_requests
+
+
+def legacy_normalize_star_token(content_type_manifest, dependencies):
+    normalized_dependencies = []
+    for dependency_name in dependencies:
+        if dependency_name.strip().endswith('.*'):
+            dp_name = dependency_name.strip()[:-2]
+            for (name, module, version) in content_type_manifest.sorted_deps:
+                if name == dp_name or name.startswith(dp_name + '.'):
+                    normalized_dependencies.append(name)
+        else:
+            normalized_dependencies.append(dependency_name)
+    return normalized_dependencies
+
+
+def legacy_resolve(content_type_manifest, dependencies):
+    # the linear scans Jammer used before the index: star expansion over sorted_deps, one level of the manifest
+    # dependency lists (primed manifests list every transitive dependency) and an ordering pass over sorted_deps
+    manifest = content_type_manifest.manifest
+    names = set(name.strip() for name in legacy_normalize_star_token(content_type_manifest, dependencies.split(','))
+                if name.strip() in manifest)
+    names.update([dependency_name for name in list(names) for dependency_name in manifest.get(name).dependencies])
+    return [name for (name, path, version) in content_type_manifest.sorted_deps if name in names]
+
+
+def indexed_resolve(index, dependencies):
+    names = []
+    for name in dependencies.split(','):
+        name = name.strip()
+        if name.endswith('.*'):
+            names.extend(index.expand_star(name[:-2]))
+        else:
+            names.append(name)
+    return index.names_from_bits(index.closure_bits(names))
+
+
+def _time(func, requests):
+    start = time.time()
+    for request in requests:
+        func(request)
+    return (time.time() - start) / len(requests)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--modules', type='int', default=5000)
+    parser.add_option('--requests', type='int', default=200)
+    parser.add_option('--size', type='int', default=5, help='modules named per request')
+    options, args = parser.parse_args(argv)
+
+    # closed, as a primed manifest is: the legacy resolution only reads one level of dependency lists
+    content_type_manifest = generate_manifest(options.modules, closed=True)
+    requests = sample_requests(content_type_manifest, options.requests, size=options.size)
+
+    start = time.time()
+    index = DependencyIndex(content_type_manifest)
+    build_seconds = time.time() - start
+
+    for request in requests:
+        assert legacy_resolve(content_type_manifest, request) == indexed_resolve(index, request)
+
+    legacy_seconds = _time(lambda request: legacy_resolve(content_type_manifest, request), requests)
+    indexed_seconds = _time(lambda request: indexed_resolve(index, request), requests)
+
+    print 'modules: %d; requests: %d' % (options.modules, options.requests)
+    print 'index build:    %10.3f ms (once per manifest generation)' % (build_seconds * 1000)
+    print 'legacy resolve: %10.3f ms/request' % (legacy_seconds * 1000)
+    print 'index resolve:  %10.3f ms/request (%.1fx)' % (indexed_seconds * 1000, legacy_seconds / indexed_seconds)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+benchmark the jam hot paths on a synthetic manifest and source tree
+
+    python -m paste.source.bench.suite --modules 100,1000,5000 --output results.json
+    python -m paste.source.bench.suite --modules 5000 --compare results.json
+
+each stage runs in a forked child so that its peak memory is measured on its own.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import optparse
+import resource
+import contextlib
+
+from .synthetic import generate_manifest, sample_requests, write_source_tree
+
+RESULTS_VERSION = 1
+
+STAGES = []
+
+
+def stage(func):
+    STAGES.append(func)
+    return func
+
+
+class StandInEnv(object):
+    def __init__(self, **overrides):
+        """
+        a stand-in for Runtime.get().env
+
+        :param overrides:
+        """
+        super(StandInEnv, self).__init__()
+
+        self.root_uri = '/static/'
+        self.compile_mode = False
+        self.network_request_threshold = 0
+        self.__dict__.update(overrides)
+
+
+class StandInRuntime(object):
+    def __init__(self, env):
+        """
+        what Runtime.get() returns while a stand_in block is active
+
+        :param env:
+        """
+        super(StandInRuntime, self).__init__()
+
+        self.env = env
+
+
+class StandInManifest(object):
+    def __init__(self, content_type_manifest):
+        """
+        a stand-in for the core manifest module, serving a single synthetic manifest
+
+        :param content_type_manifest:
+        """
+        super(StandInManifest, self).__init__()
+
+        self.content_type_manifest = content_type_manifest
+
+    def get_content_type_manifest(self, content_type):
+        return self.content_type_manifest
+
+
+@contextlib.contextmanager
+def stand_in(content_type_manifest, **env_overrides):
+    """
+    point the jam modules at a synthetic manifest and a stand-in env for the duration of the block. Runtime.get() is
+    patched before the jam modules are imported, since they read the env at import to size their caches; modules
+    that were imported already only have their env swapped.
+
+    :param content_type_manifest:
+    :param env_overrides:
+    """
+    from ...core.runtime import Runtime
+
+    env = StandInEnv(**env_overrides)
+    runtime = StandInRuntime(env)
+    saved_get = Runtime.__dict__.get('get')
+    Runtime.get = staticmethod(lambda: runtime)
+    try:
+        from .. import cache, encoding, jammer, metrics, offload, speed
+
+        modules = (cache, encoding, jammer, metrics, offload, speed)
+        saved = [module.env for module in modules], jammer.manifest
+        for module in modules:
+            module.env = env
+        jammer.manifest = StandInManifest(content_type_manifest)
+        try:
+            yield env
+        finally:
+            for module, module_env in zip(modules, saved[0]):
+                module.env = module_env
+            jammer.manifest = saved[1]
+    finally:
+        if saved_get is None:
+            del Runtime.get
+        else:
+            Runtime.get = saved_get
+
+
+def _rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1024
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def measure(func, items, setup=None):
+    """
+
+    :param func: called with each item
+    :param items:
+    :param setup: called before each item, outside the timing
+    :return: a dict of throughput and latency percentiles
+    """
+    latencies = []
+    total_start = time.time()
+    for item in items:
+        if setup is not None:
+            setup()
+        start = time.time()
+        func(item)
+        latencies.append(time.time() - start)
+    total = time.time() - total_start
+
+    latencies.sort()
+    return {
+        'ops': len(latencies),
+        'ops_per_second': len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+        'wall_seconds': total,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p90_ms': _percentile(latencies, 0.9) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def run_isolated(func, *args):
+    """
+    run func in a forked child and add its peak memory to the result
+
+    :param func: returns a json-serializable dict
+    :param args:
+    :return:
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            start_rss = _rss_kb()
+            result = func(*args)
+            result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result['rss_growth_kb'] = max(_rss_kb() - start_rss, 0)
+            payload = json.dumps(result)
+        except Exception as e:
+            payload = json.dumps({'error': '%s: %s' % (type(e).__name__, e)})
+            status = 1
+        with os.fdopen(write_fd, 'w') as pipe:
+            pipe.write(payload)
+        os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        payload = pipe.read()
+    os.waitpid(pid, 0)
+    return json.loads(payload) if payload else {'error': 'no result'}
+
+
+@stage
+def require_resolution(context):
+    from ..jammer import Jammer
+    return measure(lambda request: Jammer(dependencies=request, content_type=context['content_type']),
+                   context['requests'])
+
+
+@stage
+def normalize_star_token(context):
+    from ..jammer import Jammer
+    jammer = Jammer(content_type=context['content_type'])
+    return measure(lambda request: jammer._normalize_star_token(request.split(',')), context['star_requests'])
+
+
+@stage
+def checksum_and_uri(context):
+    from ..jammer import Jammer
+    jammers = [Jammer(dependencies=request, content_type=context['content_type']) for request in context['requests']]
+    return measure(lambda jammer: jammer.uri, jammers)
+
+
+@stage
+def uri_request_cold(context):
+    from ..jammer import Jammer, resolution_cache
+    return measure(lambda uri: Jammer(request_path=uri).uri, context['uris'], setup=resolution_cache.clear)
+
+
+@stage
+def uri_request_memoized(context):
+    from ..jammer import Jammer
+    for uri in context['uris']:
+        Jammer(request_path=uri)
+    return measure(lambda uri: Jammer(request_path=uri).uri, context['uris'])
+
+
+@stage
+def contents_assembly(context):
+    from ..jammer import Jammer
+    from ..cache import bundle_cache
+    return measure(lambda uri: Jammer(request_path=uri).contents, context['uris'], setup=bundle_cache.clear)
+
+
+@stage
+def contents_cached(context):
+    from ..jammer import Jammer
+    for uri in context['uris']:
+        Jammer(request_path=uri).contents
+    return measure(lambda uri: Jammer(request_path=uri).contents, context['uris'])
+
+
+def _compression_stage(encoding):
+    def compress_utf8(context):
+        from ..jammer import Jammer
+        from ..speed import Speed
+        bodies = [Jammer(request_path=uri).contents for uri in context['uris']]
+        result = measure(lambda body: Speed.compress_utf8(body, lambda name, value: None, skip_content_check=True,
+                                                          accept_encoding=encoding), bodies)
+        result['input_bytes'] = sum(len(body) for body in bodies)
+        return result
+    compress_utf8.__name__ = 'compress_utf8_%s' % encoding
+    return compress_utf8
+
+
+def _compression_stages():
+    from .. import encoding as content_encoding
+    return [_compression_stage(encoding) for encoding in content_encoding.SERVER_PREFERENCE]
+
+
+def compressor_compress(context):
+    from .. import compressor
+    from ..jammer import Jammer
+    bodies = [Jammer(request_path=uri).contents for uri in context['uris'][:context['compressor_items']]]
+    return measure(lambda body: compressor.compress(body, file_type=compressor.JS), bodies)
+
+
+def run_suite(module_count, request_count=200, size_scale=0.1, fan_out=4, include_compressor=False,
+              compressor_items=5, seed=0):
+    """
+
+    :param module_count:
+    :param request_count:
+    :param size_scale: see write_source_tree
+    :param fan_out:
+    :param include_compressor: also time compressor.compress, which needs java and the compressor jars
+    :param compressor_items:
+    :param seed:
+    :return: stage name -> result
+    """
+    from ...util import content_type_helper
+
+    directory = tempfile.mkdtemp(prefix='paste-bench-')
+    try:
+        content_type_manifest = generate_manifest(module_count, fan_out=fan_out, seed=seed, base_path=directory)
+        total_bytes = write_source_tree(content_type_manifest, size_scale=size_scale)
+
+        with stand_in(content_type_manifest) as env:
+            from ..jammer import Jammer
+
+            content_type = content_type_helper.filename_to_content_type('.js')
+            requests = sample_requests(content_type_manifest, request_count, star_ratio=0.0, seed=seed)
+            context = {
+                'content_type': content_type,
+                'requests': requests,
+                'star_requests': sample_requests(content_type_manifest, request_count, star_ratio=0.5, seed=seed),
+                'uris': [Jammer(dependencies=request, content_type=content_type).uri for request in requests],
+                'compressor_items': compressor_items,
+            }
+
+            stages = STAGES + _compression_stages() + ([compressor_compress] if include_compressor else [])
+            results = {
+                '_tree': {'modules': module_count, 'source_bytes': total_bytes, 'requests': request_count},
+            }
+            for stage_func in stages:
+                results[stage_func.__name__] = run_isolated(stage_func, context)
+            return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare(results, baseline):
+    """
+
+    :param results:
+    :param baseline:
+    :return: lines describing the p50 and throughput change of each stage present in both
+    """
+    lines = []
+    for size, stages in sorted(results['sizes'].iteritems(), key=lambda item: int(item[0])):
+        baseline_stages = baseline.get('sizes', {}).get(size)
+        if not baseline_stages:
+            continue
+        for name, result in sorted(stages.iteritems()):
+            before = baseline_stages.get(name)
+            if name.startswith('_') or not before or 'error' in result or 'error' in before:
+                continue
+            lines.append('%6s %-26s p50 %9.3f -> %9.3f ms (%+6.1f%%)  ops/s %+6.1f%%' % (
+                size, name, before['p50_ms'], result['p50_ms'],
+                _change(before['p50_ms'], result['p50_ms']),
+                _change(before['ops_per_second'], result['ops_per_second'])))
+    return lines
+
+
+def _change(before, after):
+    return ((after - before) / before * 100) if before else 0.0
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--modules', default='100,1000,5000',
+                      help='comma separated manifest sizes, between 100 and 20000 modules')
+    parser.add_option('--requests', type='int', default=200)
+    parser.add_option('--fan-out', dest='fan_out', type='int', default=4)
+    parser.add_option('--size-scale', dest='size_scale', type='float', default=0.1,
+                      help='scales module byte sizes to keep large trees small on disk')
+    parser.add_option('--compressor', action='store_true', default=False,
+                      help='also time compressor.compress (needs java)')
+    parser.add_option('--output', help='write the results json here')
+    parser.add_option('--compare', help='a previous results json to compare against')
+    options, args = parser.parse_args(argv)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': {},
+    }
+    for module_count in [int(size) for size in options.modules.split(',')]:
+        stages = run_suite(module_count, request_count=options.requests, size_scale=options.size_scale,
+                           fan_out=options.fan_out, include_compressor=options.compressor)
+        results['sizes'][str(module_count)] = stages
+
+        print '%d modules (%d source bytes)' % (module_count, stages['_tree']['source_bytes'])
+        for name, result in sorted(stages.iteritems()):
+            if name.startswith('_'):
+                continue
+            if 'error' in result:
+                print '  %-26s ERROR %s' % (name, result['error'])
+                continue
+            print '  %-26s %10.1f ops/s  p50 %8.3f  p90 %8.3f  p99 %8.3f ms  peak %7d KB  +%d KB' % (
+                name, result['ops_per_second'], result['p50_ms'], result['p90_ms'], result['p99_ms'],
+                result['peak_rss_kb'], result['rss_growth_kb'])
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            for line in compare(results, json.load(f)):
+                print line
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import random
+
+
+class SyntheticModule(object):
+    def __init__(self, name, path, version, last_modified, byte_size, dependencies):
+        """
+        a stand-in for a primer manifest entry
+
+        :param name:
+        :param path:
+        :param version:
+        :param last_modified:
+        :param byte_size:
+        :param dependencies:
+        """
+        super(SyntheticModule, self).__init__()
+
+        self.name = name
+        self.path = path
+        self.version = version
+        self.last_modified = last_modified
+        self.byte_size = byte_size
+        self.dependencies = dependencies
+        self.removed = False
+        self.serialized_versions = []
+
+    def deserialize(self, serialized_version):
+        module = SyntheticModule(self.name, serialized_version.get('path', self.path),
+                                 serialized_version.get('version'), serialized_version.get('last_modified'),
+                                 serialized_version.get('byte_size', self.byte_size), self.dependencies)
+        return module
+
+
+class SyntheticContentTypeManifest(object):
+    def __init__(self, modules, primer=None):
+        """
+        a stand-in for manifest.get_content_type_manifest()
+
+        :param modules: SyntheticModules in dependency order
+        :param primer:
+        """
+        super(SyntheticContentTypeManifest, self).__init__()
+
+        self.manifest = dict((module.name, module) for module in modules)
+        self.sorted_deps = [(module.name, module.path, module.version) for module in modules]
+        self.primer = primer
+
+
+def generate_manifest(module_count, fan_out=4, namespaces=20, depth=3, seed=0, base_path='/synthetic', closed=False):
+    """
+    build a manifest of module_count modules spread over nested namespaces (so star tokens like 'ns3.*' expand to
+    realistic groups), each depending on up to fan_out earlier modules
+
+    :param module_count:
+    :param fan_out:
+    :param namespaces:
+    :param depth:
+    :param seed:
+    :param base_path:
+    :param closed: list every transitive dependency of a module rather than only its direct ones
+    :return: a SyntheticContentTypeManifest
+    """
+    rng = random.Random(seed)
+    modules = []
+    closed_dependencies = {}
+    for i in xrange(module_count):
+        segments = ['ns%d' % rng.randrange(namespaces)]
+        segments.extend('sub%d' % rng.randrange(4) for _ in xrange(rng.randrange(depth)))
+        segments.append('mod%d' % i)
+        name = '.'.join(segments)
+
+        # favour recent modules so that dependency chains are deep rather than all pointing at the root
+        dependencies = set()
+        for _ in xrange(rng.randrange(fan_out + 1) if i else 0):
+            dependencies.add(modules[min(int(i * (1 - rng.random() ** 2)), i - 1)].name)
+        if closed:
+            # earlier modules are closed already, so one level of their lists is the whole closure
+            for dependency_name in list(dependencies):
+                dependencies.update(closed_dependencies[dependency_name])
+            closed_dependencies[name] = dependencies
+
+        modules.append(SyntheticModule(
+            name=name,
+            path='%s/%s.js' % (base_path, name.replace('.', '/')),
+            version='%d.0' % rng.randrange(1, 20),
+            last_modified=1400000000 + rng.randrange(10 ** 7),
+            byte_size=rng.randrange(200, 20000),
+            dependencies=sorted(dependencies)
+        ))
+    return SyntheticContentTypeManifest(modules)
+
+
+def sample_requests(content_type_manifest, count, size=5, star_ratio=0.2, seed=0):
+    """
+
+    :param content_type_manifest:
+    :param count:
+    :param size: modules named per request
+    :param star_ratio: the fraction of names replaced by their namespace's star token
+    :param seed:
+    :return: comma separated dependency strings
+    """
+    rng = random.Random(seed)
+    names = [name for (name, path, version) in content_type_manifest.sorted_deps]
+    requests = []
+    for _ in xrange(count):
+        parts = []
+        for name in rng.sample(names, min(size, len(names))):
+            if rng.random() < star_ratio:
+                parts.append(name.rsplit('.', 1)[0] + '.*')
+            else:
+                parts.append(name)
+        requests.append(','.join(parts))
+    return requests
+
+
+class SyntheticPrimer(object):
+    def __init__(self):
+        """
+        a stand-in for the primer that serves module sources as their own primed files
+        """
+        super(SyntheticPrimer, self).__init__()
+
+    def primed_path(self, filename):
+        return filename
+
+    def read_primed(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+
+def write_source_tree(content_type_manifest, size_scale=1.0):
+    """
+    write a file of (scaled) byte_size for each module at its path, and attach a SyntheticPrimer that reads them
+
+    :param content_type_manifest:
+    :param size_scale: multiplies each module's byte_size, to keep large trees small on disk
+    :return: the total bytes written
+    """
+    total = 0
+    for name, path, version in content_type_manifest.sorted_deps:
+        module = content_type_manifest.manifest[name]
+        module.byte_size = max(int(module.byte_size * size_scale), 1)
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        line = 'var %s = function () { return %d; };\n' % (name.replace('.', '_'), module.byte_size)
+        with open(path, 'wb') as f:
+            f.write((line * (module.byte_size / len(line) + 1))[:module.byte_size])
+        total += module.byte_size
+
+    content_type_manifest.primer = SyntheticPrimer()
+    return total
@@ -0,0 +1,51 @@
+import logging
+
+log = logging.getLogger('paste')
+
+from . import metrics
+from .lru import LRUCache
+from .shared import SharedBundleCache, SharedCacheError, DEFAULT_MAX_BYTES as DEFAULT_SHARED_CACHE_MAX_BYTES, \
+    DEFAULT_SLOTS as DEFAULT_SHARED_CACHE_SLOTS, DEFAULT_GRACE as DEFAULT_SHARED_CACHE_GRACE
+
+from ..core.runtime import Runtime
+env = Runtime.get().env
+
+DEFAULT_BUNDLE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_COMPRESSION_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_DELTA_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+bundle_cache = LRUCache(
+    max_bytes=getattr(env, 'bundle_cache_max_bytes', DEFAULT_BUNDLE_CACHE_MAX_BYTES),
+    name='bundle'
+)
+
+compression_cache = LRUCache(
+    max_bytes=getattr(env, 'compression_cache_max_bytes', DEFAULT_COMPRESSION_CACHE_MAX_BYTES),
+    name='compression'
+)
+
+# deltas between two versions of a bundle, keyed by the pair of checksums
+delta_cache = LRUCache(
+    max_bytes=getattr(env, 'delta_cache_max_bytes', DEFAULT_DELTA_CACHE_MAX_BYTES),
+    name='delta'
+)
+
+metrics.register_cache(bundle_cache)
+metrics.register_cache(compression_cache)
+metrics.register_cache(delta_cache)
+
+# one arena per host, shared by every worker that opens the same file
+shared_bundle_cache = None
+if getattr(env, 'shared_cache_path', None):
+    try:
+        shared_bundle_cache = SharedBundleCache(
+            env.shared_cache_path,
+            max_bytes=getattr(env, 'shared_cache_max_bytes', DEFAULT_SHARED_CACHE_MAX_BYTES),
+            slots=getattr(env, 'shared_cache_slots', DEFAULT_SHARED_CACHE_SLOTS),
+            grace=getattr(env, 'shared_cache_grace', DEFAULT_SHARED_CACHE_GRACE)
+        )
+    except SharedCacheError as e:
+        log.error('not using the shared bundle cache: %s' % e)
+
+if shared_bundle_cache is not None:
+    metrics.register_cache(shared_bundle_cache)
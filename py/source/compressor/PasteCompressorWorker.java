@@ -0,0 +1,130 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.security.Permission;
+import java.util.jar.JarFile;
+
+/**
+ * Long-lived compressor worker used by paste's compressor.pool.
+ *
+ * Usage: java -cp <compressor dir> PasteCompressorWorker <compressor jar>
+ *
+ * The jar's Main-Class is invoked once per request with System.in/out/err redirected to buffers. Requests and
+ * responses are framed on stdin/stdout with big-endian 32-bit lengths:
+ *
+ *   request:  int args_length, byte[] args (utf-8, NUL separated), int content_length, byte[] content
+ *   response: int exit_status, int stdout_length, byte[] stdout, int stderr_length, byte[] stderr
+ *
+ * Calls to System.exit() from the compressor are trapped and reported as the exit status where the JVM still
+ * allows a SecurityManager; otherwise the worker exits and the pool recycles it.
+ */
+public class PasteCompressorWorker {
+    private static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    private static void trapExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitTrappedException(status);
+                }
+
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+            });
+        } catch (UnsupportedOperationException e) {
+            // the security manager is unavailable on this JVM
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        File jar = new File(args[0]);
+        String mainClassName;
+        JarFile jarFile = new JarFile(jar);
+        try {
+            mainClassName = jarFile.getManifest().getMainAttributes().getValue("Main-Class");
+        } finally {
+            jarFile.close();
+        }
+
+        ClassLoader loader = new URLClassLoader(new URL[]{jar.toURI().toURL()},
+                PasteCompressorWorker.class.getClassLoader());
+        Method mainMethod = loader.loadClass(mainClassName).getMethod("main", String[].class);
+
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(
+                new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+
+        trapExit();
+
+        while (true) {
+            int argsLength;
+            try {
+                argsLength = in.readInt();
+            } catch (EOFException e) {
+                break;
+            }
+            byte[] argBytes = new byte[argsLength];
+            in.readFully(argBytes);
+            byte[] content = new byte[in.readInt()];
+            in.readFully(content);
+
+            String joinedArgs = new String(argBytes, "UTF-8");
+            String[] callArgs = joinedArgs.isEmpty() ? new String[0] : joinedArgs.split("\u0000");
+
+            ByteArrayOutputStream stdout = new ByteArrayOutputStream();
+            ByteArrayOutputStream stderr = new ByteArrayOutputStream();
+            System.setIn(new ByteArrayInputStream(content));
+            System.setOut(new PrintStream(stdout, true, "UTF-8"));
+            System.setErr(new PrintStream(stderr, true, "UTF-8"));
+
+            int status = 0;
+            try {
+                mainMethod.invoke(null, (Object) callArgs);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitTrappedException) {
+                    status = ((ExitTrappedException) cause).status;
+                } else {
+                    cause.printStackTrace(System.err);
+                    status = 1;
+                }
+            }
+            System.out.flush();
+            System.err.flush();
+
+            byte[] outBytes = stdout.toByteArray();
+            byte[] errBytes = stderr.toByteArray();
+            out.writeInt(status);
+            out.writeInt(outBytes.length);
+            out.write(outBytes);
+            out.writeInt(errBytes.length);
+            out.write(errBytes);
+            out.flush();
+        }
+    }
+}
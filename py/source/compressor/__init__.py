@@ -1,17 +1,174 @@
 import os
+import time
+import signal
+import shlex
+import logging
+import threading
 import subprocess
+import multiprocessing
+import collections
+import Queue
 
 import scss
 
+from .cache import CompiledAssetCache, file_digest
+from . import css as css_engine
+from . import image as image_optimizer
+from . import pool as worker_pool
+from .. import metrics
+from .. import offload
+
+log = logging.getLogger('paste')
+
 _compressor_dir = os.path.dirname(os.path.abspath(__file__))
 
-_yui_compressor_args = 'java -jar %s' % (os.path.join(_compressor_dir, 'yuicompressor-2.4.7.jar'))
-_closure_compressor_args = 'java -jar %s' % (os.path.join(_compressor_dir, 'closure-compiler.jar'))
-_html_compressor_args = 'java -jar %s' % (os.path.join(_compressor_dir, 'htmlcompressor-1.5.2.jar'))
+_yui_compressor_jar = os.path.join(_compressor_dir, 'yuicompressor-2.4.7.jar')
+_closure_compressor_jar = os.path.join(_compressor_dir, 'closure-compiler.jar')
+_html_compressor_jar = os.path.join(_compressor_dir, 'htmlcompressor-1.5.2.jar')
+
+_yui_compressor_args = ['java', '-jar', _yui_compressor_jar]
+_closure_compressor_args = ['java', '-jar', _closure_compressor_jar]
+_html_compressor_args = ['java', '-jar', _html_compressor_jar]
 
 HTML = 'html'
 JS = 'js'
 CSS = 'css'
+PNG = image_optimizer.PNG
+JPEG = image_optimizer.JPEG
+WEBP = image_optimizer.WEBP
+
+CACHE_DIR_ENV = 'PASTE_COMPRESSOR_CACHE_DIR'
+CSS_BACKEND_ENV = 'PASTE_CSS_BACKEND'
+
+# the exit status reported for an item that was killed or abandoned after its timeout
+TIMEOUT_RETURNCODE = -1
+
+CompressResult = collections.namedtuple('CompressResult', ['index', 'output', 'returncode', 'stderr', 'seconds'])
+
+_asset_cache = CompiledAssetCache(os.environ[CACHE_DIR_ENV]) if os.environ.get(CACHE_DIR_ENV) else None
+
+_css_engine = css_engine.CssEngine(backend=os.environ.get(CSS_BACKEND_ENV) or css_engine.SCSS)
+
+
+def configure_cache(directory, max_bytes=None):
+    """
+    enable (or, with directory=None, disable) the on-disk compiled-asset cache
+
+    :param directory:
+    :param max_bytes:
+    :return: the cache
+    """
+    global _asset_cache
+    if directory is None:
+        _asset_cache = None
+    elif max_bytes is None:
+        _asset_cache = CompiledAssetCache(directory)
+    else:
+        _asset_cache = CompiledAssetCache(directory, max_bytes=max_bytes)
+    return _asset_cache
+
+
+def configure_css(backend=css_engine.SCSS, check_interval=css_engine.DEFAULT_CHECK_INTERVAL):
+    """
+    choose the css compiler backend; the partial cache and import graph start over
+
+    :param backend: css_engine.SCSS, or css_engine.LIBSASS when the libsass bindings are installed
+    :param check_interval: seconds between checks of an imported partial for changes
+    :return: the engine
+    """
+    global _css_engine
+    _css_engine = css_engine.CssEngine(backend=backend, check_interval=check_interval)
+    return _css_engine
+
+
+def invalidate_css(paths):
+    """
+    drop changed partials and the compiled output of every stylesheet that imports them
+
+    :param paths:
+    :return: the number of stylesheets that will recompile
+    """
+    return len(_css_engine.invalidate(paths))
+
+
+def configure_pool(size, timeout=worker_pool.DEFAULT_TIMEOUT):
+    """
+    keep size warm JVM workers per compressor jar instead of starting java for every call; 0 disables the pool
+
+    :param size:
+    :param timeout: seconds allowed per call before the worker is recycled
+    :return: True if the pool is enabled
+    """
+    return worker_pool.configure(size, timeout=timeout)
+
+
+def is_image(file_type):
+    """
+
+    :param file_type:
+    :return: whether file_type is optimized in-process by the image optimizer rather than by a compressor
+    """
+    return file_type is not None and file_type.lower() in image_optimizer.FILE_TYPES + (WEBP,)
+
+
+def _cache_key(content, file_type, arguments, **kwargs):
+    file_type = file_type.lower()
+    if is_image(file_type):
+        # keyed by the input image and the settings it is optimized with
+        file_type = JPEG if file_type == 'jpeg' else file_type
+        compressor_digest = image_optimizer.digest(kwargs.get('quality'))
+    elif file_type == JS:
+        compressor_digest = file_digest(_closure_compressor_jar)
+    elif file_type == CSS:
+        # key on the stylesheet with its partials inlined; one that still has an unresolved import isn't cacheable
+        try:
+            content, partial_paths, unresolved = _css_engine.flatten(content, kwargs.get('load_paths'),
+                                                                     kwargs.get('path'))
+        except css_engine.CssError:
+            # reported by the compile itself
+            return None
+        if unresolved:
+            return None
+        backend = kwargs.get('css_backend') or _css_engine.backend
+        backend_module = css_engine.sass if backend == css_engine.LIBSASS else scss
+        compressor_digest = '%s-%s-%r' % (backend, getattr(backend_module, '__version__', ''),
+                                          kwargs.get('load_paths'))
+    else:
+        compressor_digest = file_digest(_html_compressor_jar)
+    return CompiledAssetCache.key(content, file_type, arguments, compressor_digest)
+
+
+def _cached(content, file_type, arguments, **kwargs):
+    """
+
+    :return: (cache key, cached output); both are None when the cache is disabled or not applicable
+    """
+    if _asset_cache is None:
+        return None, None
+    cache_key = _cache_key(content, file_type, arguments, **kwargs)
+    return cache_key, (_asset_cache.get(cache_key) if cache_key is not None else None)
+
+
+def caching():
+    """
+
+    :return: whether compressor output is kept in the on-disk cache
+    """
+    return _asset_cache is not None
+
+
+def lookup(content, file_type, arguments='', **kwargs):
+    """
+    the cached output of compress(), without compressing on a miss
+
+    :param content:
+    :param file_type:
+    :param arguments:
+    :param kwargs:
+    :return: the output, or None when it isn't cached
+    """
+    cache_key, output = _cached(content, file_type, arguments, **kwargs)
+    return output
 
 
 def compress(content, file_type=None, arguments='', **kwargs):
@@ -27,32 +184,266 @@ def compress(content, file_type=None, arguments='', **kwargs):
         print 'NO FILE TYPE. YUI COMPRESSOR WILL NOT RUN'
         return content
 
-    if file_type.lower() == JS:
-        compressor = _closure_compressor_args
-    elif file_type.lower() == CSS:
+    cache_key, output = _cached(content, file_type, arguments, **kwargs)
+    if output is not None:
+        metrics.increment('compressor.cache.hit')
+        return output
+    if cache_key is not None:
+        metrics.increment('compressor.cache.miss')
 
-        opts = {
-            'compress': ('--compress' in arguments),
-            'compress_short_colors': 0
-        }
-        if 'load_paths' in kwargs:
-            opts['load_paths'] = kwargs.get('load_paths')
+    returncode, output, stderr = _compress(content, file_type, arguments, **kwargs)
+    if returncode != 0:
+        log.warning('%s compressor exited with %d: %s' % (file_type, returncode, stderr))
 
-        _scss = scss.Scss(scss_opts=opts)
-        output = _scss.compile(content)
+    # a failed run may have written partial output, or (for an image) handed back the input as it was
+    if cache_key is not None and returncode == 0 and output:
+        _asset_cache.set(cache_key, output)
 
-        return output
+    return output
+
+
+def compress_async(content, file_type=None, arguments='', callback=None, **kwargs):
+    """
+    compress() on the io pool: the calling thread never waits on the compressor's pipes
+
+    :param content:
+    :param file_type:
+    :param arguments:
+    :param callback: see offload.submit
+    :param kwargs:
+    :return: an AsyncResult of the output
+    """
+    # css compiles and image optimization run in-process: they are cpu-bound work, not a wait on a pipe
+    pool = offload.cpu_pool() if file_type is not None and (
+        file_type.lower() == CSS or is_image(file_type)) else offload.io_pool()
+    return offload.submit(pool, compress, (content, file_type, arguments), kwargs, callback=callback)
+
+
+def compress_many(items, file_type, arguments='', workers=None, timeout=None, ordered=True, **kwargs):
+    """
+    compress many blobs of the same file type concurrently. js/html jobs run as a bounded number of concurrent
+    java processes (or on the warm worker pool when enabled); css compiles and image optimization run in a process
+    pool.
+
+    :param items: an iterable of contents
+    :param file_type:
+    :param arguments:
+    :param workers: the number of concurrent jobs; defaults to the cpu count
+    :param timeout: seconds allowed per item
+    :param ordered: yield results in input order rather than as they finish
+    :param kwargs: passed to each compress call e.g. load_paths, or quality for jpeg images
+    :return: a generator of CompressResult
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    items = list(items)
+    results = Queue.Queue()
+    pending = []
+
+    for index, content in enumerate(items):
+        cache_key, output = _cached(content, file_type, arguments, **kwargs)
+        if output is not None:
+            results.put(CompressResult(index, output, 0, '', 0.0))
+        else:
+            pending.append((index, content, cache_key))
+
+    if file_type.lower() == CSS:
+        _dispatch_process_pool(_compile_css, pending, arguments, workers, timeout, results, **kwargs)
+    elif is_image(file_type):
+        _dispatch_process_pool(_optimize_image, pending, arguments, workers, timeout, results,
+                               file_type=file_type.lower(), **kwargs)
     else:
-        compressor = _html_compressor_args
-        arguments = '--type=%s %s' % (file_type, arguments)
+        _dispatch_subprocesses(pending, file_type, arguments, workers, timeout, results)
+
+    buffered = {}
+    next_index = 0
+    for _ in xrange(len(items)):
+        result = results.get()
+
+        if result.returncode != 0:
+            log.warning('%s compressor item %d exited with %d: %s' % (
+                file_type, result.index, result.returncode, result.stderr))
+
+        if not ordered:
+            yield result
+            continue
+
+        buffered[result.index] = result
+        while next_index in buffered:
+            yield buffered.pop(next_index)
+            next_index += 1
+
+
+def _store(cache_key, result):
+    if cache_key is not None and result.returncode == 0 and result.output:
+        _asset_cache.set(cache_key, result.output)
+
+
+def _dispatch_subprocesses(pending, file_type, arguments, workers, timeout, results):
+    jobs = Queue.Queue()
+    for job in pending:
+        jobs.put(job)
+
+    def run():
+        while True:
+            try:
+                index, content, cache_key = jobs.get_nowait()
+            except Queue.Empty:
+                return
+
+            start = time.time()
+            try:
+                returncode, output, stderr = _compress(content, file_type, arguments, timeout=timeout)
+            except Exception as e:
+                returncode, output, stderr = 1, '', '%s: %s' % (type(e).__name__, e)
+            result = CompressResult(index, output, returncode, stderr, time.time() - start)
+            _store(cache_key, result)
+            results.put(result)
 
-    command = 'nice %s %s' % (compressor, arguments)
+    for _ in xrange(min(workers, len(pending))):
+        thread = threading.Thread(target=run, name='paste-compress')
+        thread.daemon = True
+        thread.start()
 
-    p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-    p.stdin.write(content)
-    p.stdin.close()
 
-    content = p.stdout.read()
-    p.stdout.close()
+def _dispatch_process_pool(target, pending, arguments, workers, timeout, results, **kwargs):
+    if not pending:
+        return
+
+    process_pool = multiprocessing.Pool(processes=min(workers, len(pending)))
+    async_results = [
+        (index, cache_key, time.time(),
+         process_pool.apply_async(target, (content, arguments), kwargs))
+        for (index, content, cache_key) in pending
+    ]
+    process_pool.close()
+
+    def collect():
+        abandoned = False
+        for index, cache_key, start, async_result in async_results:
+            # results are awaited in submission order, so each wait is bounded by the per-item timeout
+            try:
+                returncode, output, stderr = async_result.get(timeout)
+            except multiprocessing.TimeoutError:
+                returncode, output, stderr = TIMEOUT_RETURNCODE, '', 'timed out after %ss' % timeout
+                abandoned = True
+            result = CompressResult(index, output, returncode, stderr, time.time() - start)
+            _store(cache_key, result)
+            results.put(result)
+
+        if abandoned:
+            process_pool.terminate()
+        process_pool.join()
+
+    thread = threading.Thread(target=collect, name='paste-compress-css')
+    thread.daemon = True
+    thread.start()
+
+
+def _css_compile(content, arguments, load_paths=None, path=None, css_backend=None, **kwargs):
+    return _css_engine.compile(content, compress=('--compress' in arguments), load_paths=load_paths, path=path,
+                               backend=css_backend)
+
+
+def _compile_css(content, arguments, **kwargs):
+    # process pool target: errors are reported like a failed subprocess rather than raised
+    try:
+        return 0, _css_compile(content, arguments, **kwargs), ''
+    except Exception as e:
+        return 1, '', '%s: %s' % (type(e).__name__, e)
+
+
+def _image_optimize(content, file_type=None, quality=None, **kwargs):
+    if file_type == WEBP:
+        # a webp rendition of a png or jpeg
+        output = image_optimizer.to_webp(content, quality=quality or image_optimizer.DEFAULT_WEBP_QUALITY)
+        if output is None:
+            return 1, '', 'no smaller webp rendition'
+        return 0, output, ''
+    try:
+        return 0, image_optimizer.optimize(content, file_type=file_type, quality=quality), ''
+    except image_optimizer.ImageError as e:
+        # an image that can't be optimized is served as it is
+        return 1, content, 'ImageError: %s' % e
+
+
+def _optimize_image(content, arguments, **kwargs):
+    # process pool target, like _compile_css
+    try:
+        return _image_optimize(content, **kwargs)
+    except Exception as e:
+        return 1, content, '%s: %s' % (type(e).__name__, e)
+
+
+def _run_compressor(command, content, timeout=None):
+    """
+
+    :param command: the argument list
+    :param content:
+    :param timeout: seconds before the process is killed
+    :return: (exit status, stdout, stderr)
+    """
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+
+    # a session of its own lets a timeout kill the whole process group, not just `nice`
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+                         preexec_fn=os.setsid if timeout is not None else None)
+
+    timed_out = []
+    timer = None
+    if timeout is not None:
+        def kill():
+            timed_out.append(True)
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+
+    start = time.time()
+    try:
+        # communicate drains stdout and stderr together so a verbose compressor can't fill a pipe and deadlock
+        stdout, stderr = p.communicate(content)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    metrics.timing('compressor.subprocess', time.time() - start)
+
+    if timed_out:
+        metrics.increment('compressor.subprocess.timeouts')
+        return TIMEOUT_RETURNCODE, '', 'timed out after %ss' % timeout
+    return p.returncode, stdout, stderr
+
+
+def _compress(content, file_type, arguments='', timeout=None, **kwargs):
+    if is_image(file_type):
+        with metrics.timer('compressor.image'):
+            return _image_optimize(content, file_type=file_type.lower(), **kwargs)
+    elif file_type.lower() == JS:
+        compressor_jar = _closure_compressor_jar
+        compressor = _closure_compressor_args
+    elif file_type.lower() == CSS:
+        with metrics.timer('compressor.css'):
+            return 0, _css_compile(content, arguments, **kwargs), ''
+    else:
+        compressor_jar = _html_compressor_jar
+        compressor = _html_compressor_args
+        arguments = '--type=%s %s' % (file_type, arguments)
+
+    if worker_pool.enabled():
+        try:
+            with metrics.timer('compressor.worker'):
+                return worker_pool.get_pool(compressor_jar).request(content, arguments, timeout=timeout)
+        except worker_pool.WorkerError as e:
+            if timeout is not None and isinstance(e, worker_pool.WorkerTimeout):
+                # the item has had its time; running it again in a one-off process would double it
+                metrics.increment('compressor.worker.timeouts')
+                return TIMEOUT_RETURNCODE, '', str(e)
+            metrics.increment('compressor.worker.errors')
+            # the worker has been recycled; fall through to a one-off process for this call
+            pass
 
-    return content
\ No newline at end of file
+    return _run_compressor(['nice'] + compressor + shlex.split(arguments), content, timeout=timeout)
@@ -0,0 +1,162 @@
+import os
+import hashlib
+import threading
+
+from ..files import makedirs, write_atomic
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """
+    sha-256 of a file such as a compressor jar, memoized on (path, mtime, size)
+
+    :param path:
+    :return: the hex digest, or the path itself if the file can't be read
+    """
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return path
+
+    memo_key = (path, file_stat.st_mtime, file_stat.st_size)
+    with _file_digests_lock:
+        digest = _file_digests.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _file_digests_lock:
+            _file_digests[memo_key] = digest
+    return digest
+
+
+class CompiledAssetCache(object):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        a content-addressed on-disk cache of compressor output. entries are written atomically and the
+        least recently used are pruned once the directory grows past max_bytes.
+
+        :param directory:
+        :param max_bytes:
+        """
+        super(CompiledAssetCache, self).__init__()
+
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._byte_size = None
+        self._lock = threading.Lock()
+
+        makedirs(self.directory)
+
+    @classmethod
+    def key(cls, content, file_type, arguments='', compressor_digest=''):
+        """
+
+        :param content:
+        :param file_type:
+        :param arguments:
+        :param compressor_digest: identifies the compressor build, e.g. file_digest() of its jar
+        :return:
+        """
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        sha = hashlib.sha256()
+        for part in (hashlib.sha256(content).hexdigest(), file_type.lower(), arguments, compressor_digest):
+            sha.update(part)
+            sha.update('\0')
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+
+        :param key:
+        :return: the cached output or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except IOError:
+            self.misses += 1
+            return None
+
+        # bump the mtime so that pruning evicts the least recently used entries first
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return content
+
+    def set(self, key, content):
+        """
+
+        :param key:
+        :param content:
+        """
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        write_atomic(self._path(key), content)
+
+        with self._lock:
+            if self._byte_size is not None:
+                self._byte_size += len(content)
+            byte_size = self._byte_size
+
+        if byte_size is None or byte_size > self.max_bytes:
+            self.prune()
+
+    def _entries(self):
+        for dir_path, dir_names, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    file_stat = os.stat(path)
+                except OSError:
+                    continue
+                yield file_stat.st_mtime, file_stat.st_size, path
+
+    def prune(self, max_bytes=None):
+        """
+        remove the least recently used entries until the cache fits in max_bytes
+
+        :param max_bytes: defaults to self.max_bytes
+        :return: the number of entries removed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        with self._lock:
+            entries = sorted(self._entries())
+            byte_size = sum(size for (mtime, size, path) in entries)
+
+            removed = 0
+            for mtime, size, path in entries:
+                if byte_size <= max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                byte_size -= size
+                removed += 1
+
+            self._byte_size = byte_size
+        return removed
@@ -0,0 +1,310 @@
+import os
+import re
+import time
+import hashlib
+import threading
+
+import scss
+
+try:
+    import sass
+except ImportError:
+    sass = None
+
+from ..lru import LRUCache
+
+SCSS = 'scss'
+LIBSASS = 'libsass'
+
+DEFAULT_CHECK_INTERVAL = 1.0
+DEFAULT_OUTPUT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# something kept as it is - a comment, a string or a url(), so that the // in url(http://...) doesn't start a line
+# comment - or an @import statement
+_IMPORT_EXPR = re.compile(
+    r'(/\*.*?\*/|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|url\(\s*(?:"[^"]*"|\'[^\']*\'|[^)]*)\)|//[^\n]*)'
+    r'|@import\s+([^;{}]+);',
+    re.S
+)
+_IMPORT_NAME_EXPR = re.compile(r'\s*(?:"([^"]*)"|\'([^\']*)\')\s*$')
+
+
+class CssError(Exception):
+    pass
+
+
+def available_backends():
+    """
+
+    :return: the compiler backends that can be used here
+    """
+    return (SCSS, LIBSASS) if sass is not None else (SCSS,)
+
+
+def _split_imports(arguments):
+    # @import "a", "b"; imports each in turn
+    parts = []
+    current = []
+    quote = None
+    for c in arguments:
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == ',':
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(c)
+    parts.append(''.join(current))
+    return parts
+
+
+def _import_name(argument):
+    """
+
+    :param argument: one import e.g. "mixins" or url(foo.css) screen
+    :return: the name of a sass partial to inline, or None for a plain css import that has to be left as it is
+    """
+    match = _IMPORT_NAME_EXPR.match(argument)
+    if match is None:
+        # url(...), or a quoted name followed by media queries
+        return None
+    name = match.group(1) if match.group(1) is not None else match.group(2)
+    if name.endswith('.css') or name.startswith(('http://', 'https://', '//')):
+        return None
+    return name
+
+
+class _Partial(object):
+    __slots__ = ('path', 'stamp', 'source', 'checked')
+
+    def __init__(self, path):
+        self.path = path
+        self.checked = time.time()
+        with open(path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            self.source = f.read()
+        self.stamp = (file_stat.st_mtime, file_stat.st_size)
+
+
+class CssEngine(object):
+    def __init__(self, backend=SCSS, check_interval=DEFAULT_CHECK_INTERVAL,
+                 output_cache_max_bytes=DEFAULT_OUTPUT_CACHE_MAX_BYTES):
+        """
+        compiles stylesheets with their @imports inlined from a cache of partials, so a shared mixin library is read
+        once rather than once per stylesheet. the partials each stylesheet pulls in are kept as an import graph, and
+        compiled output is reused until one of them changes.
+
+        :param backend: SCSS or, when the libsass bindings are installed, LIBSASS
+        :param check_interval: partials are re-stat'ed at most once per check_interval seconds
+        :param output_cache_max_bytes:
+        """
+        super(CssEngine, self).__init__()
+
+        if backend not in available_backends():
+            raise CssError('css backend %r is not available' % backend)
+
+        self.backend = backend
+        self.check_interval = check_interval
+
+        self._partials = {}
+        # stylesheet key -> the partial paths it imports, transitively
+        self._imports = {}
+        # partial path -> the stylesheet keys that import it
+        self._dependents = {}
+        self._outputs = LRUCache(max_bytes=output_cache_max_bytes, name='css')
+        self._lock = threading.Lock()
+
+    def partial(self, path):
+        """
+
+        :param path:
+        :return: the cached partial, re-read if the file has changed; None if it can't be read
+        """
+        now = time.time()
+        with self._lock:
+            partial = self._partials.get(path)
+
+        if partial is not None and now - partial.checked >= self.check_interval:
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                file_stat = None
+            if file_stat is None or (file_stat.st_mtime, file_stat.st_size) != partial.stamp:
+                partial = None
+            else:
+                partial.checked = now
+
+        if partial is None:
+            try:
+                partial = _Partial(path)
+            except IOError:
+                with self._lock:
+                    self._partials.pop(path, None)
+                return None
+            with self._lock:
+                self._partials[path] = partial
+        return partial
+
+    def resolve(self, name, directories):
+        """
+
+        :param name: an import name e.g. "mixins/buttons"
+        :param directories: searched in order
+        :return: the path of the partial, or None
+        """
+        head, base = os.path.split(name)
+        if base.endswith('.scss'):
+            candidates = [os.path.join(head, '_' + base), name]
+        else:
+            candidates = [os.path.join(head, '_' + base + '.scss'), name + '.scss']
+
+        for directory in directories:
+            for candidate in candidates:
+                path = os.path.abspath(os.path.join(directory, candidate))
+                if path in self._partials or os.path.isfile(path):
+                    return path
+        return None
+
+    def flatten(self, content, load_paths=None, path=None):
+        """
+        inline every sass @import that resolves under load_paths
+
+        :param content:
+        :param load_paths:
+        :param path: the stylesheet's own path, for imports relative to it
+        :return: (source, the imported partial paths in import order, whether any sass import was left unresolved)
+        """
+        imported = []
+        unresolved = []
+
+        def inline(source, directory, stack):
+            directories = ([directory] if directory else []) + list(load_paths or ())
+
+            def replace(match):
+                if match.group(1) is not None:
+                    return match.group(1)
+
+                kept = []
+                parts = []
+                for argument in _split_imports(match.group(2)):
+                    name = _import_name(argument)
+                    partial_path = self.resolve(name, directories) if name is not None else None
+                    partial = self.partial(partial_path) if partial_path is not None else None
+                    if partial is None:
+                        if name is not None:
+                            unresolved.append(name)
+                        kept.append(argument.strip())
+                        continue
+                    if partial_path in stack:
+                        raise CssError('import cycle: %s' % ' -> '.join(stack + [partial_path]))
+                    if partial_path not in imported:
+                        imported.append(partial_path)
+                    parts.append(inline(partial.source, os.path.dirname(partial_path), stack + [partial_path]))
+
+                if kept:
+                    parts.insert(0, '@import %s;' % ', '.join(kept))
+                return '\n'.join(parts)
+
+            return _IMPORT_EXPR.sub(replace, source)
+
+        source = inline(content, os.path.dirname(os.path.abspath(path)) if path else None, [])
+        return source, tuple(imported), bool(unresolved)
+
+    def _fingerprint(self, partial_paths):
+        stamps = []
+        for partial_path in partial_paths:
+            partial = self.partial(partial_path)
+            stamps.append(partial.stamp if partial is not None else None)
+        return tuple(stamps)
+
+    def _key(self, content, compress, load_paths, path, backend):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        return hashlib.sha1('\0'.join([
+            hashlib.sha1(content).hexdigest(), repr(bool(compress)), repr(tuple(load_paths or ())), path or '', backend
+        ])).hexdigest()
+
+    def compile(self, content, compress=False, load_paths=None, path=None, backend=None):
+        """
+
+        :param content: the stylesheet source
+        :param compress: minify the output
+        :param load_paths: where @imports are looked up
+        :param path: the stylesheet's own path, if it has one
+        :param backend: defaults to the engine's backend
+        :return: the compiled css
+        """
+        backend = backend or self.backend
+        key = self._key(content, compress, load_paths, path, backend)
+
+        with self._lock:
+            partial_paths = self._imports.get(key)
+        if partial_paths is not None:
+            output = self._outputs.get(key, fingerprint=self._fingerprint(partial_paths))
+            if output is not None:
+                return output
+
+        source, partial_paths, unresolved = self.flatten(content, load_paths, path)
+        if backend == LIBSASS:
+            if sass is None:
+                raise CssError('css backend %r is not available' % backend)
+            output = sass.compile(string=source, include_paths=list(load_paths or ()),
+                                  output_style='compressed' if compress else 'nested')
+            if isinstance(output, unicode):
+                output = output.encode('utf-8')
+        else:
+            opts = {
+                'compress': compress,
+                'compress_short_colors': 0
+            }
+            if load_paths is not None:
+                opts['load_paths'] = load_paths
+            output = scss.Scss(scss_opts=opts).compile(source)
+
+        with self._lock:
+            for partial_path in self._imports.get(key, ()):
+                self._dependents.get(partial_path, set()).discard(key)
+            self._imports[key] = partial_paths
+            for partial_path in partial_paths:
+                self._dependents.setdefault(partial_path, set()).add(key)
+        # an import that couldn't be resolved has no stamp to fingerprint, and may resolve once the file appears
+        if not unresolved:
+            self._outputs.set(key, output, fingerprint=self._fingerprint(partial_paths))
+        return output
+
+    def dependents(self, path):
+        """
+
+        :param path: a partial
+        :return: the keys of the compiled stylesheets that import path, directly or not
+        """
+        with self._lock:
+            return set(self._dependents.get(os.path.abspath(path), ()))
+
+    def invalidate(self, paths):
+        """
+        forget changed partials straight away rather than at the next check, e.g. from a file watcher
+
+        :param paths:
+        :return: the keys of the stylesheets that will recompile
+        """
+        affected = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            with self._lock:
+                self._partials.pop(path, None)
+                keys = set(self._dependents.get(path, ()))
+            for key in keys:
+                self._outputs.invalidate(key)
+            affected |= keys
+        return affected
+
+    def clear(self):
+        with self._lock:
+            self._partials.clear()
+            self._imports.clear()
+            self._dependents.clear()
+        self._outputs.clear()
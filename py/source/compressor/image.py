@@ -0,0 +1,257 @@
+import zlib
+import struct
+import logging
+import cStringIO
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logging.getLogger('paste')
+
+PNG = 'png'
+JPEG = 'jpg'
+WEBP = 'webp'
+
+FILE_TYPES = (PNG, JPEG, 'jpeg')
+
+DEFAULT_WEBP_QUALITY = 80
+
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+_JPEG_SIGNATURE = '\xff\xd8\xff'
+
+# ancillary chunks that only carry metadata; color, transparency and animation chunks are kept
+_PNG_METADATA_CHUNKS = frozenset(['tEXt', 'zTXt', 'iTXt', 'tIME', 'eXIf', 'dSIG'])
+
+# zlib's Z_RLE, which python 2's zlib module doesn't export
+_Z_RLE = 3
+_DEFLATE_STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, _Z_RLE)
+
+_chunk_header = struct.Struct('>I4s')
+_uint16 = struct.Struct('>H')
+
+_JPEG_APP0, _JPEG_APP1, _JPEG_APP2, _JPEG_APP14 = 0xe0, 0xe1, 0xe2, 0xee
+_JPEG_SOS = 0xda
+_JPEG_COM = 0xfe
+# markers that stand alone, without a length: TEM, RST0-7, SOI, EOI
+_JPEG_STANDALONE = frozenset([0x01] + range(0xd0, 0xda))
+
+
+class ImageError(Exception):
+    pass
+
+
+def sniff(content):
+    """
+
+    :param content:
+    :return: PNG or JPEG by the content's signature, or None for anything else
+    """
+    if content.startswith(_PNG_SIGNATURE):
+        return PNG
+    if content.startswith(_JPEG_SIGNATURE):
+        return JPEG
+    return None
+
+
+def can_encode(file_type):
+    """
+
+    :param file_type: e.g. WEBP
+    :return: whether PIL is installed and was built with an encoder for file_type
+    """
+    if Image is None:
+        return False
+    Image.init()
+    return {JPEG: 'JPEG', WEBP: 'WEBP'}.get(file_type) in Image.SAVE
+
+
+def digest(quality=None):
+    """
+
+    :param quality:
+    :return: identifies the optimizer build and settings, for cache keys
+    """
+    return 'zlib-%s-pil-%s-q%s' % (zlib.ZLIB_VERSION,
+                                   getattr(Image, '__version__', None) or getattr(Image, 'VERSION', ''), quality)
+
+
+def _iter_png_chunks(content):
+    offset = len(_PNG_SIGNATURE)
+    while offset < len(content):
+        if offset + _chunk_header.size > len(content):
+            raise ImageError('truncated png chunk header at %d' % offset)
+        length, chunk_type = _chunk_header.unpack_from(content, offset)
+        data_start = offset + _chunk_header.size
+        data_end = data_start + length
+        if data_end + 4 > len(content):
+            raise ImageError('truncated png %s chunk at %d' % (chunk_type, offset))
+        data = content[data_start:data_end]
+        crc = struct.unpack_from('>I', content, data_end)[0]
+        if zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff != crc:
+            raise ImageError('bad crc in png %s chunk at %d' % (chunk_type, offset))
+        yield chunk_type, data
+        offset = data_end + 4
+        if chunk_type == 'IEND':
+            return
+    raise ImageError('png has no IEND chunk')
+
+
+def _png_chunk(chunk_type, data):
+    return (_chunk_header.pack(len(data), chunk_type) + data +
+            struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+
+def _deflate(raw):
+    smallest = None
+    for strategy in _DEFLATE_STRATEGIES:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS, 9, strategy)
+        compressed = compressor.compress(raw) + compressor.flush()
+        if smallest is None or len(compressed) < len(smallest):
+            smallest = compressed
+    return smallest
+
+
+def optimize_png(content):
+    """
+    lossless: drop metadata chunks and re-deflate the image data with whichever zlib strategy compresses it best.
+    scanline filters are left as they are.
+
+    :param content:
+    :return: the optimized png
+    :raise ImageError: if content isn't a well formed png
+    """
+    chunks = list(_iter_png_chunks(content))
+    idat = ''.join(data for (chunk_type, data) in chunks if chunk_type == 'IDAT')
+    try:
+        deflated = _deflate(zlib.decompress(idat))
+    except zlib.error as e:
+        raise ImageError('corrupt png image data: %s' % e)
+    if len(deflated) >= len(idat):
+        deflated = None
+
+    parts = [_PNG_SIGNATURE]
+    written_idat = False
+    for chunk_type, data in chunks:
+        if chunk_type in _PNG_METADATA_CHUNKS:
+            continue
+        if chunk_type == 'IDAT' and deflated is not None:
+            # the image data is one zlib stream however it was split; it goes back as a single chunk
+            if not written_idat:
+                parts.append(_png_chunk('IDAT', deflated))
+                written_idat = True
+            continue
+        parts.append(_png_chunk(chunk_type, data))
+    return ''.join(parts)
+
+
+def _keep_jpeg_segment(marker, data):
+    if marker == _JPEG_COM:
+        return False
+    if 0xe0 <= marker <= 0xef:
+        # keep JFIF, Exif (its orientation changes how the image is shown), ICC profiles and the Adobe color
+        # transform flag; XMP, Photoshop and the rest are metadata
+        if marker == _JPEG_APP1:
+            return data.startswith('Exif\0')
+        return marker in (_JPEG_APP0, _JPEG_APP2, _JPEG_APP14)
+    return True
+
+
+def strip_jpeg(content):
+    """
+    lossless: drop comment and metadata segments ahead of the scan data
+
+    :param content:
+    :return: the stripped jpeg
+    :raise ImageError: if content isn't a well formed jpeg
+    """
+    parts = [content[:2]]
+    offset = 2
+    while True:
+        # markers may be padded with any number of 0xff fill bytes
+        while offset < len(content) and content[offset] == '\xff':
+            offset += 1
+        if offset >= len(content):
+            raise ImageError('truncated jpeg at %d' % offset)
+        marker = ord(content[offset])
+        offset += 1
+        if marker in _JPEG_STANDALONE:
+            parts.append('\xff' + chr(marker))
+            continue
+        if offset + 2 > len(content):
+            raise ImageError('truncated jpeg segment at %d' % offset)
+        length = _uint16.unpack_from(content, offset)[0]
+        if length < 2 or offset + length > len(content):
+            raise ImageError('bad jpeg segment length at %d' % offset)
+        if marker == _JPEG_SOS:
+            # entropy coded data follows; everything from here on is copied as is
+            parts.append(content[offset - 2:])
+            return ''.join(parts)
+        if _keep_jpeg_segment(marker, content[offset + 2:offset + length]):
+            parts.append(content[offset - 2:offset + length])
+        offset += length
+
+
+def _reencode(content, file_type, quality):
+    source = Image.open(cStringIO.StringIO(content))
+    options = {'quality': quality}
+    for key in ('icc_profile', 'exif'):
+        if source.info.get(key):
+            options[key] = source.info[key]
+    if file_type == JPEG:
+        options.update(optimize=True, progressive=True)
+        if source.mode not in ('RGB', 'L', 'CMYK'):
+            source = source.convert('RGB')
+    elif source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA')
+    output = cStringIO.StringIO()
+    source.save(output, {JPEG: 'JPEG', WEBP: 'WEBP'}[file_type], **options)
+    return output.getvalue()
+
+
+def optimize(content, file_type=None, quality=None):
+    """
+    make an image smaller without changing its format: always losslessly, and for a jpeg also by re-encoding at
+    quality when that is given and PIL is installed. the result is never larger than content.
+
+    :param content:
+    :param file_type: PNG or JPEG; sniffed from content by default
+    :param quality: a jpeg quality (1-95) for lossy re-encoding, or None for lossless only
+    :return: the optimized image, or content itself when it can't be made smaller
+    :raise ImageError: if content isn't a well formed image of file_type
+    """
+    file_type = sniff(content) if file_type is None else (JPEG if file_type == 'jpeg' else file_type)
+    if file_type == PNG:
+        output = optimize_png(content)
+    elif file_type == JPEG:
+        output = strip_jpeg(content)
+        if quality is not None and can_encode(JPEG):
+            try:
+                reencoded = _reencode(content, JPEG, quality)
+            except Exception as e:
+                log.warning('could not re-encode jpeg: %s' % e)
+            else:
+                if len(reencoded) < len(output):
+                    output = reencoded
+    else:
+        raise ImageError('unsupported image type %r' % file_type)
+    return output if len(output) < len(content) else content
+
+
+def to_webp(content, quality=DEFAULT_WEBP_QUALITY):
+    """
+    a lossy webp rendition of an image, for clients that accept image/webp
+
+    :param content:
+    :param quality:
+    :return: the webp image, or None when PIL can't encode webp here or the result wouldn't be smaller
+    """
+    if not can_encode(WEBP):
+        return None
+    try:
+        output = _reencode(content, WEBP, quality)
+    except Exception as e:
+        log.warning('could not encode webp: %s' % e)
+        return None
+    return output if len(output) < len(content) else None
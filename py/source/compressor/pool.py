@@ -0,0 +1,333 @@
+import os
+import re
+import time
+import shlex
+import struct
+import select
+import atexit
+import logging
+import threading
+import subprocess
+import Queue
+
+log = logging.getLogger('paste')
+
+_compressor_dir = os.path.dirname(os.path.abspath(__file__))
+
+SHIM_CLASS = 'PasteCompressorWorker'
+DEFAULT_TIMEOUT = 60
+
+_int_struct = struct.Struct('>i')
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerTimeout(WorkerError):
+    pass
+
+
+def build_shim():
+    """
+    compile the java worker shim next to this module if it hasn't been already
+
+    :return: True if the shim class is available
+    """
+    if os.path.exists(os.path.join(_compressor_dir, SHIM_CLASS + '.class')):
+        return True
+
+    try:
+        subprocess.check_call(['javac', '-nowarn', '-d', _compressor_dir,
+                               os.path.join(_compressor_dir, SHIM_CLASS + '.java')])
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.warning('unable to build the compressor worker shim: %s' % e)
+        return False
+    return True
+
+
+_java_options = None
+
+
+def _java_command(jar):
+    global _java_options
+    if _java_options is None:
+        # the shim traps System.exit() with a SecurityManager, which must be explicitly allowed from java 12 on
+        try:
+            version_output = subprocess.Popen(['java', '-version'], stderr=subprocess.PIPE).communicate()[1]
+        except OSError:
+            version_output = ''
+        version_match = re.search(r'version "(?:1\.)?(?P<major>[0-9]+)', version_output)
+        major = int(version_match.group('major')) if version_match else 0
+        _java_options = ['-Djava.security.manager=allow'] if major >= 12 else []
+    return ['nice', 'java'] + _java_options + ['-cp', _compressor_dir, SHIM_CLASS, jar]
+
+
+class _Worker(object):
+    def __init__(self, jar):
+        super(_Worker, self).__init__()
+
+        self.jar = jar
+        self.requests = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+
+        with open(os.devnull, 'wb') as devnull:
+            self.process = subprocess.Popen(_java_command(jar), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=devnull)
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def _read_exact(self, size, deadline):
+        fd = self.process.stdout.fileno()
+        chunks = []
+        remaining = size
+        while remaining:
+            timeout = deadline - time.time()
+            if timeout <= 0 or not select.select([fd], [], [], timeout)[0]:
+                raise WorkerTimeout('compressor worker %d timed out' % self.pid)
+            chunk = os.read(fd, remaining)
+            if not chunk:
+                raise WorkerError('compressor worker %d exited with %r' % (self.pid, self.process.poll()))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return ''.join(chunks)
+
+    def _read_int(self, deadline):
+        return _int_struct.unpack(self._read_exact(_int_struct.size, deadline))[0]
+
+    def request(self, arguments, content, timeout):
+        """
+
+        :param arguments: the compressor's command line arguments as a list
+        :param content:
+        :param timeout: seconds
+        :return: (exit status, stdout, stderr)
+        """
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        arg_bytes = '\0'.join(arguments)
+
+        start = time.time()
+        try:
+            self.process.stdin.write(''.join([
+                _int_struct.pack(len(arg_bytes)), arg_bytes, _int_struct.pack(len(content)), content
+            ]))
+            self.process.stdin.flush()
+        except (IOError, OSError) as e:
+            raise WorkerError('compressor worker %d: %s' % (self.pid, e))
+
+        deadline = start + timeout
+        status = self._read_int(deadline)
+        stdout = self._read_exact(self._read_int(deadline), deadline)
+        stderr = self._read_exact(self._read_int(deadline), deadline)
+
+        elapsed = time.time() - start
+        self.requests += 1
+        self.total_seconds += elapsed
+        self.last_seconds = elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+        return status, stdout, stderr
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+        self.process.wait()
+
+    @property
+    def stats(self):
+        """
+
+
+        :return:
+        """
+        return {
+            'pid': self.pid,
+            'jar': os.path.basename(self.jar),
+            'requests': self.requests,
+            'mean_seconds': (self.total_seconds / self.requests) if self.requests else 0.0,
+            'max_seconds': self.max_seconds,
+            'last_seconds': self.last_seconds,
+        }
+
+
+class WorkerPool(object):
+    def __init__(self, jar, size=2, timeout=DEFAULT_TIMEOUT):
+        """
+        a pool of warm JVMs running a single compressor jar. workers are started on demand and replaced after a
+        crash or timeout.
+
+        :param jar:
+        :param size:
+        :param timeout: seconds allowed per request
+        """
+        super(WorkerPool, self).__init__()
+
+        self.jar = jar
+        self.size = size
+        self.timeout = timeout
+        self.recycled = 0
+
+        self._idle = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except Queue.Empty:
+                pass
+
+            with self._lock:
+                if len(self._workers) < self.size:
+                    try:
+                        worker = _Worker(self.jar)
+                    except OSError as e:
+                        raise WorkerError('unable to start a compressor worker: %s' % e)
+                    self._workers.append(worker)
+                    return worker
+
+            # wake up periodically in case a recycled worker freed a slot
+            try:
+                return self._idle.get(timeout=1)
+            except Queue.Empty:
+                continue
+
+    def _discard(self, worker):
+        worker.close()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self.recycled += 1
+
+    def request(self, content, arguments='', timeout=None):
+        """
+
+        :param content:
+        :param arguments: the compressor's command line arguments as a string
+        :param timeout: seconds allowed for this request; defaults to the pool's timeout
+        :return: (exit status, stdout, stderr)
+        :raise: WorkerError if the worker crashed or timed out; it is replaced on the next call
+        """
+        worker = self._acquire()
+        try:
+            result = worker.request(shlex.split(arguments), content, self.timeout if timeout is None else timeout)
+        except WorkerError as e:
+            log.warning('recycling compressor worker: %s' % e)
+            self._discard(worker)
+            raise
+
+        if self._closed:
+            worker.close()
+        else:
+            self._idle.put(worker)
+        return result
+
+    def compress(self, content, arguments=''):
+        """
+
+        :param content:
+        :param arguments: the compressor's command line arguments as a string
+        :return: the compressor's stdout
+        :raise: WorkerError if the worker crashed or timed out; it is replaced on the next call
+        """
+        status, stdout, stderr = self.request(content, arguments)
+        if status != 0:
+            log.warning('%s exited with %d: %s' % (os.path.basename(self.jar), status, stderr))
+        return stdout
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+    @property
+    def stats(self):
+        """
+
+
+        :return:
+        """
+        with self._lock:
+            workers = list(self._workers)
+        return {
+            'jar': os.path.basename(self.jar),
+            'size': self.size,
+            'recycled': self.recycled,
+            'workers': [worker.stats for worker in workers],
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pool_size = 0
+_pool_timeout = DEFAULT_TIMEOUT
+
+
+def configure(size, timeout=DEFAULT_TIMEOUT):
+    """
+    set the number of warm workers per compressor jar; a size of 0 disables the pool
+
+    :param size:
+    :param timeout: seconds allowed per request
+    :return: True if the pool is enabled
+    """
+    global _pool_size, _pool_timeout
+    close()
+    _pool_timeout = timeout
+    _pool_size = size if size and build_shim() else 0
+    return bool(_pool_size)
+
+
+def enabled():
+    return _pool_size > 0
+
+
+def get_pool(jar):
+    """
+
+    :param jar:
+    :return:
+    """
+    with _pools_lock:
+        pool = _pools.get(jar)
+        if pool is None:
+            pool = _pools[jar] = WorkerPool(jar, size=_pool_size, timeout=_pool_timeout)
+    return pool
+
+
+def stats():
+    """
+
+
+    :return: stats for each pool, including per-worker latency
+    """
+    with _pools_lock:
+        pools = _pools.values()
+    return [pool.stats for pool in pools]
+
+
+def close():
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close)
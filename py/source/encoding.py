@@ -0,0 +1,186 @@
+import zlib
+import gzip
+import StringIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ..core.runtime import Runtime
+env = Runtime.get().env
+
+IDENTITY = 'identity'
+BROTLI = 'br'
+ZSTD = 'zstd'
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+
+DEFAULT_COMPRESSION_LEVEL = 9
+DEFAULT_BROTLI_QUALITY = 11
+DEFAULT_ZSTD_LEVEL = 19
+
+
+def compression_level(encoding):
+    """
+
+    :param encoding:
+    :return: the configured level for encoding
+    """
+    if encoding == BROTLI:
+        return getattr(env, 'brotli_quality', DEFAULT_BROTLI_QUALITY)
+    elif encoding == ZSTD:
+        return getattr(env, 'zstd_level', DEFAULT_ZSTD_LEVEL)
+    return getattr(env, 'compression_level', DEFAULT_COMPRESSION_LEVEL)
+
+
+def _deflate(response_body, level):
+    # raw deflate stream: strip the zlib header and adler32 trailer
+    return zlib.compress(response_body, level)[2:-4]
+
+
+def _gzip(response_body, level):
+    file_obj = StringIO.StringIO()
+    # a fixed mtime keeps the output byte-identical across builds
+    gzipped_file = gzip.GzipFile(fileobj=file_obj, mode='wb', compresslevel=level, mtime=0)
+    gzipped_file.write(response_body)
+    gzipped_file.close()
+    return file_obj.getvalue()
+
+
+def _brotli(response_body, level):
+    return brotli.compress(response_body, quality=level)
+
+
+def _zstd(response_body, level):
+    return zstandard.ZstdCompressor(level=level).compress(response_body)
+
+
+ENCODERS = {
+    DEFLATE: _deflate,
+    GZIP: _gzip,
+}
+if brotli is not None:
+    ENCODERS[BROTLI] = _brotli
+if zstandard is not None:
+    ENCODERS[ZSTD] = _zstd
+
+# the server's preference when the client weighs several encodings equally
+SERVER_PREFERENCE = tuple(encoding for encoding in (BROTLI, ZSTD, GZIP, DEFLATE) if encoding in ENCODERS)
+
+
+def encode(response_body, encoding, level=None):
+    """
+
+    :param response_body:
+    :param encoding:
+    :param level: defaults to the configured level for encoding
+    :return:
+    """
+    return ENCODERS[encoding](response_body, compression_level(encoding) if level is None else level)
+
+
+class _BrotliCompressor(object):
+    def __init__(self, level):
+        super(_BrotliCompressor, self).__init__()
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compressor(encoding, level=None):
+    """
+    an incremental compressor with the compress(data)/flush() interface of zlib.compressobj; the concatenated output
+    is a complete body in encoding
+
+    :param encoding:
+    :param level: defaults to the configured level for encoding
+    :return:
+    """
+    if encoding not in ENCODERS:
+        raise KeyError(encoding)
+    if level is None:
+        level = compression_level(encoding)
+
+    if encoding == DEFLATE:
+        return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    elif encoding == GZIP:
+        # a 16 + window bits zlib stream is framed as gzip, with a zero mtime in its header
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == BROTLI:
+        return _BrotliCompressor(level)
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def parse_accept_encoding(accept_encoding):
+    """
+    parse an Accept-Encoding header into a dict of coding -> q-value. malformed q-values are treated as 0.
+
+    :param accept_encoding:
+    :return:
+    """
+    q_values = {}
+    for part in (accept_encoding or '').split(','):
+        params = part.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = min(max(float(value.strip()), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+
+        # x-gzip is an alias of gzip (rfc 7230 section 4.2.3)
+        if coding == 'x-gzip':
+            coding = GZIP
+        q_values[coding] = max(q, q_values.get(coding, 0.0))
+    return q_values
+
+
+def negotiate_encoding(accept_encoding, available=None):
+    """
+    pick the content coding to respond with. the highest client q-value wins and ties go to the server preference.
+
+    :param accept_encoding:
+    :param available: the encodings to consider, in server preference order; defaults to SERVER_PREFERENCE
+    :return: the chosen encoding, or None to respond with the identity encoding
+    """
+    q_values = parse_accept_encoding(accept_encoding)
+    if not q_values:
+        return None
+
+    wildcard_q = q_values.get('*')
+    best_encoding, best_q = None, 0.0
+    for encoding in (SERVER_PREFERENCE if available is None else available):
+        q = q_values.get(encoding, wildcard_q or 0.0)
+        if q > best_q:
+            best_encoding, best_q = encoding, q
+    return best_encoding
+
+
+def identity_acceptable(accept_encoding):
+    """
+    rfc 7231 section 5.3.4: identity is acceptable unless it, or a wildcard without an explicit identity entry,
+    is given a q-value of 0
+
+    :param accept_encoding:
+    :return:
+    """
+    q_values = parse_accept_encoding(accept_encoding)
+    if IDENTITY in q_values:
+        return q_values[IDENTITY] > 0
+    return q_values.get('*', 1.0) > 0
@@ -0,0 +1,55 @@
+import os
+import errno
+import tempfile
+
+
+def _umask():
+    # the umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# mkstemp creates files that only their owner can read; written files get the mode that open() would have given them
+FILE_MODE = 0666 & ~_umask()
+
+
+def makedirs(directory):
+    """
+    os.makedirs that doesn't mind the directory existing already, or another process creating it concurrently
+
+    :param directory:
+    """
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def write_atomic(path, content, fsync=False, prefix='.tmp-'):
+    """
+    write content to a temporary file next to path and rename it into place, so that readers see either the
+    previous file or the whole new one, never a partial write. the directory is created if it's missing.
+
+    :param path:
+    :param content:
+    :param fsync: flush the file to disk before it is renamed into place
+    :param prefix: of the temporary file's name, so that directory walks can skip writes in flight
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=prefix)
+    try:
+        os.fchmod(fd, FILE_MODE)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
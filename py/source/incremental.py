@@ -0,0 +1,285 @@
+import os
+import logging
+import itertools
+import threading
+
+log = logging.getLogger('paste')
+
+from .watcher import create_watcher
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+_generations = itertools.count(1)
+
+
+class ModuleEntry(object):
+    def __init__(self, name, path, version, last_modified, byte_size, dependencies, removed=False,
+                 serialized_versions=()):
+        """
+        an immutable manifest entry with the interface Jammer reads from primer manifest modules
+
+        :param name:
+        :param path:
+        :param version:
+        :param last_modified:
+        :param byte_size:
+        :param dependencies:
+        :param removed:
+        :param serialized_versions: dicts of earlier versions, most recent first
+        """
+        super(ModuleEntry, self).__init__()
+
+        self.name = name
+        self.path = path
+        self.version = version
+        self.last_modified = last_modified
+        self.byte_size = byte_size
+        self.dependencies = tuple(dependencies)
+        self.removed = removed
+        self.serialized_versions = tuple(serialized_versions)
+
+    @classmethod
+    def from_module(cls, module):
+        """
+
+        :param module: a primer manifest module
+        :return:
+        """
+        return cls(module.name, module.path, module.version, module.last_modified, module.byte_size,
+                   module.dependencies, removed=module.removed, serialized_versions=module.serialized_versions)
+
+    def serialize(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'last_modified': self.last_modified,
+            'byte_size': self.byte_size,
+        }
+
+    def deserialize(self, serialized_version):
+        """
+
+        :param serialized_version:
+        :return: the entry as it was at serialized_version
+        """
+        return ModuleEntry(self.name, serialized_version.get('path', self.path), serialized_version.get('version'),
+                           serialized_version.get('last_modified'),
+                           serialized_version.get('byte_size', self.byte_size), self.dependencies)
+
+    def replace(self, **changes):
+        """
+
+        :param changes:
+        :return: a copy of the entry with changes applied
+        """
+        fields = dict(name=self.name, path=self.path, version=self.version, last_modified=self.last_modified,
+                      byte_size=self.byte_size, dependencies=self.dependencies, removed=self.removed,
+                      serialized_versions=self.serialized_versions)
+        fields.update(changes)
+        return ModuleEntry(**fields)
+
+
+class ManifestGeneration(object):
+    def __init__(self, content_type, manifest, sorted_names, primer, generation=None):
+        """
+        one immutable generation of a content type manifest. it stands in for manifest.get_content_type_manifest()
+        wherever Jammer reads the manifest.
+
+        :param content_type:
+        :param manifest: name -> ModuleEntry
+        :param sorted_names: module names in dependency order
+        :param primer:
+        :param generation:
+        """
+        super(ManifestGeneration, self).__init__()
+
+        self.content_type = content_type
+        self.manifest = manifest
+        self.sorted_deps = [(name, manifest[name].path, manifest[name].version) for name in sorted_names]
+        self.primer = primer
+        self.generation = next(_generations) if generation is None else generation
+
+
+class IncrementalManifest(object):
+    def __init__(self, content_type_manifest, content_type=None, watcher=None, rebuild_module=None, archive=None):
+        """
+        keeps a manifest current from file changes: only the changed modules and their reverse dependents are
+        recomputed, and each round of changes is published as a new ManifestGeneration by swapping one reference.
+
+        :param content_type_manifest: the manifest to start from
+        :param content_type:
+        :param watcher: defaults to create_watcher() over the module paths
+        :param rebuild_module: optional callable(entry) -> ModuleEntry that re-primes a changed module, e.g. to pick
+            up new dependencies; by default only last_modified and byte_size are refreshed from the file
+        :param archive: an optional PrimedArchive that each published version is archived in, so that it can still be
+            served after it has been superseded
+        """
+        super(IncrementalManifest, self).__init__()
+
+        self.content_type = content_type
+        self.rebuild_module = rebuild_module
+        self.archive = archive
+
+        manifest = dict(
+            (name, ModuleEntry.from_module(content_type_manifest.manifest[name]))
+            for (name, path, version) in content_type_manifest.sorted_deps
+        )
+        self.current = ManifestGeneration(content_type, manifest,
+                                          [name for (name, path, version) in content_type_manifest.sorted_deps],
+                                          content_type_manifest.primer)
+
+        self._paths = dict((os.path.abspath(entry.path), name) for (name, entry) in manifest.iteritems())
+        self._dependents = self._reverse_dependencies(manifest)
+        self.watcher = watcher if watcher is not None else create_watcher(self._paths.keys())
+
+        if self.archive is not None:
+            self.archive.archive_manifest(self.current)
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def _reverse_dependencies(cls, manifest):
+        dependents = dict((name, set()) for name in manifest)
+        for name, entry in manifest.iteritems():
+            for dependency_name in entry.dependencies:
+                if dependency_name in dependents:
+                    dependents[dependency_name].add(name)
+        return dependents
+
+    def _affected(self, names):
+        affected = set(names)
+        pending = list(names)
+        while pending:
+            for dependent_name in self._dependents.get(pending.pop(), ()):
+                if dependent_name not in affected:
+                    affected.add(dependent_name)
+                    pending.append(dependent_name)
+        return affected
+
+    @classmethod
+    def _bump(cls, entry, **changes):
+        version = float(entry.version or 0) + 1
+        return entry.replace(
+            version=('%.1f' % version) if isinstance(entry.version, basestring) else version,
+            serialized_versions=(entry.serialize(),) + entry.serialized_versions,
+            **changes
+        )
+
+    def apply(self, changed_paths):
+        """
+        recompute the modules at changed_paths and everything that depends on them, and publish the result
+
+        :param changed_paths:
+        :return: the names of the modules whose version was bumped
+        """
+        changed_names = set(self._paths[path] for path in (os.path.abspath(p) for p in changed_paths)
+                            if path in self._paths)
+        if not changed_names:
+            return set()
+
+        with self._lock:
+            previous = self.current
+            manifest = dict(previous.manifest)
+
+            for name in changed_names:
+                entry = manifest[name]
+                try:
+                    file_stat = os.stat(entry.path)
+                except OSError:
+                    manifest[name] = self._bump(entry, removed=True)
+                    continue
+
+                entry = self._bump(entry, last_modified=int(file_stat.st_mtime), byte_size=file_stat.st_size,
+                                   removed=False)
+                if self.rebuild_module is not None:
+                    entry = self.rebuild_module(entry)
+                manifest[name] = entry
+
+            if self.rebuild_module is not None:
+                # a rebuilt module may have new dependencies
+                self._dependents = self._reverse_dependencies(manifest)
+
+            affected = self._affected(changed_names)
+            for name in affected - changed_names:
+                entry = manifest[name]
+                last_modified = max([entry.last_modified] + [
+                    manifest[dependency_name].last_modified for dependency_name in entry.dependencies
+                    if dependency_name in manifest
+                ])
+                manifest[name] = self._bump(entry, last_modified=last_modified)
+
+            self.current = ManifestGeneration(self.content_type, manifest,
+                                              [name for (name, path, version) in previous.sorted_deps],
+                                              previous.primer)
+
+        if self.archive is not None:
+            self.archive.archive_manifest(self.current, names=affected)
+
+        log.debug('published manifest generation %d: %d changed, %d affected' % (
+            self.current.generation, len(changed_names), len(affected)))
+        return affected
+
+    def poll(self):
+        """
+        apply whatever the watcher has seen since the last poll
+
+        :return: the names of the modules whose version was bumped
+        """
+        return self.apply(self.watcher.poll())
+
+    def start(self, interval=DEFAULT_POLL_INTERVAL):
+        """
+        poll the watcher from a daemon thread
+
+        :param interval: seconds between polls
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    self.poll()
+                except Exception:
+                    log.exception('incremental manifest update failed')
+                self._stopped.wait(interval)
+
+        self._thread = threading.Thread(target=run, name='paste-manifest-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.watcher.close()
+
+
+_published = {}
+
+
+def publish(content_type, incremental_manifest):
+    """
+    make Jammer read content_type's manifest from incremental_manifest's current generation
+
+    :param content_type:
+    :param incremental_manifest: an IncrementalManifest, or anything else with a current generation e.g. a
+        snapshot.SnapshotFile; None goes back to the primer manifest
+    """
+    if incremental_manifest is None:
+        _published.pop(content_type, None)
+    else:
+        _published[content_type] = incremental_manifest
+
+
+def get_content_type_manifest(content_type):
+    """
+
+    :param content_type:
+    :return: the current generation for content_type, or None when it isn't published
+    """
+    incremental_manifest = _published.get(content_type)
+    return incremental_manifest.current if incremental_manifest is not None else None
@@ -0,0 +1,323 @@
+import re
+import base64
+import binascii
+import hashlib
+import itertools
+import threading
+import collections
+
+_generations = itertools.count(1)
+
+# a pre-deserialized manifest entry for one version of a module
+VersionRecord = collections.namedtuple('VersionRecord', ['path', 'last_modified', 'byte_size'])
+
+
+# separates the rank layout tag from the bits in a loaded bitset token
+LOADED_BITS_SEPARATOR = '.'
+
+# b64decode skips characters outside the alphabet rather than failing on them
+_ENCODED_BITS_EXPR = re.compile(r'^[A-Za-z0-9_-]*\Z')
+
+
+def encode_bits(bits):
+    """
+    the compact wire form of a bitset: urlsafe base64, unpadded, of its bytes lowest rank first, so that byte i holds
+    ranks 8i to 8i + 7 (least significant bit first)
+
+    :param bits:
+    :return:
+    """
+    if not bits:
+        return ''
+    hex_digits = '%x' % bits
+    if len(hex_digits) % 2:
+        hex_digits = '0' + hex_digits
+    return base64.urlsafe_b64encode(binascii.unhexlify(hex_digits)[::-1]).rstrip('=')
+
+
+def decode_bits(encoded):
+    """
+
+    :param encoded: from encode_bits
+    :return: the bitset
+    :raise ValueError: if encoded isn't a bitset
+    """
+    if not encoded:
+        return 0
+    if not _ENCODED_BITS_EXPR.match(encoded):
+        raise ValueError('malformed bitset: %r' % encoded)
+    try:
+        data = base64.urlsafe_b64decode(str(encoded) + '=' * (-len(encoded) % 4))
+    except (TypeError, binascii.Error) as e:
+        raise ValueError('malformed bitset: %s' % e)
+    return int(binascii.hexlify(data[::-1]), 16) if data else 0
+
+
+def iter_bits(bits):
+    """
+    yield the position of each set bit, lowest first
+
+    :param bits:
+    :return:
+    """
+    # scanning the binary string is far cheaper than repeated big-int masking on wide bitsets
+    binary = bin(bits)[:1:-1]
+    position = binary.find('1')
+    while position != -1:
+        yield position
+        position = binary.find('1', position + 1)
+
+
+class DependencyIndex(object):
+    def __init__(self, content_type_manifest):
+        """
+        a read-only index over one generation of a content type manifest. each module is identified by its rank in
+        sorted_deps, and sets of modules are ints used as bitsets of ranks, so resolving a request is a union of
+        precomputed closures and ordering is a walk over the set bits.
+
+        :param content_type_manifest:
+        """
+        super(DependencyIndex, self).__init__()
+
+        self.generation = next(_generations)
+        self.sorted_deps = content_type_manifest.sorted_deps
+        self.names = tuple(name for (name, path, version) in self.sorted_deps)
+        self.versions = tuple(float(version) if version else None for (name, path, version) in self.sorted_deps)
+        self.ranks = dict((name, rank) for (rank, name) in enumerate(self.names))
+
+        self.closures = self._build_closures(content_type_manifest)
+        self._trie = self._build_trie()
+        self._rank_tag = None
+        self.version_records = self._build_version_records(content_type_manifest)
+
+    def _build_closures(self, content_type_manifest):
+        if hasattr(content_type_manifest, 'direct_ranks'):
+            # a manifest snapshot stores its adjacency lists as ranks already
+            direct_ranks = content_type_manifest.direct_ranks()
+        else:
+            manifest = content_type_manifest.manifest
+            direct_ranks = []
+            for name in self.names:
+                module = manifest.get(name)
+                direct_ranks.append([
+                    self.ranks[dependency_name]
+                    for dependency_name in (module.dependencies if module is not None else ())
+                    if dependency_name in self.ranks
+                ])
+
+        # sorted_deps puts dependencies first, so one pass in rank order normally reaches the fixed point. further
+        # passes only happen when the manifest order disagrees with the graph.
+        closures = [1 << rank for rank in xrange(len(self.names))]
+        changed = True
+        while changed:
+            changed = False
+            for rank, dependency_ranks in enumerate(direct_ranks):
+                bits = closures[rank]
+                for dependency_rank in dependency_ranks:
+                    bits |= closures[dependency_rank]
+                if bits != closures[rank]:
+                    closures[rank] = bits
+                    changed = True
+        return tuple(closures)
+
+    def _build_version_records(self, content_type_manifest):
+        # (name, version) -> VersionRecord, for every version in each module's history
+        records = {}
+        if hasattr(content_type_manifest, 'iter_history'):
+            # a manifest snapshot reads its history in one pass, without building the modules
+            for (rank, version, path, last_modified, byte_size) in content_type_manifest.iter_history():
+                try:
+                    version = float(version)
+                except (TypeError, ValueError):
+                    continue
+                records.setdefault((self.names[rank], version), VersionRecord(path, last_modified, byte_size))
+            return records
+
+        manifest = content_type_manifest.manifest
+        for name in self.names:
+            module = manifest.get(name)
+            if module is None:
+                continue
+            for serialized_version in module.serialized_versions:
+                try:
+                    version = float(serialized_version.get('version'))
+                except (TypeError, ValueError):
+                    continue
+                # the first entry for a version wins, as with a scan
+                records.setdefault((name, version), VersionRecord(
+                    serialized_version.get('path', module.path),
+                    serialized_version.get('last_modified'),
+                    serialized_version.get('byte_size', module.byte_size)
+                ))
+        return records
+
+    def _build_trie(self):
+        # each node is [subtree bits, children by name segment]
+        root = [0, {}]
+        for rank, name in enumerate(self.names):
+            node = root
+            for segment in name.split('.'):
+                node = node[1].setdefault(segment, [0, {}])
+                node[0] |= 1 << rank
+        return root
+
+    @property
+    def rank_tag(self):
+        """
+        identifies the rank layout, i.e. the module names in order. unlike generation it is the same in every process
+        and across manifest versions that only bump module versions, so a client's loaded bitset stays valid until
+        modules are added, removed or reordered.
+
+        :return:
+        """
+        if self._rank_tag is None:
+            self._rank_tag = hashlib.sha1('\n'.join(self.names)).hexdigest()[:12]
+        return self._rank_tag
+
+    def encode_loaded(self, bits):
+        """
+
+        :param bits:
+        :return: a token for the client to send back with its next request, e.g. to Jammer.jam_filter_loaded_bits
+        """
+        return self.rank_tag + LOADED_BITS_SEPARATOR + encode_bits(bits)
+
+    def decode_loaded(self, token):
+        """
+
+        :param token: from encode_loaded
+        :return: the bitset, or None when the token is malformed or was encoded against another rank layout
+        """
+        tag, separator, encoded = (token or '').partition(LOADED_BITS_SEPARATOR)
+        if not separator or tag != self.rank_tag:
+            return None
+        try:
+            bits = decode_bits(encoded)
+        except ValueError:
+            return None
+        # ignore bits past the last rank
+        return bits & ((1 << len(self.names)) - 1)
+
+    def rank(self, name):
+        """
+
+        :param name:
+        :return: the module's rank, or None if it isn't in the manifest
+        """
+        return self.ranks.get(name)
+
+    def bits(self, names):
+        """
+
+        :param names:
+        :return: the bitset of the ranked modules among names
+        """
+        bits = 0
+        for name in names:
+            rank = self.ranks.get(name)
+            if rank is not None:
+                bits |= 1 << rank
+        return bits
+
+    def closure_bits(self, names):
+        """
+
+        :param names:
+        :return: the bitset of names and everything they depend on
+        """
+        bits = 0
+        for name in names:
+            rank = self.ranks.get(name)
+            if rank is not None:
+                bits |= self.closures[rank]
+        return bits
+
+    def star_bits(self, prefix):
+        """
+
+        :param prefix: a namespace e.g. 'paste' for the token 'paste.*'
+        :return: the bitset of prefix and every module under it
+        """
+        node = self._trie
+        for segment in prefix.split('.'):
+            node = node[1].get(segment)
+            if node is None:
+                return 0
+        return node[0]
+
+    def expand_star(self, prefix):
+        """
+
+        :param prefix:
+        :return: prefix and the modules under it, in manifest order
+        """
+        return self.names_from_bits(self.star_bits(prefix))
+
+    def names_from_bits(self, bits):
+        """
+
+        :param bits:
+        :return: the names in bits, in manifest order
+        """
+        return [self.names[rank] for rank in iter_bits(bits)]
+
+    def sorted_ranks(self, names):
+        """
+
+        :param names:
+        :return: the ranks of the ranked names among names, ascending i.e. in manifest order
+        """
+        ranks = self.ranks
+        return sorted(ranks[name] for name in names if name in ranks)
+
+    def sort_names(self, names):
+        """
+
+        :param names:
+        :return: the ranked names among names, in manifest order
+        """
+        return [self.names[rank] for rank in self.sorted_ranks(names)]
+
+    def version_record(self, name, version):
+        """
+
+        :param name:
+        :param version: a float, as parsed from a uri
+        :return: the VersionRecord of an earlier version of the module, or None
+        """
+        return self.version_records.get((name, version))
+
+    def is_current(self, name, version):
+        """
+
+        :param name:
+        :param version:
+        :return: whether version is the module's version in this generation
+        """
+        rank = self.ranks.get(name)
+        return rank is not None and self.versions[rank] == version
+
+
+_MAX_INDEXES = 32
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dependency_index(content_type_manifest):
+    """
+    the index for a manifest, built once per manifest generation
+
+    :param content_type_manifest:
+    :return:
+    """
+    key = id(content_type_manifest)
+    index = _indexes.get(key)
+    # a new generation replaces sorted_deps; holding the old list keeps its id from being reused
+    if index is None or index.sorted_deps is not content_type_manifest.sorted_deps:
+        index = DependencyIndex(content_type_manifest)
+        with _indexes_lock:
+            if len(_indexes) >= _MAX_INDEXES:
+                _indexes.clear()
+            _indexes[key] = index
+    return index
@@ -3,11 +3,15 @@ import os
 import re
 import stat
 import sys
+import time
 
 sys.path.append(os.path.normpath(os.path.dirname(os.path.abspath(__file__)) + "/..") + os.sep)
 
+import json
 import optparse
 import types
+import collections
+from multiprocessing.pool import ThreadPool
 
 import logging
 
@@ -20,10 +24,58 @@ env = Runtime.get().env
 
 from ..core import manifest
 
+from . import incremental
+
+from .cache import LRUCache, bundle_cache, shared_bundle_cache, delta_cache
+from .index import get_dependency_index, iter_bits
+from . import planner
+from .mapped import MappedFileCache, DEFAULT_MAX_HANDLES
+from .archive import PrimedArchive
+from .files import write_atomic
+from .snapshot import write_snapshot
+from .speed import Speed
+from . import encoding as content_encoding
+from . import metrics
+from . import offload
+
 DEBUG_LAST_MODIFIED_URI = ''
 TIMESTAMP_EXPR = re.compile(r'^[' + DEBUG_LAST_MODIFIED_URI + r'require0-9]+/')
 VERSION_PREFIX = '+v'
 
+DEFAULT_RESOLUTION_CACHE_MAX_ENTRIES = 1024
+
+# capped by a number of resolved request paths rather than bytes
+resolution_cache = LRUCache(
+    max_entries=getattr(env, 'resolution_cache_max_entries', DEFAULT_RESOLUTION_CACHE_MAX_ENTRIES),
+    name='resolution'
+)
+metrics.register_cache(resolution_cache)
+
+# primed files are memory mapped only when the primer can say where a module's primed file lives
+mapped_files = MappedFileCache(
+    max_handles=getattr(env, 'mapped_file_handles', DEFAULT_MAX_HANDLES)
+) if getattr(env, 'mmap_primed_files', False) else None
+
+# with an archive, a uri pinned to an earlier module version is served that version's primed content
+primed_archive = PrimedArchive(env.primed_archive_dir) if getattr(env, 'primed_archive_dir', None) else None
+
+_DependencyRecord = collections.namedtuple(
+    '_DependencyRecord', ['name', 'version', 'last_modified', 'source_path', 'version_mismatch']
+)
+_Resolution = collections.namedtuple(
+    '_Resolution', ['dependencies', 'checksum', 'last_modified', 'byte_size', 'uri']
+)
+
+_uri_path_exprs = {}
+
+
+def _uri_path_expr(file_extension):
+    expr = _uri_path_exprs.get(file_extension)
+    if expr is None:
+        expr = _uri_path_exprs[file_extension] = re.compile(
+            r"(?:(?P<last_modified>[0-9]+)/?)?(?P<dependencies>[^/]*)(?=" + file_extension + r")")
+    return expr
+
 
 def _ensure_file_extension(file_extension):
     if isinstance(file_extension, types.StringTypes) and not file_extension.startswith('.'):
@@ -32,6 +84,9 @@ def _ensure_file_extension(file_extension):
 
 
 class _ModuleDependency(object):
+    # one is created per module per request, so no per-instance __dict__
+    __slots__ = ('name', 'version', '_last_modified', '_latest_lm', '_removed', '_version_mismatch', '_source_path')
+
     def __init__(self, name, version=None):
         super(_ModuleDependency, self).__init__()
 
@@ -39,44 +94,69 @@ class _ModuleDependency(object):
         self.version = float(version.strip()) if version else None
         self._last_modified = None
         self._latest_lm = None
+        self._removed = None
         self._version_mismatch = None
         self._source_path = None
 
-    def _initialize(self, module):
+    def _initialize(self, module, index=None):
         self._latest_lm = module.last_modified
         self._removed = module.removed
-        deserialized_module = next(
-            (mv for mv in module.serialized_versions if self.version and mv.get('version') == self.version),
-            None
-        )
-        if deserialized_module:
-            module = module.deserialize(deserialized_module)
+        if index is not None:
+            # the version history is indexed once per manifest generation
+            version_record = index.version_record(self.name, self.version) if self.version else None
+            if version_record is not None:
+                self._last_modified = version_record.last_modified
+                self._source_path = version_record.path
+            else:
+                self._last_modified = module.last_modified
+                self._source_path = module.path
+        else:
+            deserialized_module = next(
+                (mv for mv in module.serialized_versions if self.version and mv.get('version') == self.version),
+                None
+            )
+            if deserialized_module:
+                module = module.deserialize(deserialized_module)
+            self._last_modified = module.last_modified
+            self._source_path = module.path
 
-        self._last_modified = module.last_modified
         self._version_mismatch = self._removed or self._latest_lm != self._last_modified
-        self._source_path = module.path
 
-    def get_has_ver_mismatch(self, module):
+    def get_has_ver_mismatch(self, module, index=None):
         if self._version_mismatch is None and module:
-            self._initialize(module)
+            self._initialize(module, index)
         return self._version_mismatch
 
-    def get_last_modified(self, module):
+    def get_last_modified(self, module, index=None):
         if self._last_modified is None and module:
-            self._initialize(module)
+            self._initialize(module, index)
         return self._last_modified
 
-    def get_source_path(self, module):
+    def get_source_path(self, module, index=None):
         if self._source_path is None and module:
-            self._initialize(module)
+            self._initialize(module, index)
         return self._source_path
 
+    @classmethod
+    def restore(cls, record):
+        """
+
+        :param record: a _DependencyRecord
+        :return:
+        """
+        dependency = cls(record.name)
+        dependency.version = record.version
+        dependency._last_modified = record.last_modified
+        dependency._source_path = record.source_path
+        dependency._version_mismatch = record.version_mismatch
+        return dependency
+
     @classmethod
     def create(cls, dependency_name, version=None):
         if not version:
-            version_match = re.search(r"\+v(?P<version>.+)", dependency_name)
-            if version_match:
-                version = version_match.group('version') or None
+            position = dependency_name.find(VERSION_PREFIX)
+            if position != -1:
+                version = dependency_name[position + len(VERSION_PREFIX):] or None
                 if version:
                     dependency_name = dependency_name.replace(VERSION_PREFIX + version, '')
         return cls(dependency_name, version)
@@ -91,9 +171,18 @@ class Jammer:
         :param require_dependencies:
         :param content_type:
         """
+        start = time.time()
+
         self._content_type_manifest = None
         self._content_type_sorted_keys = None
 
+        self._checksum = None
+        self._uri = None
+        self._contents = None
+        self._last_modified = None
+        self._dependency_last_modifieds = None
+        self._byte_size = None
+
         self.content_type = (content_type_helper.filename_to_content_type(
             _ensure_file_extension(content_type)
         ) or content_type or content_type_helper.filename_to_content_type(request_path))
@@ -102,12 +191,21 @@ class Jammer:
             self.dependencies = OrderedDict()
             log.warning('no content type passed to Jammer!')
 
-        self.uri_path_expr = re.compile(
-            r"(?:(?P<last_modified>[0-9]+)/?)?(?P<dependencies>[^/]*)(?=" + self.content_type.file_extension + r")")
+        self.uri_path_expr = _uri_path_expr(self.content_type.file_extension)
 
         if request_path and not dependencies:
             dependencies = self.parse_request_path_dependencies(request_path)
 
+        resolution_key = None
+        if dependencies and request_path and not require_dependencies and not self.is_debug:
+            # hot uris resolve to the same dependencies until the manifest changes, so skip resolution entirely
+            resolution_key = (self.content_type.file_extension, dependencies, self.dependency_index.generation)
+            resolution = resolution_cache.get(resolution_key)
+            if resolution is not None:
+                self._restore_resolution(resolution)
+                metrics.timing('jam.resolve', time.time() - start)
+                return
+
         if dependencies and request_path and not require_dependencies:
 
             # sometimes, we don't want to walk the tree but return exactly what is requested.
@@ -118,28 +216,32 @@ class Jammer:
 
             # step 2. if the instance is not a result of a URI or if it is and there is no
             # version mismatch, re-order the dependencies
-            exploded_dependencies = [_ModuleDependency.create(module_name)
-                                     for module_name in self._normalize_star_token(dependencies.split(','))]
-            ed_od = OrderedDict((d.name, d) for d in exploded_dependencies)
+            index = self.dependency_index
+            manifest_modules = self.content_type_manifest.manifest
+            ed_od = OrderedDict(
+                (d.name, d) for d in (_ModuleDependency.create(module_name)
+                                      for module_name in self._normalize_star_token(dependencies.split(',')))
+            )
             ver_mismatch = next(
                 (d_name for (d_name, d) in ed_od.iteritems()
-                 if d.get_has_ver_mismatch(self.content_type_manifest.manifest.get(d_name))),
+                 if d.get_has_ver_mismatch(manifest_modules.get(d_name), index)),
                 None
             )
 
             # if there is a version mismatch with a URI path, we want to try and just fulfill
             # it the way it's been requested for backward compatibility
             if not request_path or (request_path and not ver_mismatch):
-                # get all the possible names in the sorted manifest
-                sorted_names = [name for (name, path, version) in self.content_type_manifest.sorted_deps]
+                # get all the possible names in the sorted manifest, as a sorted rank array
+                ranks = index.ranks
+                names = index.names
                 ed_od = OrderedDict(
-                    (name, ed_od.get(name)) for name in sorted_names if name in ed_od
+                    (names[rank], ed_od[names[rank]]) for rank in index.sorted_ranks(ed_od)
                 )
 
                 # attempt to back-fill any dependencies that may have been removed or changed
                 if request_path:
                     ed_od.update(OrderedDict(
-                        (d_name, d) for (d_name, d) in ed_od.iteritems() if d_name not in sorted_names)
+                        (d_name, d) for (d_name, d) in ed_od.iteritems() if d_name not in ranks)
                     )
 
             self.dependencies = ed_od
@@ -149,39 +251,82 @@ class Jammer:
 
             # step 1. get all the modules from the normalized star dependencies result
 
-            # step 2. for each iteration of step 1, union the current name to the dependencies
-            # of the current name in the primer manifest
+            # step 2. union the precomputed dependency closures of each name in step 1; the set
+            # bits of the result are already in manifest order
             exploded_dependencies = [
                 _ModuleDependency.create(module_name)
                 for module_name in self._normalize_star_token(dependencies.split(','))
             ]
-            ed_dict = dict((d.name, d) for d in exploded_dependencies if d.name in self.content_type_manifest.manifest)
-            missing_deps = [_ModuleDependency.create(name)
-                            for (d_name, d) in ed_dict.iteritems()
-                            for name in self.content_type_manifest.manifest.get(d_name).dependencies]
-            ed_dict.update(dict((d.name, d) for d in missing_deps))
-
-            self.dependencies = self._order_dependencies(ed_dict)
+            self.dependencies = self._dependencies_from_bits(
+                self.dependency_index.closure_bits(d.name for d in exploded_dependencies)
+            )
 
         else:
             # note: jammer can still work even if no dependecies are passed. the url property will simply return None
             self.dependencies = OrderedDict()
             log.debug('no dependencies passed to Jammer!')
 
+        if resolution_key is not None and self.dependencies:
+            resolution_cache.set(resolution_key, self._freeze_resolution())
+        metrics.timing('jam.resolve', time.time() - start)
+
+    def _freeze_resolution(self):
+        manifest = self.content_type_manifest.manifest
+        index = self.dependency_index
+        # checksum first: it fills in each dependency's version
+        checksum = self.checksum
+        return _Resolution(
+            dependencies=tuple(
+                _DependencyRecord(
+                    name=d_name,
+                    version=d.version,
+                    last_modified=d.get_last_modified(manifest.get(d_name), index),
+                    source_path=d.get_source_path(manifest.get(d_name), index),
+                    version_mismatch=d.get_has_ver_mismatch(manifest.get(d_name), index)
+                ) for (d_name, d) in self.dependencies.iteritems()
+            ),
+            checksum=checksum,
+            last_modified=self.last_modified,
+            byte_size=self.byte_size,
+            uri=self.uri
+        )
+
+    def _restore_resolution(self, resolution):
+        self.dependencies = OrderedDict(
+            (record.name, _ModuleDependency.restore(record)) for record in resolution.dependencies
+        )
+        self._dependency_last_modifieds = tuple(record.last_modified for record in resolution.dependencies)
+        self._checksum = resolution.checksum
+        self._last_modified = resolution.last_modified
+        self._byte_size = resolution.byte_size
+        self._uri = resolution.uri
+
+    def _reset_derived_properties(self):
         self._checksum = None
         self._uri = None
         self._contents = None
         self._last_modified = None
+        self._dependency_last_modifieds = None
         self._byte_size = None
 
+    def parse_request_path(self, path):
+        """
+
+        :param path:
+        :return: (dependencies, last_modified) from a single pass over path
+        """
+        match = next((match for match in self.uri_path_expr.finditer(path) if match.group('dependencies')), None)
+        if match is None:
+            return '', ''
+        return match.group('dependencies'), match.group('last_modified')
+
     def parse_request_path_dependencies(self, path):
         """
 
         :param path:
         :return:
         """
-        return next((match.group('dependencies') for match in self.uri_path_expr.finditer(path) if
-                     match.group('dependencies')), '')
+        return self.parse_request_path(path)[0]
 
     def parse_request_path_last_modified(self, path):
         """
@@ -189,45 +334,57 @@ class Jammer:
         :param path:
         :return:
         """
-        return next((match.group('last_modified') for match in self.uri_path_expr.finditer(path) if
-                     match.group('dependencies')), '')
+        return self.parse_request_path(path)[1]
 
     def _order_dependencies(self, dependencies):
+        index = self.dependency_index
+        ordered_dependencies = OrderedDict()
+        for rank in index.sorted_ranks(dependencies):
+            dep = dependencies[index.names[rank]]
+            dep.version = index.versions[rank]
+            ordered_dependencies[dep.name] = dep
+        return ordered_dependencies
+
+    def _dependencies_from_bits(self, bits):
+        index = self.dependency_index
         ordered_dependencies = OrderedDict()
-        for name, path, version in self.content_type_manifest.sorted_deps:
-            if name in dependencies:
-                dep = dependencies.get(name)
-                dep.version = float(version) if version else None
-                ordered_dependencies[name] = dep
+        for rank in iter_bits(bits):
+            dep = _ModuleDependency(index.names[rank])
+            dep.version = index.versions[rank]
+            ordered_dependencies[dep.name] = dep
         return ordered_dependencies
 
     def _normalize_star_token(self, dependencies):
         # step 1. find all the dependencies that are .* dependencies e.g. paste.*
 
-        # step 2. in each iteration of step 1, match relevant children (e.g. paste.event, util, etc)
-        # in the primer manifest
-        star_deps = {}
-        for i, dependency_name in enumerate(dependencies):
+        # step 2. replace each of step 1 in place with its relevant children (e.g. paste.event, util, etc)
+        # from the prefix trie of the primer manifest
+        normalized_dependencies = []
+        for dependency_name in dependencies:
             if dependency_name.strip().endswith('.*'):
-                dp_name = dependencies.pop(i).strip()[:-2]
-                star_deps[i] = []
-
-                for (name, module, version) in self.content_type_manifest.sorted_deps:
-                    if name == dp_name or name.startswith(dp_name + '.'):
-                        star_deps[i].append(name)
-
-        for i, deps in star_deps.iteritems():
-            dependencies = dependencies[:i] + deps + dependencies[i:]
-
-        return dependencies
+                normalized_dependencies.extend(self.dependency_index.expand_star(dependency_name.strip()[:-2]))
+            else:
+                normalized_dependencies.append(dependency_name)
+        return normalized_dependencies
 
     def _set_debug_properties(self):
-        dependencies_stats = [
-            os.stat(d.get_source_path(self.content_type_manifest.manifest.get(d_name)))
+        manifest_modules = self.content_type_manifest.manifest
+        index = self.dependency_index
+        source_paths = [
+            d.get_source_path(manifest_modules.get(d_name), index)
             for (d_name, d) in self.dependencies.iteritems()
         ]
-        self._last_modified = max(file_stat[stat.ST_MTIME] for file_stat in dependencies_stats)
-        self._byte_size = sum(file_stat[stat.ST_SIZE] for file_stat in dependencies_stats)
+        if mapped_files is not None:
+            # (mtime, size) from the handle cache, re-stat'ed at most once per check interval
+            dependencies_stats = [mapped_files.stat(source_path) for source_path in source_paths]
+        else:
+            dependencies_stats = [
+                (file_stat[stat.ST_MTIME], file_stat[stat.ST_SIZE])
+                for file_stat in (os.stat(source_path) for source_path in source_paths)
+            ]
+        self._dependency_last_modifieds = tuple(int(mtime) for (mtime, size) in dependencies_stats)
+        self._last_modified = max(self._dependency_last_modifieds)
+        self._byte_size = sum(size for (mtime, size) in dependencies_stats)
 
     @property
     def content_type_manifest(self):
@@ -238,9 +395,30 @@ class Jammer:
         :return:
         """
         if self._content_type_manifest is None:
-            self._content_type_manifest = manifest.get_content_type_manifest(self.content_type)
+            with metrics.timer('jam.manifest_lookup'):
+                self._content_type_manifest = (incremental.get_content_type_manifest(self.content_type) or
+                                               manifest.get_content_type_manifest(self.content_type))
         return self._content_type_manifest
 
+    @property
+    def is_watched(self):
+        """
+        whether the manifest is kept current by a file watcher, in which case its entries can be trusted even in
+        debug mode
+
+        :return:
+        """
+        return isinstance(self.content_type_manifest, incremental.ManifestGeneration)
+
+    @property
+    def dependency_index(self):
+        """
+
+
+        :return: the rank/closure index of the current manifest generation
+        """
+        return get_dependency_index(self.content_type_manifest)
+
     @property
     def last_modified(self):
         """
@@ -249,15 +427,28 @@ class Jammer:
         :return:
         """
         if not self._last_modified and self.dependencies:
-            if self.is_debug:
+            self._last_modified = max(self.dependency_last_modifieds)
+            log.debug('generated last_modified: %i', self._last_modified)
+        return self._last_modified
+
+    @property
+    def dependency_last_modifieds(self):
+        """
+
+
+        :return: the last modified time of each dependency, in order
+        """
+        if self._dependency_last_modifieds is None and self.dependencies:
+            if self.is_debug and not self.is_watched:
                 self._set_debug_properties()
             else:
-                self._last_modified = max([
-                    d.get_last_modified(self.content_type_manifest.manifest.get(d_name))
+                manifest_modules = self.content_type_manifest.manifest
+                index = self.dependency_index
+                self._dependency_last_modifieds = tuple(
+                    d.get_last_modified(manifest_modules.get(d_name), index)
                     for (d_name, d) in self.dependencies.iteritems()
-                ])
-            log.debug('generated last_modified: %i' % self._last_modified)
-        return self._last_modified
+                )
+        return self._dependency_last_modifieds
 
     @property
     def _checksum_format(self):
@@ -279,7 +470,7 @@ class Jammer:
                 self._checksum_format.format(name=d.name, version_prefix=VERSION_PREFIX + str(d.version))
                 for (d_name, d) in self.dependencies.iteritems()
             ])
-            log.debug('generated checksum: %s' % self._checksum)
+            log.debug('generated checksum: %s', self._checksum)
         return self._checksum
 
     @property
@@ -296,7 +487,7 @@ class Jammer:
                 self.checksum,
                 self.content_type.file_extension
             )
-            log.debug('generated uri: %s' % self._uri)
+            log.debug('generated uri: %s', self._uri)
         return self._uri
 
     @property
@@ -321,7 +512,7 @@ class Jammer:
         :return:
         """
         if not self._byte_size and self.dependencies:
-            if self.is_debug:
+            if self.is_debug and not self.is_watched:
                 self._set_debug_properties()
             else:
                 self._byte_size = sum(
@@ -329,7 +520,7 @@ class Jammer:
                     for (primer_part_name, primer_part) in self.content_type_manifest.manifest.iteritems()
                     if primer_part_name in self.dependencies
                 ) or 0
-            log.debug('generated byte_size: %d' % self._byte_size)
+            log.debug('generated byte_size: %d', self._byte_size)
         return self._byte_size
 
     @property
@@ -340,15 +531,91 @@ class Jammer:
         :return:
         """
         if not self._contents and self.dependencies:
-            # potential fixme: responses *should* be cached via cloud front and url caching
-            self._contents = ''.join([
-                self.read_contents(
-                    filename=d.get_source_path(self.content_type_manifest.manifest.get(d_name))
-                ) for (d_name, d) in self.dependencies.iteritems()
-            ])
-            log.debug('generated contents: %s' % self._contents)
+            # responses *should* be cached via cloud front and url caching, but the origin keeps a
+            # process-wide copy of each jam so that cdn misses don't rebuild identical bundles
+            cache_key = self.bundle_cache_key
+            self._contents = bundle_cache.get(cache_key, fingerprint=self.dependency_last_modifieds)
+            if self._contents is None:
+                # another worker on this host may already have built it
+                shared_key = self.shared_cache_key
+                shared_contents = shared_bundle_cache.get(shared_key) if shared_key is not None else None
+                if shared_contents is not None:
+                    self._contents = str(shared_contents)
+                else:
+                    manifest_modules = self.content_type_manifest.manifest
+                    index = self.dependency_index
+                    with metrics.timer('jam.read'):
+                        parts = [
+                            self._read_dependency(d, manifest_modules.get(d_name), index)
+                            for (d_name, d) in self.dependencies.iteritems()
+                        ]
+                    with metrics.timer('jam.concatenate'):
+                        self._contents = ''.join(parts)
+                    metrics.increment('jam.contents.bytes', len(self._contents))
+                    if shared_key is not None:
+                        shared_bundle_cache.set(shared_key, self._contents)
+                bundle_cache.set(cache_key, self._contents, fingerprint=self.dependency_last_modifieds)
+            # the whole bundle: only format it when someone is listening
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('generated contents: %s', self._contents)
         return self._contents
 
+    def aread_contents(self, callback=None):
+        """
+        build the bundle on the io pool, so that primed file reads don't block the calling thread e.g. an event loop.
+        the jammer shouldn't be used from elsewhere until the result is ready.
+
+        :param callback: see offload.submit
+        :return: an AsyncResult of the contents
+        """
+        return offload.submit(offload.io_pool(), lambda: self.contents, callback=callback)
+
+    def iter_contents(self, view=False):
+        """
+        yield the bundle one primed dependency at a time, so that it never has to be held in memory whole. a bundle
+        already in the bundle cache, or in the host's shared cache, is yielded as a single chunk.
+
+        :param view: yield zero-copy buffers over memory mapped primed files and the shared cache instead of str.
+            buffers aren't valid wsgi body chunks, so this is only for consumers that copy or compress each chunk
+            before it leaves them, e.g. Speed.compress_stream
+        :return:
+        """
+        if not self.dependencies:
+            return
+
+        contents = self._contents or bundle_cache.get(self.bundle_cache_key,
+                                                      fingerprint=self.dependency_last_modifieds)
+        if contents is None and self.shared_cache_key is not None:
+            contents = shared_bundle_cache.get(self.shared_cache_key)
+        if contents is not None:
+            yield contents if view else str(contents)
+            return
+
+        manifest_modules = self.content_type_manifest.manifest
+        index = self.dependency_index
+        for (d_name, d) in self.dependencies.iteritems():
+            yield self._read_dependency(d, manifest_modules.get(d_name), index, view=view)
+
+    @property
+    def shared_cache_key(self):
+        """
+
+
+        :return: the bundle's key in the host's shared cache, or None when there is no shared cache
+        """
+        if shared_bundle_cache is None or self.is_debug or not self.dependencies:
+            return None
+        return self.bundle_cache_key + (repr(self.dependency_last_modifieds), content_encoding.IDENTITY)
+
+    @property
+    def bundle_cache_key(self):
+        """
+
+
+        :return:
+        """
+        return self.content_type.file_extension, self.checksum, self.last_modified
+
     @property
     def is_debug(self):
         """
@@ -367,13 +634,153 @@ class Jammer:
         if not loaded_deps:
             loaded_deps = set()
 
-        keys = set(self.dependencies.keys()) - loaded_deps
         self.dependencies = self._order_dependencies(
-            dict((d.name, d) for (d_name, d) in self.dependencies.iteritems() if d.name in keys)
+            dict((d.name, d) for (d_name, d) in self.dependencies.iteritems() if d.name not in loaded_deps)
         )
+        self._reset_derived_properties()
 
         return set(self.dependencies.keys())
 
+    def filter_loaded_bits(self, loaded_bits):
+        """
+        filter_loaded for a bitset of the ranks the client has loaded: one bitwise subtraction, however many modules
+        are requested or loaded
+
+        :param loaded_bits:
+        :return: the bitset of everything loaded once this jam is, i.e. loaded_bits and this jam's modules
+        """
+        index = self.dependency_index
+        requested_bits = index.bits(self.dependencies)
+
+        self.dependencies = self._dependencies_from_bits(requested_bits & ~loaded_bits)
+        self._reset_derived_properties()
+
+        return loaded_bits | requested_bits
+
+    def _is_servable(self, d, index):
+        # whether the exact bytes of the version d pins can be read. the manifest keeps a record of old versions, but
+        # only the archive keeps their content; without it they'd be read from the current primed file.
+        if d.version is None or index.is_current(d.name, d.version):
+            return True
+        return primed_archive is not None and primed_archive.has(d.name, d.version)
+
+    def delta_from(self, base):
+        """
+        a patch that turns the bundle a client already has into this one, as json:
+
+            {"base": base uri, "uri": this uri, "base_byte_size": ..., "byte_size": ...,
+             "changed": [modules replaced], "removed": [modules dropped],
+             "ops": [[offset, length] to copy from the base bundle, or "content" to insert, ...]}
+
+        modules at the same version in both bundles are copied, so a release that changes one module sends just that
+        module. deltas are cached per pair of checksums.
+
+        :param base: the Jammer of the client's bundle, e.g. Jammer(request_path=its uri)
+        :return: the delta, or None when the base bundle can't be rebuilt exactly (e.g. a module version that is
+            neither current nor archived) or a delta would be no smaller than the bundle
+        """
+        if self.is_debug or not self.dependencies or not base.dependencies:
+            return None
+
+        cache_key = (self.content_type.file_extension, base.checksum, self.checksum)
+        delta = delta_cache.get(cache_key)
+        if delta is None:
+            with metrics.timer('jam.delta'):
+                delta = self._build_delta(base) or ''
+            delta_cache.set(cache_key, delta, byte_size=max(len(delta), 1))
+        return delta or None
+
+    def _build_delta(self, base):
+        index = self.dependency_index
+        manifest_modules = self.content_type_manifest.manifest
+        if any(not self._is_servable(d, index) for (d_name, d) in base.dependencies.iteritems()):
+            return None
+
+        # (name, version) -> (offset, length) in the base bundle
+        base_spans = {}
+        offset = 0
+        for (d_name, d) in base.dependencies.iteritems():
+            length = len(self._read_dependency(d, manifest_modules.get(d_name), index))
+            base_spans[(d_name, d.version)] = (offset, length)
+            offset += length
+        base_byte_size = offset
+
+        ops = []
+        changed = []
+        byte_size = 0
+        for (d_name, d) in self.dependencies.iteritems():
+            span = base_spans.get((d_name, d.version))
+            if span is not None:
+                byte_size += span[1]
+                if ops and isinstance(ops[-1], list) and ops[-1][0] + ops[-1][1] == span[0]:
+                    # extend the previous copy
+                    ops[-1][1] += span[1]
+                else:
+                    ops.append(list(span))
+            else:
+                content = self._read_dependency(d, manifest_modules.get(d_name), index)
+                byte_size += len(content)
+                changed.append(d_name)
+                ops.append(content)
+
+        removed = [d_name for d_name in base.dependencies if d_name not in self.dependencies]
+        try:
+            delta = json.dumps({
+                'base': base.uri,
+                'uri': self.uri,
+                'base_byte_size': base_byte_size,
+                'byte_size': byte_size,
+                'changed': changed,
+                'removed': removed,
+                'ops': ops,
+            }, separators=(',', ':'))
+        except UnicodeDecodeError:
+            log.warning('delta from %s to %s: primed content is not utf-8' % (base.uri, self.uri))
+            return None
+
+        if len(delta) >= byte_size:
+            return None
+        return delta
+
+    def planned_jammers(self, plan):
+        """
+        split this jam along an offline planner.ChunkPlan, so that pages share cacheable chunk uris instead of each
+        getting its own ad-hoc jam. chunks come in dependency order.
+
+        :param plan:
+        :return: one Jammer per chunk covering the dependencies, plus one for any modules no chunk covers
+        """
+        index = self.dependency_index
+        covering, uncovered = plan.rebase(index).chunks_for(index.bits(self.dependencies))
+        if uncovered:
+            # the uncovered modules may depend on a chunk or a chunk on them
+            covering = planner.order_chunks(
+                covering + [planner.Chunk(tuple(index.names_from_bits(uncovered)), None, uncovered)], index)
+        return [self._exact(chunk.bits) for chunk in covering]
+
+    def chunk_uris(self, plan):
+        """
+
+        :param plan:
+        :return:
+        """
+        return [jammer.uri for jammer in self.planned_jammers(plan)]
+
+    def _exact(self, bits):
+        jammer = self.__class__(content_type=self.content_type)
+        jammer._content_type_manifest = self._content_type_manifest
+        jammer.dependencies = jammer._dependencies_from_bits(bits)
+        return jammer
+
+    def _read_dependency(self, d, module, index, view=False):
+        if primed_archive is not None and d.version is not None and not index.is_current(d.name, d.version):
+            archived = primed_archive.read(d.name, d.version)
+            if archived is not None:
+                return archived
+
+        source_path = d.get_source_path(module, index)
+        return self.read_contents_view(filename=source_path) if view else self.read_contents(filename=source_path)
+
     def read_contents(self, filename):
         """
 
@@ -382,6 +789,17 @@ class Jammer:
         """
         return self.content_type_manifest.primer.read_primed(filename)
 
+    def read_contents_view(self, filename):
+        """
+
+        :param filename:
+        :return: a zero-copy buffer over the primed file when primed files are memory mapped, else its contents
+        """
+        primed_path = getattr(self.content_type_manifest.primer, 'primed_path', None)
+        if mapped_files is not None and primed_path is not None:
+            return mapped_files.view(primed_path(filename))
+        return self.read_contents(filename)
+
     @classmethod
     def jam_filter_loaded(cls, file_extension, dependencies, loaded_deps=None):
 
@@ -421,3 +839,221 @@ class Jammer:
         loaded_deps |= jammer.filter_loaded(loaded_deps)
 
         return jammer
+
+    @classmethod
+    def jam_filter_loaded_bits(cls, file_extension, dependencies, loaded=None):
+        """
+        jam_filter_loaded with the loaded modules sent as a DependencyIndex.encode_loaded token rather than a set of
+        names. a token from another rank layout (modules were added or removed since the client got it) can't be
+        trusted, so it counts as nothing loaded.
+
+        :param file_extension:
+        :param dependencies:
+        :param loaded: the token the client got back with its last jam, if any
+        :return: (jammer, the token to hand back to the client alongside jammer.uri)
+        """
+        file_extension = _ensure_file_extension(file_extension)
+        content_type = content_type_helper.filename_to_content_type(file_extension)
+
+        if not isinstance(dependencies, types.StringTypes):
+            log.warning('Dependencies of non-StringTypes passed. file_extension=%s; dependencies=%r; loaded=%r' % (
+                file_extension,
+                dependencies,
+                loaded
+            ))
+            dependencies = ''
+        jammer = cls(content_type=content_type, dependencies=dependencies)
+
+        index = jammer.dependency_index
+        loaded_bits = index.decode_loaded(loaded) if loaded else 0
+        if loaded_bits is None:
+            log.debug('stale or malformed loaded token %r for %s' % (loaded, file_extension))
+            metrics.increment('jam.loaded_bits.stale')
+            loaded_bits = 0
+
+        return jammer, index.encode_loaded(jammer.filter_loaded_bits(loaded_bits))
+
+    @classmethod
+    def jam_delta(cls, base_request_path, request_path):
+        """
+        the delta from the bundle at base_request_path to the bundle at request_path, e.g. for a client that has the
+        previous release's bundle cached
+
+        :param base_request_path:
+        :param request_path:
+        :return: (jammer for request_path, the delta or None if the client should fetch jammer.uri whole)
+        """
+        jammer = cls(request_path=request_path)
+        base = cls(request_path=base_request_path)
+        if base.content_type.file_extension != jammer.content_type.file_extension:
+            return jammer, None
+        return jammer, jammer.delta_from(base)
+
+
+PrewarmReport = collections.namedtuple('PrewarmReport', ['uri', 'seconds', 'byte_size', 'encoded_sizes', 'error'])
+
+_ACCESS_LOG_PATH_EXPR = re.compile(r'"(?:GET|HEAD) (?P<path>\S+)')
+
+
+def read_access_log(lines, content_type=None):
+    """
+    count the jam request paths in an access log (common/combined format) or a plain list of paths
+
+    :param lines:
+    :param content_type: only count paths of this content type
+    :return: a Counter of request path -> hits
+    """
+    requests = collections.Counter()
+    for line in lines:
+        match = _ACCESS_LOG_PATH_EXPR.search(line)
+        path = (match.group('path') if match else line.strip()).split('?', 1)[0]
+        if not path.startswith(env.root_uri):
+            continue
+        path_content_type = content_type_helper.filename_to_content_type(path)
+        if path_content_type is None or (content_type is not None and path_content_type != content_type):
+            continue
+        requests[path] += 1
+    return requests
+
+
+def prewarm(requests, content_type=None, workers=4, encodings=None, output_dir=None):
+    """
+    build the given bundles ahead of traffic, filling the bundle and compressed-variant caches, and optionally write
+    each one (and a .gz sibling) under output_dir at its uri for a cdn origin. only the host's shared cache and
+    output_dir outlive the calling process.
+
+    :param requests: request paths under env.root_uri, or comma separated dependency strings
+    :param content_type: required for dependency strings
+    :param workers: bundles built concurrently
+    :param encodings: content codings to precompress; defaults to every available one
+    :param output_dir:
+    :return: a PrewarmReport per request, in order
+    """
+    if encodings is None:
+        encodings = content_encoding.SERVER_PREFERENCE
+
+    def build(request):
+        start = time.time()
+        uri = request
+        try:
+            if request.startswith(env.root_uri):
+                jammer = Jammer(request_path=request, content_type=content_type)
+            else:
+                jammer = Jammer(dependencies=request, content_type=content_type, require_dependencies=True)
+
+            uri = jammer.uri
+            contents = jammer.contents
+            if not contents:
+                return PrewarmReport(uri, time.time() - start, 0, {}, 'empty bundle')
+
+            cache_key = None if jammer.is_debug else uri
+            encoded_sizes = dict(
+                (encoding, len(Speed.compress_variant(contents, encoding, cache_key=cache_key)))
+                for encoding in encodings
+            )
+
+            if output_dir is not None:
+                filename = os.path.join(output_dir, uri.lstrip('/'))
+                write_atomic(filename, contents)
+                Speed.write_gzip_siblings([filename])
+
+            return PrewarmReport(uri, time.time() - start, len(contents), encoded_sizes, None)
+        except Exception as e:
+            log.exception('unable to prewarm %s' % request)
+            return PrewarmReport(uri, time.time() - start, 0, {}, '%s: %s' % (type(e).__name__, e))
+
+    pool = ThreadPool(processes=max(1, workers))
+    try:
+        return pool.map(build, list(requests))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    """
+    pre-warm the top bundles at deploy time, into --output-dir or the host's shared cache (env.shared_cache_path)
+
+        python -m paste.source.jammer --access-log access.log --top 200 --output-dir /srv/cdn-origin
+        python -m paste.source.jammer --content-type js paste.*,app.main
+        python -m paste.source.jammer --content-type js --snapshot /srv/manifest/js.snapshot --generation 42
+
+    :param argv:
+    :return: the exit status
+    """
+    parser = optparse.OptionParser(usage='%prog [options] [REQUEST_PATH_OR_DEPENDENCIES...]')
+    parser.add_option('--access-log', dest='access_logs', action='append', default=[],
+                      help='an access log or list of request paths; may be repeated, - reads stdin')
+    parser.add_option('--content-type', dest='content_type',
+                      help='the file extension of the bundles, required for dependency strings')
+    parser.add_option('--top', dest='top', type='int', default=200, help='how many of the most requested to build')
+    parser.add_option('--workers', dest='workers', type='int', default=4)
+    parser.add_option('--encodings', dest='encodings', help='comma separated content codings to precompress')
+    parser.add_option('--output-dir', dest='output_dir', help='write each bundle and a .gz sibling here')
+    parser.add_option('--archive', dest='archive', action='store_true', default=False,
+                      help='first archive the current version of every module in env.primed_archive_dir')
+    parser.add_option('--snapshot', dest='snapshot',
+                      help='first compile the manifest into a binary snapshot at SNAPSHOT, for workers to load')
+    parser.add_option('--generation', dest='generation', type='int', default=0,
+                      help='the generation recorded in the snapshot, e.g. a deploy number')
+    options, args = parser.parse_args(argv)
+
+    content_type = content_type_helper.filename_to_content_type(
+        _ensure_file_extension(options.content_type)) if options.content_type else None
+
+    requests = collections.Counter()
+    for access_log in options.access_logs:
+        if access_log == '-':
+            requests.update(read_access_log(sys.stdin, content_type=content_type))
+        else:
+            with open(access_log) as f:
+                requests.update(read_access_log(f, content_type=content_type))
+    ordered_requests = [request for (request, hits) in requests.most_common(options.top)] + args
+
+    if options.archive:
+        if primed_archive is None:
+            parser.error('--archive needs env.primed_archive_dir')
+        if content_type is None:
+            parser.error('--archive needs --content-type')
+        print '%d module versions archived' % primed_archive.archive_manifest(
+            Jammer(content_type=content_type).content_type_manifest)
+        if not ordered_requests:
+            return 0
+
+    if options.snapshot:
+        if content_type is None:
+            parser.error('--snapshot needs --content-type')
+        print '%d byte snapshot written to %s' % (write_snapshot(
+            Jammer(content_type=content_type).content_type_manifest, options.snapshot,
+            generation=options.generation), options.snapshot)
+        if not ordered_requests:
+            return 0
+
+    if not ordered_requests:
+        parser.error('nothing to pre-warm')
+    if args and content_type is None:
+        parser.error('--content-type is required for dependency strings')
+    if options.output_dir is None and shared_bundle_cache is None:
+        # this process's own caches go when it exits, so the work would be thrown away
+        parser.error('pre-warming needs --output-dir or env.shared_cache_path')
+
+    reports = prewarm(ordered_requests, content_type=content_type, workers=options.workers,
+                      encodings=options.encodings.split(',') if options.encodings else None,
+                      output_dir=options.output_dir)
+
+    failures = 0
+    for report in reports:
+        if report.error:
+            failures += 1
+            print '%8.1f ms  FAILED  %s  (%s)' % (report.seconds * 1000, report.uri, report.error)
+        else:
+            print '%8.1f ms  %9d B  %s  %s' % (
+                report.seconds * 1000, report.byte_size,
+                ' '.join('%s=%d' % item for item in sorted(report.encoded_sizes.iteritems())), report.uri)
+    print '%d bundles, %d failed, %.1f ms total build time' % (
+        len(reports), failures, sum(report.seconds for report in reports) * 1000)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
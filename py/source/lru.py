@@ -0,0 +1,136 @@
+import threading
+import logging
+
+log = logging.getLogger('paste')
+
+from ..util import OrderedDict
+
+
+class LRUCache(object):
+    def __init__(self, max_bytes=None, name=None, max_entries=None):
+        """
+        A thread-safe least recently used cache bounded by the total byte size of its values, or by the number of
+        its entries when max_entries is given.
+
+        :param max_bytes: the memory cap; a cap of 0 disables the cache. with max_entries, None leaves it unbounded
+        :param name:
+        :param max_entries: the entry cap, for values whose byte size isn't worth measuring; a cap of 0 disables the
+            cache
+        """
+        super(LRUCache, self).__init__()
+
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes if max_entries is not None else max_bytes or 0
+        self.byte_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, fingerprint=None):
+        """
+
+        :param key:
+        :param fingerprint: when given, an entry stored with a different fingerprint is treated as stale and dropped
+        :return: the cached value or None
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, byte_size, entry_fingerprint = entry
+            if fingerprint is not None and entry_fingerprint != fingerprint:
+                self.byte_size -= byte_size
+                self.invalidations += 1
+                self.misses += 1
+                log.debug('%s cache invalidated: %r', self.name, key)
+                return None
+
+            # re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, byte_size=None, fingerprint=None):
+        """
+
+        :param key:
+        :param value:
+        :param byte_size: defaults to len(value), or to 0 for a cache bounded by max_entries
+        :param fingerprint:
+        :return: True if the value was stored
+        """
+        if byte_size is None:
+            byte_size = len(value) if self.max_entries is None else 0
+
+        if self.max_entries is not None and self.max_entries <= 0:
+            return False
+        if self.max_bytes is not None and byte_size > self.max_bytes:
+            return False
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.byte_size -= entry[1]
+
+            self._entries[key] = (value, byte_size, fingerprint)
+            self.byte_size += byte_size
+
+            while self._entries and self._over_capacity():
+                evicted_key = next(iter(self._entries))
+                self.byte_size -= self._entries.pop(evicted_key)[1]
+                self.evictions += 1
+                log.debug('%s cache evicted: %r', self.name, evicted_key)
+        return True
+
+    def _over_capacity(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.byte_size > self.max_bytes
+
+    def invalidate(self, key):
+        """
+
+        :param key:
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.byte_size -= entry[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.byte_size = 0
+
+    @property
+    def stats(self):
+        """
+
+
+        :return:
+        """
+        return {
+            'name': self.name,
+            'entries': len(self._entries),
+            'byte_size': self.byte_size,
+            'max_bytes': self.max_bytes,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,93 @@
+import os
+import mmap
+import time
+import threading
+
+from ..util import OrderedDict
+
+DEFAULT_MAX_HANDLES = 512
+DEFAULT_CHECK_INTERVAL = 1.0
+
+
+class _MappedFile(object):
+    def __init__(self, path):
+        super(_MappedFile, self).__init__()
+
+        self.path = path
+        self.checked = time.time()
+        with open(path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            self.mtime = file_stat.st_mtime
+            self.size = file_stat.st_size
+            # zero length files can't be mapped
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def view(self):
+        # a buffer is python 2's zero-copy view; unlike memoryview it accepts an mmap. it keeps the map alive, so an
+        # evicted handle is never closed out from under a reader.
+        return buffer(self.map) if self.map is not None else ''
+
+
+class MappedFileCache(object):
+    def __init__(self, max_handles=DEFAULT_MAX_HANDLES, check_interval=DEFAULT_CHECK_INTERVAL):
+        """
+        a small LRU of read-only memory maps of primed files. a handle is re-mapped when the file's mtime or size
+        changes; files are re-stat'ed at most once per check_interval seconds. mapped files must be replaced by
+        rename rather than truncated in place, or readers of an old view can fault.
+
+        :param max_handles:
+        :param check_interval:
+        """
+        super(MappedFileCache, self).__init__()
+
+        self.max_handles = max_handles
+        self.check_interval = check_interval
+
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _handle(self, path):
+        now = time.time()
+        with self._lock:
+            handle = self._handles.pop(path, None)
+
+        if handle is not None and now - handle.checked >= self.check_interval:
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                file_stat = None
+            if file_stat is None or file_stat.st_mtime != handle.mtime or file_stat.st_size != handle.size:
+                handle = None
+            else:
+                handle.checked = now
+
+        if handle is None:
+            handle = _MappedFile(path)
+
+        with self._lock:
+            self._handles[path] = handle
+            while len(self._handles) > self.max_handles:
+                self._handles.pop(next(iter(self._handles)))
+        return handle
+
+    def view(self, path):
+        """
+
+        :param path:
+        :return: a zero-copy read-only buffer over the file's contents. it isn't a str, so it mustn't be handed to
+            wsgi as a body chunk without a copy
+        """
+        return self._handle(path).view()
+
+    def stat(self, path):
+        """
+
+        :param path:
+        :return: (mtime, size) as of the last check
+        """
+        handle = self._handle(path)
+        return handle.mtime, handle.size
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
@@ -0,0 +1,361 @@
+import time
+import socket
+import logging
+import threading
+import collections
+
+log = logging.getLogger('paste')
+
+from ..core.runtime import Runtime
+env = Runtime.get().env
+
+from .files import write_atomic
+
+DEFAULT_PREFIX = 'paste'
+DEFAULT_FLUSH_INTERVAL = 10.0
+# timing samples kept per name between flushes; beyond this statsd is told the sample rate
+MAX_SAMPLES_PER_FLUSH = 1000
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class NullMetrics(object):
+    """
+    the default: every hook is a no-op, so instrumented code costs a method call when metrics are off
+    """
+    enabled = False
+
+    def timer(self, name):
+        return _null_timer
+
+    def timing(self, name, seconds):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.timing(self.name, time.time() - self.start)
+        return False
+
+
+class Metrics(object):
+    enabled = True
+
+    def __init__(self, prefix=DEFAULT_PREFIX):
+        """
+        aggregates stage timers, counters and gauges in memory until an exporter flushes them
+
+        :param prefix: prepended to every metric name
+        """
+        super(Metrics, self).__init__()
+
+        self.prefix = prefix
+        self.counters = collections.defaultdict(int)
+        self.gauges = {}
+        # name -> [count, total seconds, max seconds], over the life of the process
+        self.timings = {}
+
+        self._samples = collections.defaultdict(list)
+        self._sample_counts = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        """
+        time a block: `with metrics.timer('jam.contents'): ...`
+
+        :param name:
+        :return:
+        """
+        return _Timer(self, name)
+
+    def timing(self, name, seconds):
+        with self._lock:
+            summary = self.timings.get(name)
+            if summary is None:
+                summary = self.timings[name] = [0, 0.0, 0.0]
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+
+            self._sample_counts[name] += 1
+            samples = self._samples[name]
+            if len(samples) < MAX_SAMPLES_PER_FLUSH:
+                samples.append(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def drain_samples(self):
+        """
+
+        :return: name -> (timing samples since the last drain, how many timings they were taken from)
+        """
+        with self._lock:
+            samples = dict((name, (values, self._sample_counts[name])) for (name, values) in self._samples.iteritems())
+            self._samples = collections.defaultdict(list)
+            self._sample_counts = collections.defaultdict(int)
+        return samples
+
+    def snapshot(self):
+        """
+
+        :return: (counters, gauges, timings) copies, with the registered cache stats folded into the gauges
+        """
+        for cache in _caches:
+            stats = cache.stats
+            lookups = stats['hits'] + stats['misses']
+            prefix = 'cache.%s.' % stats['name']
+            self.gauge(prefix + 'hit_ratio', float(stats['hits']) / lookups if lookups else 0.0)
+            self.gauge(prefix + 'entries', stats['entries'])
+            self.gauge(prefix + 'byte_size', stats['byte_size'])
+            self.gauge(prefix + 'evictions', stats['evictions'])
+
+        with self._lock:
+            return (dict(self.counters), dict(self.gauges),
+                    dict((name, tuple(summary)) for (name, summary) in self.timings.iteritems()))
+
+
+class StatsdExporter(object):
+    def __init__(self, metrics, address):
+        """
+        send metrics as statsd lines over udp, or over a unix datagram socket when address is a path
+
+        :param metrics: a Metrics
+        :param address: 'host:port' or a socket path
+        """
+        super(StatsdExporter, self).__init__()
+
+        self.metrics = metrics
+        if address.startswith('/'):
+            self.address = address
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            host, _, port = address.rpartition(':')
+            self.address = (host or 'localhost', int(port))
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._counters = {}
+
+    def lines(self):
+        prefix = self.metrics.prefix + '.' if self.metrics.prefix else ''
+        counters, gauges, timings = self.metrics.snapshot()
+
+        lines = []
+        for name, value in sorted(counters.iteritems()):
+            # statsd counters are deltas
+            delta = value - self._counters.get(name, 0)
+            self._counters[name] = value
+            if delta:
+                lines.append('%s%s:%d|c' % (prefix, name, delta))
+        for name, value in sorted(gauges.iteritems()):
+            lines.append('%s%s:%s|g' % (prefix, name, value))
+        for name, (samples, count) in sorted(self.metrics.drain_samples().iteritems()):
+            rate = '|@%.4f' % (float(len(samples)) / count) if len(samples) < count else ''
+            lines.extend('%s%s:%.3f|ms%s' % (prefix, name, seconds * 1000, rate) for seconds in samples)
+        return lines
+
+    def flush(self):
+        packet = []
+        packet_size = 0
+        for line in self.lines():
+            # stay under a typical mtu
+            if packet and packet_size + len(line) > 1400:
+                self._send('\n'.join(packet))
+                packet, packet_size = [], 0
+            packet.append(line)
+            packet_size += len(line) + 1
+        if packet:
+            self._send('\n'.join(packet))
+
+    def _send(self, data):
+        try:
+            self.socket.sendto(data, self.address)
+        except socket.error as e:
+            log.debug('statsd send failed: %s', e)
+
+    def close(self):
+        self.socket.close()
+
+
+class PrometheusTextExporter(object):
+    def __init__(self, metrics, path):
+        """
+        write metrics in the prometheus text exposition format, e.g. for node_exporter's textfile collector. the file
+        is replaced atomically on each flush.
+
+        :param metrics: a Metrics
+        :param path:
+        """
+        super(PrometheusTextExporter, self).__init__()
+
+        self.metrics = metrics
+        self.path = path
+
+    def _name(self, name):
+        prefix = self.metrics.prefix + '_' if self.metrics.prefix else ''
+        return prefix + ''.join(c if c.isalnum() else '_' for c in name)
+
+    def text(self):
+        counters, gauges, timings = self.metrics.snapshot()
+        # the samples only feed statsd
+        self.metrics.drain_samples()
+
+        lines = []
+        for name, value in sorted(counters.iteritems()):
+            name = self._name(name) + '_total'
+            lines.extend(['# TYPE %s counter' % name, '%s %d' % (name, value)])
+        for name, value in sorted(gauges.iteritems()):
+            name = self._name(name)
+            lines.extend(['# TYPE %s gauge' % name, '%s %s' % (name, value)])
+        for name, (count, total, maximum) in sorted(timings.iteritems()):
+            name = self._name(name) + '_seconds'
+            lines.extend([
+                '# TYPE %s summary' % name,
+                '%s_count %d' % (name, count),
+                '%s_sum %f' % (name, total),
+                '# TYPE %s_max gauge' % name,
+                '%s_max %f' % (name, maximum),
+            ])
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        try:
+            write_atomic(self.path, self.text(), prefix='.metrics-')
+        except (IOError, OSError) as e:
+            log.debug('metrics write failed: %s', e)
+
+    def close(self):
+        pass
+
+
+_metrics = NullMetrics()
+_exporters = []
+_caches = []
+_flush_thread = None
+_stopped = threading.Event()
+
+
+def get():
+    """
+
+    :return: the active metrics, a NullMetrics unless configure() has been called
+    """
+    return _metrics
+
+
+def timer(name):
+    return _metrics.timer(name)
+
+
+def timing(name, seconds):
+    _metrics.timing(name, seconds)
+
+
+def increment(name, value=1):
+    _metrics.increment(name, value)
+
+
+def gauge(name, value):
+    _metrics.gauge(name, value)
+
+
+def register_cache(cache):
+    """
+    report a cache's hit ratio, size and evictions as gauges on each flush
+
+    :param cache: an LRUCache
+    """
+    _caches.append(cache)
+
+
+def flush():
+    for exporter in _exporters:
+        try:
+            exporter.flush()
+        except Exception:
+            log.exception('metrics export failed')
+
+
+def configure(statsd_address=None, prometheus_path=None, prefix=DEFAULT_PREFIX, flush_interval=DEFAULT_FLUSH_INTERVAL,
+              metrics=None):
+    """
+    turn metrics on and export them periodically; with no exporter and no metrics object, metrics go back to no-ops
+
+    :param statsd_address: 'host:port' or a unix datagram socket path
+    :param prometheus_path: a file to write prometheus text to
+    :param prefix:
+    :param flush_interval: seconds between exports
+    :param metrics: a custom metrics object, e.g. a tracing adapter with the same timer/timing/increment/gauge methods
+    """
+    global _metrics, _flush_thread
+    close()
+
+    if metrics is None and (statsd_address or prometheus_path):
+        metrics = Metrics(prefix=prefix)
+    _metrics = metrics if metrics is not None else NullMetrics()
+
+    if statsd_address:
+        _exporters.append(StatsdExporter(_metrics, statsd_address))
+    if prometheus_path:
+        _exporters.append(PrometheusTextExporter(_metrics, prometheus_path))
+
+    if _exporters and flush_interval:
+        _stopped.clear()
+
+        def run():
+            while not _stopped.wait(flush_interval):
+                flush()
+
+        _flush_thread = threading.Thread(target=run, name='paste-metrics')
+        _flush_thread.daemon = True
+        _flush_thread.start()
+
+
+def close():
+    global _flush_thread
+    if _flush_thread is not None:
+        _stopped.set()
+        _flush_thread.join()
+        _flush_thread = None
+    flush()
+    while _exporters:
+        _exporters.pop().close()
+
+
+if getattr(env, 'metrics_statsd_address', None) or getattr(env, 'metrics_prometheus_path', None):
+    configure(statsd_address=getattr(env, 'metrics_statsd_address', None),
+              prometheus_path=getattr(env, 'metrics_prometheus_path', None),
+              prefix=getattr(env, 'metrics_prefix', DEFAULT_PREFIX),
+              flush_interval=getattr(env, 'metrics_flush_interval', DEFAULT_FLUSH_INTERVAL))
@@ -0,0 +1,82 @@
+import atexit
+import logging
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger('paste')
+
+from ..core.runtime import Runtime
+env = Runtime.get().env
+
+DEFAULT_IO_THREADS = 32
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def _pool(kind, size):
+    pool = _pools.get(kind)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(kind)
+            if pool is None:
+                pool = _pools[kind] = ThreadPool(size)
+    return pool
+
+
+def io_pool():
+    """
+    threads for blocking reads and subprocess pipes; they mostly wait, so there are many of them
+
+    :return:
+    """
+    return _pool('io', getattr(env, 'offload_io_threads', DEFAULT_IO_THREADS))
+
+
+def cpu_pool():
+    """
+    threads for compression; zlib, brotli and zstandard release the gil while they work, so one per cpu runs in
+    parallel
+
+    :return:
+    """
+    return _pool('cpu', getattr(env, 'offload_cpu_threads', None) or multiprocessing.cpu_count())
+
+
+def _run(func, args, kwargs, callback):
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if callback is not None:
+            callback(None, e)
+        raise
+    if callback is not None:
+        callback(result, None)
+    return result
+
+
+def submit(pool, func, args=(), kwargs=None, callback=None):
+    """
+    run func on pool instead of the calling thread, e.g. an event loop
+
+    :param pool: io_pool() or cpu_pool()
+    :param func:
+    :param args:
+    :param kwargs:
+    :param callback: called from the pool thread with (result, None) or (None, exception); an event loop should hand
+        it back to its own thread e.g. with tornado's IOLoop.add_callback
+    :return: a multiprocessing AsyncResult; get() returns the result or re-raises the exception
+    """
+    return pool.apply_async(_run, (func, args, kwargs or {}, callback))
+
+
+def close():
+    with _lock:
+        for pool in _pools.itervalues():
+            pool.close()
+            pool.join()
+        _pools.clear()
+
+
+atexit.register(close)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+"""
+offline planner that splits the modules pages request into a small set of shared chunk bundles
+
+    python -m paste.source.planner --content-type js --output plan.json requests.log
+"""
+import sys
+import json
+import heapq
+import logging
+import optparse
+import itertools
+import collections
+
+log = logging.getLogger('paste')
+
+from .index import get_dependency_index, iter_bits
+
+# the cost of one extra request, in bytes, when weighing a merge that saves pages a request
+DEFAULT_REQUEST_OVERHEAD_BYTES = 2048
+DEFAULT_MAX_CHUNKS = 16
+DEFAULT_MAX_GROUPS = 256
+
+Chunk = collections.namedtuple('Chunk', ['names', 'byte_size', 'bits'])
+
+
+def read_request_log(lines):
+    """
+    parse a log of requested dependency strings, one per line, optionally prefixed with a count and a tab
+
+    :param lines:
+    :return: a Counter of dependency string -> count
+    """
+    requests = collections.Counter()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        count, _, dependencies = line.rpartition('\t')
+        requests[dependencies.strip()] += int(count) if count.strip() else 1
+    return requests
+
+
+def resolve_request_bits(index, dependencies):
+    """
+    the require-style closure of a dependency string, as a rank bitset
+
+    :param index: a DependencyIndex
+    :param dependencies:
+    :return:
+    """
+    bits = 0
+    for name in dependencies.split(','):
+        name = name.strip()
+        if name.endswith('.*'):
+            bits |= index.star_bits(name[:-2])
+        elif name:
+            bits |= index.closure_bits([name.split('+v', 1)[0]])
+    # star expansions need their own closures too
+    return index.closure_bits(index.names_from_bits(bits))
+
+
+def _lowest_rank(chunk):
+    return (chunk.bits & -chunk.bits).bit_length()
+
+
+def order_chunks(chunks, index):
+    """
+    order chunks so that each comes after every chunk holding one of its dependencies, taking the chunk with the
+    lowest ranked module first where that leaves a choice. chunks that depend on each other can't be ordered and are
+    merged into one.
+
+    :param chunks:
+    :param index: a DependencyIndex
+    :return: the ordered chunks
+    """
+    owners = {}
+    for i, chunk in enumerate(chunks):
+        for rank in iter_bits(chunk.bits):
+            owners[rank] = i
+
+    dependents = [[] for chunk in chunks]
+    blocking = [0] * len(chunks)
+    for i, chunk in enumerate(chunks):
+        needs = 0
+        for rank in iter_bits(chunk.bits):
+            needs |= index.closures[rank]
+        for j in set(owners[rank] for rank in iter_bits(needs & ~chunk.bits) if rank in owners):
+            dependents[j].append(i)
+            blocking[i] += 1
+
+    ready = [(_lowest_rank(chunk), i) for (i, chunk) in enumerate(chunks) if not blocking[i]]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        lowest_rank, i = heapq.heappop(ready)
+        ordered.append(chunks[i])
+        for j in dependents[i]:
+            blocking[j] -= 1
+            if not blocking[j]:
+                heapq.heappush(ready, (_lowest_rank(chunks[j]), j))
+
+    if len(ordered) < len(chunks):
+        # whatever is left is a dependency cycle or depends on one; everything it needs from outside is placed
+        cyclic = [chunk for (i, chunk) in enumerate(chunks) if blocking[i]]
+        bits = 0
+        for chunk in cyclic:
+            bits |= chunk.bits
+        log.warning('merging %d chunks with cyclic dependencies' % len(cyclic))
+        ordered.append(Chunk(tuple(index.names_from_bits(bits)),
+                             sum(chunk.byte_size or 0 for chunk in cyclic), bits))
+    return ordered
+
+
+class ChunkPlan(object):
+    def __init__(self, chunks, generation=None):
+        """
+
+        :param chunks: Chunks, each a set of modules bundled under one uri
+        :param generation: the manifest generation the plan was computed against
+        """
+        super(ChunkPlan, self).__init__()
+
+        self.chunks = chunks
+        self.generation = generation
+
+    def chunks_for(self, bits):
+        """
+
+        :param bits: a rank bitset of the modules a page needs
+        :return: the chunks covering bits, in plan order so that dependencies come first, and the bits no chunk
+            covers
+        """
+        covering = [chunk for chunk in self.chunks if chunk.bits & bits]
+        covered = 0
+        for chunk in covering:
+            covered |= chunk.bits
+        return covering, bits & ~covered
+
+    def rebase(self, index):
+        """
+        re-rank the chunks by name against another manifest generation, and re-order them by its dependencies;
+        modules that no longer exist are dropped
+
+        :param index: a DependencyIndex
+        :return: a plan ranked against index
+        """
+        if self.generation == index.generation:
+            return self
+
+        chunks = []
+        for chunk in self.chunks:
+            bits = index.bits(chunk.names)
+            if bits:
+                chunks.append(Chunk(tuple(index.names_from_bits(bits)), chunk.byte_size, bits))
+        return ChunkPlan(order_chunks(chunks, index), generation=index.generation)
+
+    def to_json(self):
+        return json.dumps({
+            'chunks': [{'names': list(chunk.names), 'byte_size': chunk.byte_size} for chunk in self.chunks],
+        }, indent=2)
+
+    @classmethod
+    def from_json(cls, data, content_type_manifest):
+        """
+
+        :param data:
+        :param content_type_manifest: the manifest to rank the chunks against
+        :return:
+        """
+        chunks = [Chunk(tuple(chunk['names']), chunk['byte_size'], 0) for chunk in json.loads(data)['chunks']]
+        return cls(chunks).rebase(get_dependency_index(content_type_manifest))
+
+
+class ChunkPlanner(object):
+    def __init__(self, content_type_manifest, request_overhead_bytes=DEFAULT_REQUEST_OVERHEAD_BYTES,
+                 max_chunks=DEFAULT_MAX_CHUNKS, max_groups=DEFAULT_MAX_GROUPS):
+        """
+        modules are first grouped by exactly which pages use them (zero waste, but many uris). groups are then merged
+        greedily, cheapest first, while a merge costs pages fewer wasted bytes than the requests it saves them, and
+        until there are at most max_chunks. widely shared modules end up together as the common core and the rest
+        collapse into per-section chunks. a merge that would leave two chunks depending on each other is never made,
+        so the chunks can always be served in dependency order.
+
+        :param content_type_manifest:
+        :param request_overhead_bytes: the byte cost assigned to each extra request
+        :param max_chunks:
+        :param max_groups: beyond this many groups the least requested are folded together by the page that requests
+            them most before the greedy merge, whose cost grows with the square of the number of groups
+        """
+        super(ChunkPlanner, self).__init__()
+
+        self.content_type_manifest = content_type_manifest
+        self.index = get_dependency_index(content_type_manifest)
+        self.request_overhead_bytes = request_overhead_bytes
+        self.max_chunks = max_chunks
+        self.max_groups = max_groups
+
+        manifest = content_type_manifest.manifest
+        self.byte_sizes = tuple(
+            (manifest.get(name).byte_size or 0) if manifest.get(name) is not None else 0 for name in self.index.names
+        )
+
+    def plan(self, requests):
+        """
+
+        :param requests: a mapping of dependency string -> count, e.g. from read_request_log()
+        :return: a ChunkPlan
+        """
+        page_bits = collections.Counter()
+        for dependencies, count in requests.iteritems():
+            bits = resolve_request_bits(self.index, dependencies)
+            if bits:
+                page_bits[bits] += count
+        pages = page_bits.items()
+        page_weights = [count for (bits, count) in pages]
+
+        # signature: the bitset of pages that need a module
+        signatures = collections.defaultdict(int)
+        for page, (bits, count) in enumerate(pages):
+            for rank in iter_bits(bits):
+                signatures[rank] |= 1 << page
+
+        groups = collections.defaultdict(int)
+        for rank, signature in signatures.iteritems():
+            groups[signature] |= 1 << rank
+
+        # the weight of a set of pages is the sum of their counts, taken bit by bit of the counts: a popcount of the
+        # pages whose count has that bit set. this runs once per candidate pair, so it must not walk the pages.
+        weight_masks = []
+        for bit in xrange(max(page_weights or [0]).bit_length()):
+            mask = 0
+            for page, count in enumerate(page_weights):
+                if count >> bit & 1:
+                    mask |= 1 << page
+            weight_masks.append((1 << bit, mask))
+
+        def weight(signature):
+            return sum(value * bin(signature & mask).count('1') for (value, mask) in weight_masks)
+
+        def byte_size(bits):
+            return sum(self.byte_sizes[rank] for rank in iter_bits(bits))
+
+        # live chunks: id -> [signature, module bits, byte size, weight]
+        ids = itertools.count()
+        chunks = {}
+        owners = {}
+        for signature, bits in groups.iteritems():
+            chunk_id = next(ids)
+            chunks[chunk_id] = [signature, bits, byte_size(bits), weight(signature)]
+            for rank in iter_bits(bits):
+                owners[rank] = chunk_id
+
+        # the chunks each chunk depends on. a module's pages all need its dependencies, so a group only depends on
+        # groups with strictly more pages and the initial chunks are acyclic.
+        depends_on = {}
+        for chunk_id, (signature, bits, size, chunk_weight) in chunks.iteritems():
+            needs = 0
+            for rank in iter_bits(bits):
+                needs |= self.index.closures[rank]
+            depends_on[chunk_id] = set(owners[rank] for rank in iter_bits(needs & ~bits))
+
+        def merge_cost(a, b):
+            signature_a, bits_a, size_a, weight_a = chunks[a]
+            signature_b, bits_b, size_b, weight_b = chunks[b]
+            saved_requests = weight(signature_a & signature_b)
+            wasted_bytes = (weight_a - saved_requests) * size_b + (weight_b - saved_requests) * size_a
+            return wasted_bytes - saved_requests * self.request_overhead_bytes
+
+        def creates_cycle(a, b):
+            # merging a and b closes a cycle iff a chunk depending on neither of them is reachable from one and
+            # reaches either
+            pending = list((depends_on[a] | depends_on[b]) - set([a, b]))
+            seen = set(pending)
+            while pending:
+                for other in depends_on[pending.pop()]:
+                    if other == a or other == b:
+                        return True
+                    if other not in seen:
+                        seen.add(other)
+                        pending.append(other)
+            return False
+
+        def merge(a, b):
+            signature_a, bits_a, size_a, weight_a = chunks.pop(a)
+            signature_b, bits_b, size_b, weight_b = chunks.pop(b)
+            merged = next(ids)
+            chunks[merged] = [signature_a | signature_b, bits_a | bits_b, size_a + size_b,
+                              weight(signature_a | signature_b)]
+            depends_on[merged] = (depends_on.pop(a) | depends_on.pop(b)) - set([a, b])
+            for other_depends_on in depends_on.itervalues():
+                if a in other_depends_on or b in other_depends_on:
+                    other_depends_on.difference_update((a, b))
+                    other_depends_on.add(merged)
+            return merged
+
+        if len(chunks) > self.max_groups:
+            # keep the most requested half of max_groups as they are; fold each of the rest into one chunk per page
+            folds = {}
+            for chunk_id in sorted(chunks, key=lambda chunk_id: chunks[chunk_id][3])[:-(self.max_groups // 2) or None]:
+                page = max(iter_bits(chunks[chunk_id][0]), key=page_weights.__getitem__)
+                fold = folds.get(page)
+                if fold is None:
+                    folds[page] = chunk_id
+                elif not creates_cycle(fold, chunk_id):
+                    folds[page] = merge(fold, chunk_id)
+
+        def push_merges(a, others):
+            signature_a = chunks[a][0]
+            for b in others:
+                if b != a and (signature_a & chunks[b][0] or not shared_page_only):
+                    heapq.heappush(heap, (merge_cost(a, b), a, b))
+
+        # only chunks that share a page can save a request by merging. chunks with nothing in common are weighed
+        # once that runs out while there are still too many chunks.
+        shared_page_only = True
+        heap = []
+        for a, b in itertools.combinations(chunks, 2):
+            if chunks[a][0] & chunks[b][0]:
+                heap.append((merge_cost(a, b), a, b))
+        heapq.heapify(heap)
+
+        while len(chunks) > 1:
+            if not heap:
+                if not shared_page_only or len(chunks) <= self.max_chunks:
+                    break
+                shared_page_only = False
+                heap = [(merge_cost(a, b), a, b) for (a, b) in itertools.combinations(chunks, 2)]
+                heapq.heapify(heap)
+                continue
+
+            cost, a, b = heapq.heappop(heap)
+            if a not in chunks or b not in chunks:
+                continue
+            if cost > 0 and len(chunks) <= self.max_chunks:
+                break
+            if creates_cycle(a, b):
+                continue
+
+            merged = merge(a, b)
+            push_merges(merged, [other for other in chunks if other != merged])
+
+        planned = [
+            Chunk(tuple(self.index.names_from_bits(bits)), size, bits)
+            for (signature, bits, size, chunk_weight) in chunks.itervalues()
+        ]
+        return ChunkPlan(order_chunks(planned, self.index), generation=self.index.generation)
+
+    def expected_cost(self, plan, requests):
+        """
+
+        :param plan:
+        :param requests: a mapping of dependency string -> count
+        :return: (mean bytes downloaded per page, mean requests per page, distinct uris)
+        """
+        total_bytes = total_requests = total_count = 0
+        uris = set()
+        for dependencies, count in requests.iteritems():
+            bits = resolve_request_bits(self.index, dependencies)
+            covering, uncovered = plan.chunks_for(bits)
+            total_bytes += count * (sum(chunk.byte_size for chunk in covering) +
+                                    sum(self.byte_sizes[rank] for rank in iter_bits(uncovered)))
+            total_requests += count * (len(covering) + (1 if uncovered else 0))
+            total_count += count
+            uris.update(chunk.names for chunk in covering)
+            if uncovered:
+                uris.add(uncovered)
+        if not total_count:
+            return 0.0, 0.0, 0
+        return float(total_bytes) / total_count, float(total_requests) / total_count, len(uris)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] REQUEST_LOG...')
+    parser.add_option('--content-type', dest='content_type', default='js')
+    parser.add_option('--output', dest='output', help='where to write the plan json; defaults to stdout')
+    parser.add_option('--max-chunks', dest='max_chunks', type='int', default=DEFAULT_MAX_CHUNKS)
+    parser.add_option('--max-groups', dest='max_groups', type='int', default=DEFAULT_MAX_GROUPS)
+    parser.add_option('--request-overhead', dest='request_overhead_bytes', type='int',
+                      default=DEFAULT_REQUEST_OVERHEAD_BYTES)
+    options, args = parser.parse_args(argv)
+
+    from .jammer import Jammer
+
+    requests = collections.Counter()
+    for filename in args or ['-']:
+        with (sys.stdin if filename == '-' else open(filename)) as request_log:
+            requests.update(read_request_log(request_log))
+
+    content_type_manifest = Jammer(content_type=options.content_type).content_type_manifest
+    planner = ChunkPlanner(content_type_manifest, request_overhead_bytes=options.request_overhead_bytes,
+                           max_chunks=options.max_chunks, max_groups=options.max_groups)
+    plan = planner.plan(requests)
+
+    mean_bytes, mean_requests, uris = planner.expected_cost(plan, requests)
+    sys.stderr.write('%d chunks; %.0f bytes and %.2f requests per page; %d distinct uris\n' % (
+        len(plan.chunks), mean_bytes, mean_requests, uris))
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(plan.to_json())
+    else:
+        sys.stdout.write(plan.to_json() + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,352 @@
+import os
+import mmap
+import time
+import fcntl
+import errno
+import struct
+import hashlib
+import threading
+import contextlib
+
+MAGIC = 'PSBC'
+FORMAT_VERSION = 1
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_SLOTS = 16384
+# a view handed to a reader is not overwritten for at least this many seconds
+DEFAULT_GRACE = 30.0
+MAX_PROBES = 32
+READ_ATTEMPTS = 3
+
+# magic, format version, slot count, data size, head, extent, seq, inserts, evictions
+_HEADER = struct.Struct('<4sII4xQQQQQQ')
+_HEADER_SIZE = 128
+_DATA_SIZE_OFFSET = 16
+_HEAD_OFFSET = 24
+_EXTENT_OFFSET = 32
+_SEQ_OFFSET = 40
+_INSERTS_OFFSET = 48
+_EVICTIONS_OFFSET = 56
+_Q = struct.Struct('<Q')
+
+# state, referenced, key digest, record offset, payload length, last access
+_SLOT = struct.Struct('<BB2x16sQQd4x')
+_SLOT_REFERENCED_OFFSET = 1
+_SLOT_LAST_ACCESS_OFFSET = 36
+_D = struct.Struct('<d')
+
+_EMPTY, _LIVE, _TOMBSTONE = 0, 1, 2
+
+# slot index (-1 for a dead record), reserved, span including this header
+_RECORD = struct.Struct('<iIQ')
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class SharedCacheError(Exception):
+    pass
+
+
+class SharedBundleCache(object):
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, slots=DEFAULT_SLOTS, grace=DEFAULT_GRACE):
+        """
+        a host-wide cache of built bundles in a memory mapped arena file, shared by every worker process that opens
+        the same path. readers take no lock and get zero-copy views; writers are serialized with fcntl record locks.
+
+        the data region is a ring of records. an insert reclaims the records at the head in order, except that a
+        record read since it was written gets a second chance (it is skipped and its read flag is cleared), so
+        eviction approximates least recently used. a record read within the last `grace` seconds is never reclaimed;
+        an insert that would need one fails instead.
+
+        an arena's layout is never changed once it is mapped, so each format version and size gets its own file next
+        to path. workers still running with another size keep theirs, and arena files no worker uses any more can be
+        deleted.
+
+        :param path: the arena file's prefix; the file is created if it doesn't exist
+        :param max_bytes: the size of the data region
+        :param slots: the number of hash index slots
+        :param grace: seconds a returned view stays valid
+        :raise SharedCacheError: if the arena file exists but isn't a valid arena of this layout
+        """
+        super(SharedBundleCache, self).__init__()
+
+        self.path = '%s.v%d-%d-%d' % (os.path.abspath(path), FORMAT_VERSION, slots, _align(max_bytes))
+        self.grace = grace
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            with self._locked():
+                self._initialize(max_bytes, slots)
+        except:
+            os.close(self._fd)
+            raise
+
+        size = os.fstat(self._fd).st_size
+        self._map = mmap.mmap(self._fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        magic, version, self.slot_count, self.data_size = _HEADER.unpack_from(self._map, 0)[:4]
+        self._slots_offset = _HEADER_SIZE
+        self._data_offset = _HEADER_SIZE + _align(self.slot_count * _SLOT.size)
+
+    def _initialize(self, max_bytes, slots):
+        data_size = _align(max_bytes)
+        size = _HEADER_SIZE + _align(slots * _SLOT.size) + data_size
+        file_size = os.fstat(self._fd).st_size
+        if not file_size:
+            # a new arena: it is initialized under the lock before anyone maps it
+            os.ftruncate(self._fd, size)
+            os.write(self._fd, _HEADER.pack(MAGIC, FORMAT_VERSION, slots, data_size, 0, 0, 0, 0, 0))
+            return
+
+        header = os.read(self._fd, _HEADER.size)
+        if len(header) == _HEADER.size and file_size == size:
+            magic, version, slot_count, header_data_size = _HEADER.unpack(header)[:4]
+            if (magic, version, slot_count, header_data_size) == (MAGIC, FORMAT_VERSION, slots, data_size):
+                return
+        # resizing it in place would fault every worker that has it mapped
+        raise SharedCacheError('%s is not a version %d shared bundle cache of %d slots and %d bytes' % (
+            self.path, FORMAT_VERSION, slots, data_size))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # record locks exclude other processes; the thread lock excludes this process's other threads
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    @classmethod
+    def digest(cls, key):
+        """
+
+        :param key: e.g. Jammer.uri and a content coding
+        :return:
+        """
+        if isinstance(key, tuple):
+            key = '\0'.join(str(part) for part in key)
+        return hashlib.md5(key).digest()
+
+    def _get_q(self, offset):
+        return _Q.unpack_from(self._map, offset)[0]
+
+    def _set_q(self, offset, value):
+        _Q.pack_into(self._map, offset, value)
+
+    def _slot_offset(self, index):
+        return self._slots_offset + index * _SLOT.size
+
+    def _read_slot(self, index):
+        return _SLOT.unpack_from(self._map, self._slot_offset(index))
+
+    def _probe(self, digest):
+        start = _Q.unpack_from(digest)[0] % self.slot_count
+        for i in xrange(min(MAX_PROBES, self.slot_count)):
+            yield (start + i) % self.slot_count
+
+    def _find(self, digest):
+        for index in self._probe(digest):
+            state, referenced, slot_digest, offset, length, last_access = self._read_slot(index)
+            if state == _EMPTY:
+                return None
+            if state == _LIVE and slot_digest == digest:
+                return index, offset, length
+        return None
+
+    def get(self, key):
+        """
+
+        :param key:
+        :return: a read-only zero-copy buffer over the cached bundle, or None
+        """
+        digest = self.digest(key)
+        for attempt in xrange(READ_ATTEMPTS):
+            seq = self._get_q(_SEQ_OFFSET)
+            if seq & 1:
+                # a writer is mid-update
+                continue
+            found = self._find(digest)
+            if found is None:
+                if self._get_q(_SEQ_OFFSET) == seq:
+                    break
+                continue
+
+            index, offset, length = found
+            # mark the read before validating, so that a writer starting after validation sees it
+            slot_offset = self._slot_offset(index)
+            _D.pack_into(self._map, slot_offset + _SLOT_LAST_ACCESS_OFFSET, time.time())
+            self._map[slot_offset + _SLOT_REFERENCED_OFFSET] = '\x01'
+            if self._get_q(_SEQ_OFFSET) == seq:
+                self.hits += 1
+                return buffer(self._map, self._data_offset + offset + _RECORD.size, length)
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """
+        publish a bundle; keys are expected to identify immutable content, so an existing entry is kept as it is
+
+        :param key:
+        :param value:
+        :return: True if the bundle is in the cache
+        """
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        need = _align(_RECORD.size + len(value))
+        # no single bundle may take more than a quarter of the arena
+        if need > self.data_size / 4:
+            return False
+
+        digest = self.digest(key)
+        now = time.time()
+        with self._locked():
+            seq = self._get_q(_SEQ_OFFSET)
+            self._set_q(_SEQ_OFFSET, seq + 1)
+            try:
+                if self._find(digest) is not None:
+                    return True
+                index = self._free_slot(digest, now)
+                if index is None:
+                    return False
+                offset = self._allocate(need, now)
+                if offset is None:
+                    return False
+
+                span = _RECORD.unpack_from(self._map, self._data_offset + offset)[2]
+                _RECORD.pack_into(self._map, self._data_offset + offset, index, 0, span)
+                start = self._data_offset + offset + _RECORD.size
+                self._map[start:start + len(value)] = value
+                # last access stays 0 until a reader asks for it, so an unread entry isn't held for the grace period
+                _SLOT.pack_into(self._map, self._slot_offset(index), _LIVE, 0, digest, offset, len(value), 0.0)
+                self._set_q(_INSERTS_OFFSET, self._get_q(_INSERTS_OFFSET) + 1)
+                return True
+            finally:
+                self._set_q(_SEQ_OFFSET, seq + 2)
+
+    def _free_slot(self, digest, now):
+        oldest = None
+        for index in self._probe(digest):
+            state, referenced, slot_digest, offset, length, last_access = self._read_slot(index)
+            if state != _LIVE:
+                return index
+            if now - last_access >= self.grace and (oldest is None or last_access < oldest[1]):
+                oldest = index, last_access
+        if oldest is None:
+            return None
+        # the probe sequence is full: evict its least recently used entry
+        self._evict(oldest[0])
+        return oldest[0]
+
+    def _evict(self, index):
+        state, referenced, slot_digest, offset, length, last_access = self._read_slot(index)
+        record_slot, reserved, span = _RECORD.unpack_from(self._map, self._data_offset + offset)
+        if record_slot == index:
+            _RECORD.pack_into(self._map, self._data_offset + offset, -1, 0, span)
+        _SLOT.pack_into(self._map, self._slot_offset(index), _TOMBSTONE, 0, '\0' * 16, 0, 0, 0.0)
+        self._set_q(_EVICTIONS_OFFSET, self._get_q(_EVICTIONS_OFFSET) + 1)
+
+    def _live_slot(self, offset, record_slot):
+        if record_slot < 0:
+            return None
+        state, referenced, slot_digest, slot_offset, length, last_access = self._read_slot(record_slot)
+        if state != _LIVE or slot_offset != offset:
+            return None
+        return referenced, last_access
+
+    def _allocate(self, need, now):
+        """
+        claim `need` bytes at the ring head, reclaiming records as needed
+
+        :return: the offset of a dead record spanning at least need bytes, or None
+        """
+        head = self._get_q(_HEAD_OFFSET)
+        extent = self._get_q(_EXTENT_OFFSET)
+        wrapped = False
+        skipped = 0
+
+        start = head
+        while True:
+            if start + need > self.data_size:
+                if wrapped:
+                    return None
+                wrapped = True
+                start = 0
+                continue
+
+            # walk the records from start until enough of them have been reclaimed
+            span = 0
+            restart = None
+            while span < need:
+                position = start + span
+                if position >= extent:
+                    # nothing has been written past the extent
+                    span = need
+                    break
+                record_slot, reserved, record_span = _RECORD.unpack_from(self._map, self._data_offset + position)
+                live = self._live_slot(position, record_slot)
+                if live is not None:
+                    referenced, last_access = live
+                    if now - last_access < self.grace:
+                        return None
+                    if referenced and skipped < self.slot_count:
+                        # second chance: leave it where it is and continue after it
+                        self._map[self._slot_offset(record_slot) + _SLOT_REFERENCED_OFFSET] = '\x00'
+                        skipped += 1
+                        restart = position + record_span
+                        break
+                    self._evict(record_slot)
+                span += record_span
+
+            if restart is not None:
+                start = restart
+                continue
+
+            # mark everything reclaimed as dead, then split off whatever is left over
+            leftover = span - need
+            if start + span > extent:
+                extent = start + need
+                leftover = 0
+            elif leftover and leftover < _RECORD.size:
+                need, leftover = span, 0
+            _RECORD.pack_into(self._map, self._data_offset + start, -1, 0, need)
+            if leftover:
+                _RECORD.pack_into(self._map, self._data_offset + start + need, -1, 0, leftover)
+
+            self._set_q(_HEAD_OFFSET, start + need)
+            self._set_q(_EXTENT_OFFSET, extent)
+            return start
+
+    @property
+    def stats(self):
+        """
+
+
+        :return:
+        """
+        lengths = [slot[4] for slot in (self._read_slot(index) for index in xrange(self.slot_count))
+                   if slot[0] == _LIVE]
+        return {
+            'name': 'shared',
+            'path': self.path,
+            'entries': len(lengths),
+            'byte_size': sum(lengths),
+            'max_bytes': self.data_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'inserts': self._get_q(_INSERTS_OFFSET),
+            'evictions': self._get_q(_EVICTIONS_OFFSET),
+        }
+
+    def close(self):
+        self._map.close()
+        try:
+            os.close(self._fd)
+        except OSError as e:
+            if e.errno != errno.EBADF:
+                raise
@@ -0,0 +1,548 @@
+import os
+import math
+import mmap
+import time
+import errno
+import struct
+import logging
+import threading
+
+log = logging.getLogger('paste')
+
+from . import incremental
+from .files import write_atomic
+
+MAGIC = 'PSMS'
+FORMAT_VERSION = 1
+
+DEFAULT_CHECK_INTERVAL = 1.0
+
+# magic, format version, module count, string count, history count, dependency count, generation, created
+_HEADER = struct.Struct('<4sIIIIIQd')
+_HEADER_SIZE = 64
+
+# the value kinds of a version, so that it is restored as the type it was written as
+_NONE, _INT, _FLOAT, _STR, _UNICODE = range(5)
+
+# version kind, version string, path string, last modified, byte size
+_HISTORY = struct.Struct('<BxxxIIdq')
+
+_NO_SIZE = -1
+
+# (name, struct format code), in file order
+_SECTIONS = (
+    ('string_ends', 'I'),
+    ('string_data', 'c'),
+    ('names', 'I'),
+    ('paths', 'I'),
+    ('version_kinds', 'B'),
+    ('versions', 'I'),
+    ('last_modifieds', 'd'),
+    ('byte_sizes', 'q'),
+    ('removed', 'B'),
+    ('dependency_ends', 'I'),
+    ('dependency_ranks', 'I'),
+    ('history_ends', 'I'),
+    ('history', None),
+)
+_TABLE = struct.Struct('<' + 'QQ' * len(_SECTIONS))
+_CODES = dict(_SECTIONS)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def _encode_time(value):
+    return float('nan') if value is None else float(value)
+
+
+def _decode_time(value):
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def _version_kind(version):
+    if version is None:
+        return _NONE
+    if isinstance(version, (int, long)):
+        return _INT
+    if isinstance(version, float):
+        return _FLOAT
+    return _UNICODE if isinstance(version, unicode) else _STR
+
+
+def _decode_version(kind, literal):
+    if kind == _NONE:
+        return None
+    if kind == _INT:
+        return int(literal)
+    if kind == _FLOAT:
+        return float(literal)
+    return literal.decode('utf-8') if kind == _UNICODE else literal
+
+
+class _StringTable(object):
+    def __init__(self):
+        super(_StringTable, self).__init__()
+
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def intern_version(self, version):
+        kind = _version_kind(version)
+        if kind == _NONE:
+            return kind, self.intern('')
+        return kind, self.intern(repr(version) if kind == _FLOAT else version if kind >= _STR else str(version))
+
+
+def compile_snapshot(content_type_manifest, generation=0):
+    """
+    compile a manifest into the snapshot format: an interned string table, then flat arrays indexed by rank (the
+    module's position in sorted_deps), with each module's dependencies and version history as ranges of shared arrays
+
+    :param content_type_manifest:
+    :param generation: recorded in the snapshot, e.g. a deploy number
+    :return: the snapshot bytes
+    """
+    manifest = content_type_manifest.manifest
+    names = [name for (name, path, version) in content_type_manifest.sorted_deps]
+    ranks = dict((name, rank) for (rank, name) in enumerate(names))
+
+    strings = _StringTable()
+    arrays = dict((section, []) for (section, code) in _SECTIONS)
+    history = []
+    for name in names:
+        module = manifest[name]
+        arrays['names'].append(strings.intern(name))
+        arrays['paths'].append(strings.intern(module.path))
+        kind, version_id = strings.intern_version(module.version)
+        arrays['version_kinds'].append(kind)
+        arrays['versions'].append(version_id)
+        arrays['last_modifieds'].append(_encode_time(module.last_modified))
+        arrays['byte_sizes'].append(_NO_SIZE if module.byte_size is None else module.byte_size)
+        arrays['removed'].append(1 if module.removed else 0)
+
+        # dependencies outside the manifest can't be ranked; nothing resolves them anyway
+        arrays['dependency_ranks'].extend(ranks[dependency_name] for dependency_name in module.dependencies
+                                          if dependency_name in ranks)
+        arrays['dependency_ends'].append(len(arrays['dependency_ranks']))
+
+        for serialized_version in module.serialized_versions:
+            kind, version_id = strings.intern_version(serialized_version.get('version'))
+            byte_size = serialized_version.get('byte_size', module.byte_size)
+            history.append(_HISTORY.pack(
+                kind, version_id, strings.intern(serialized_version.get('path', module.path)),
+                _encode_time(serialized_version.get('last_modified')), _NO_SIZE if byte_size is None else byte_size
+            ))
+        arrays['history_ends'].append(len(history))
+
+    end = 0
+    for string in strings.strings:
+        end += len(string)
+        arrays['string_ends'].append(end)
+
+    sections = []
+    for section, code in _SECTIONS:
+        if section == 'string_data':
+            sections.append(''.join(strings.strings))
+        elif section == 'history':
+            sections.append(''.join(history))
+        else:
+            values = arrays[section]
+            sections.append(struct.pack('<%d%s' % (len(values), code), *values))
+
+    table = []
+    offset = _HEADER_SIZE + _align(_TABLE.size)
+    for data in sections:
+        table.extend((offset, len(data)))
+        offset += _align(len(data))
+
+    parts = [
+        _HEADER.pack(MAGIC, FORMAT_VERSION, len(names), len(strings.strings), len(history),
+                     len(arrays['dependency_ranks']), generation, time.time()).ljust(_HEADER_SIZE, '\0'),
+        _TABLE.pack(*table).ljust(_align(_TABLE.size), '\0')
+    ]
+    parts.extend(data.ljust(_align(len(data)), '\0') for data in sections)
+    return ''.join(parts)
+
+
+def write_snapshot(content_type_manifest, path, generation=0):
+    """
+    compile a manifest and publish it at path. the file is replaced by rename, so a process that has the previous
+    snapshot mapped keeps reading it undisturbed and SnapshotFile picks up the new one by its inode.
+
+    :param content_type_manifest:
+    :param path:
+    :param generation:
+    :return: the snapshot's size in bytes
+    """
+    data = compile_snapshot(content_type_manifest, generation=generation)
+    write_atomic(path, data, fsync=True)
+    return len(data)
+
+
+class SnapshotModule(object):
+    # the interface Jammer reads from primer manifest modules
+    __slots__ = ('name', 'path', 'version', 'last_modified', 'byte_size', 'dependencies', 'removed',
+                 '_snapshot', '_rank')
+
+    def __init__(self, name, path, version, last_modified, byte_size, dependencies, removed=False):
+        super(SnapshotModule, self).__init__()
+
+        self.name = name
+        self.path = path
+        self.version = version
+        self.last_modified = last_modified
+        self.byte_size = byte_size
+        self.dependencies = dependencies
+        self.removed = removed
+        self._snapshot = None
+        self._rank = None
+
+    @property
+    def serialized_versions(self):
+        """
+
+        :return: dicts of earlier versions, most recent first
+        """
+        if self._snapshot is None:
+            return ()
+        return self._snapshot.serialized_versions(self._rank)
+
+    def deserialize(self, serialized_version):
+        """
+
+        :param serialized_version:
+        :return: the module as it was at serialized_version
+        """
+        return SnapshotModule(self.name, serialized_version.get('path', self.path), serialized_version.get('version'),
+                              serialized_version.get('last_modified'),
+                              serialized_version.get('byte_size', self.byte_size), self.dependencies)
+
+
+class _SnapshotModules(object):
+    def __init__(self, snapshot):
+        """
+        name -> SnapshotModule, read out of the snapshot the first time each module is asked for
+
+        :param snapshot:
+        """
+        super(_SnapshotModules, self).__init__()
+
+        self._snapshot = snapshot
+        self._modules = {}
+
+    def get(self, name, default=None):
+        module = self._modules.get(name)
+        if module is None:
+            rank = self._snapshot.ranks.get(name)
+            if rank is None:
+                return default
+            module = self._modules[name] = self._snapshot.module(rank)
+        return module
+
+    def __getitem__(self, name):
+        module = self.get(name)
+        if module is None:
+            raise KeyError(name)
+        return module
+
+    def __contains__(self, name):
+        return name in self._snapshot.ranks
+
+    def __iter__(self):
+        return iter(self._snapshot.names)
+
+    def __len__(self):
+        return len(self._snapshot.names)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def keys(self):
+        return list(self._snapshot.names)
+
+    def itervalues(self):
+        return (self[name] for name in self._snapshot.names)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        return ((name, self[name]) for name in self._snapshot.names)
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class ManifestSnapshot(object):
+    def __init__(self, path, primer, content_type=None):
+        """
+        a read-only manifest generation backed by a memory mapped snapshot file. it stands in for
+        manifest.get_content_type_manifest() wherever Jammer reads the manifest, so it can be published with
+        incremental.publish(). loading maps the file and decodes the module names; every other field is read out
+        of the map on demand. the pages are the file's page cache, so workers forked after loading share them.
+
+        :param path: written by write_snapshot()
+        :param primer: reads primed files; it isn't part of the snapshot
+        :param content_type:
+        """
+        super(ManifestSnapshot, self).__init__()
+
+        self.path = os.path.abspath(path)
+        self.primer = primer
+        self.content_type = content_type
+
+        with open(self.path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            if file_stat.st_size < _HEADER_SIZE + _TABLE.size:
+                raise SnapshotError('%s is not a manifest snapshot' % self.path)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stamp = (file_stat.st_ino, file_stat.st_mtime, file_stat.st_size)
+
+        (magic, version, self.module_count, self.string_count, self.history_count, self.dependency_count,
+         self.generation, self.created) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise SnapshotError('%s is not a version %d manifest snapshot' % (self.path, FORMAT_VERSION))
+
+        table = _TABLE.unpack_from(self._map, _HEADER_SIZE)
+        self._offsets = {}
+        for i, (section, code) in enumerate(_SECTIONS):
+            offset, length = table[2 * i], table[2 * i + 1]
+            if offset + length > file_stat.st_size:
+                raise SnapshotError('%s is truncated' % self.path)
+            self._offsets[section] = offset
+
+        self._string_ends = self._array('string_ends', self.string_count)
+        self.names = tuple(self._string(string_id) for string_id in self._array('names', self.module_count))
+        self.ranks = dict((name, rank) for (rank, name) in enumerate(self.names))
+        self.manifest = _SnapshotModules(self)
+        self._sorted_deps = None
+        self._lock = threading.Lock()
+
+    def _array(self, section, count):
+        return struct.unpack_from('<%d%s' % (count, _CODES[section]), self._map, self._offsets[section])
+
+    def _value(self, section, index):
+        code = _CODES[section]
+        return struct.unpack_from('<' + code, self._map, self._offsets[section] + index * struct.calcsize(code))[0]
+
+    def _range(self, section, rank):
+        # the half-open range of rank's entries in a shared array
+        end = self._value(section, rank)
+        return (self._value(section, rank - 1) if rank else 0), end
+
+    def _string(self, string_id):
+        start = self._string_ends[string_id - 1] if string_id else 0
+        offset = self._offsets['string_data']
+        return self._map[offset + start:offset + self._string_ends[string_id]]
+
+    def _version(self, kind, string_id):
+        return _decode_version(kind, self._string(string_id))
+
+    @property
+    def sorted_deps(self):
+        """
+
+        :return: (name, path, version) in dependency order
+        """
+        if self._sorted_deps is None:
+            paths = self._array('paths', self.module_count)
+            kinds = self._array('version_kinds', self.module_count)
+            versions = self._array('versions', self.module_count)
+            sorted_deps = [
+                (name, self._string(paths[rank]), self._version(kinds[rank], versions[rank]))
+                for (rank, name) in enumerate(self.names)
+            ]
+            with self._lock:
+                if self._sorted_deps is None:
+                    self._sorted_deps = sorted_deps
+        return self._sorted_deps
+
+    def dependency_ranks(self, rank):
+        """
+
+        :param rank:
+        :return: the ranks of the module's direct dependencies
+        """
+        start, end = self._range('dependency_ends', rank)
+        if start == end:
+            return ()
+        return struct.unpack_from('<%dI' % (end - start), self._map, self._offsets['dependency_ranks'] + start * 4)
+
+    def direct_ranks(self):
+        """
+
+        :return: each module's dependency_ranks, by rank
+        """
+        dependency_ends = self._array('dependency_ends', self.module_count)
+        dependency_ranks = self._array('dependency_ranks', self.dependency_count)
+        start = 0
+        direct_ranks = []
+        for end in dependency_ends:
+            direct_ranks.append(dependency_ranks[start:end])
+            start = end
+        return direct_ranks
+
+    def module(self, rank):
+        """
+
+        :param rank:
+        :return: a new SnapshotModule
+        """
+        byte_size = self._value('byte_sizes', rank)
+        module = SnapshotModule(
+            self.names[rank],
+            self._string(self._value('paths', rank)),
+            self._version(self._value('version_kinds', rank), self._value('versions', rank)),
+            _decode_time(self._value('last_modifieds', rank)),
+            None if byte_size == _NO_SIZE else byte_size,
+            tuple(self.names[dependency_rank] for dependency_rank in self.dependency_ranks(rank)),
+            removed=bool(self._value('removed', rank))
+        )
+        module._snapshot = self
+        module._rank = rank
+        return module
+
+    def serialized_versions(self, rank):
+        """
+
+        :param rank:
+        :return: dicts of the module's earlier versions, most recent first
+        """
+        start, end = self._range('history_ends', rank)
+        serialized_versions = []
+        for i in xrange(start, end):
+            kind, version_id, path_id, last_modified, byte_size = _HISTORY.unpack_from(
+                self._map, self._offsets['history'] + i * _HISTORY.size)
+            serialized_versions.append({
+                'version': self._version(kind, version_id),
+                'path': self._string(path_id),
+                'last_modified': _decode_time(last_modified),
+                'byte_size': None if byte_size == _NO_SIZE else byte_size,
+            })
+        return tuple(serialized_versions)
+
+    def iter_history(self):
+        """
+        every module's earlier versions, read in one pass
+
+        :return: (rank, version, path, last_modified, byte_size) for each version, most recent first per module
+        """
+        history_ends = self._array('history_ends', self.module_count)
+        offset = self._offsets['history']
+        rank = 0
+        for i in xrange(self.history_count):
+            while history_ends[rank] <= i:
+                rank += 1
+            kind, version_id, path_id, last_modified, byte_size = _HISTORY.unpack_from(
+                self._map, offset + i * _HISTORY.size)
+            yield (rank, self._version(kind, version_id), self._string(path_id), _decode_time(last_modified),
+                   None if byte_size == _NO_SIZE else byte_size)
+
+    def materialize(self):
+        """
+        read every module and sorted_deps out of the snapshot now, e.g. in a master process before it forks, so that
+        workers inherit the objects instead of each building their own
+
+        :return: self
+        """
+        self.sorted_deps
+        for name in self.names:
+            self.manifest.get(name)
+        return self
+
+
+class SnapshotFile(object):
+    def __init__(self, path, primer, content_type=None, check_interval=DEFAULT_CHECK_INTERVAL):
+        """
+        the current ManifestSnapshot at path. a new generation is published by renaming a new snapshot over the
+        path; it is noticed by its inode at most once per check_interval seconds and swapped in with one reference
+        assignment, so a Jammer keeps the generation it started with. it can be published with incremental.publish().
+
+        :param path:
+        :param primer:
+        :param content_type:
+        :param check_interval:
+        """
+        super(SnapshotFile, self).__init__()
+
+        self.path = os.path.abspath(path)
+        self.primer = primer
+        self.content_type = content_type
+        self.check_interval = check_interval
+
+        self._current = ManifestSnapshot(self.path, primer, content_type=content_type)
+        self._checked = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """
+
+        :return: the latest ManifestSnapshot
+        """
+        now = time.time()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self.reload()
+        return self._current
+
+    def reload(self):
+        """
+        swap in the snapshot at path if it has been replaced; a snapshot that can't be loaded leaves the current one
+        in place
+
+        :return: whether a new snapshot was swapped in
+        """
+        try:
+            file_stat = os.stat(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        if (file_stat.st_ino, file_stat.st_mtime, file_stat.st_size) == self._current.stamp:
+            return False
+
+        with self._lock:
+            if (file_stat.st_ino, file_stat.st_mtime, file_stat.st_size) == self._current.stamp:
+                return False
+            try:
+                snapshot = ManifestSnapshot(self.path, self.primer, content_type=self.content_type)
+            except (IOError, OSError, SnapshotError) as e:
+                log.warning('could not load manifest snapshot %s: %s' % (self.path, e))
+                return False
+            # the old map is unmapped once the last Jammer reading it is gone
+            self._current = snapshot
+        log.debug('loaded manifest snapshot %s generation %d' % (self.path, snapshot.generation))
+        return True
+
+
+def publish_snapshot(content_type, path, primer, check_interval=DEFAULT_CHECK_INTERVAL):
+    """
+    make Jammer read content_type's manifest from the snapshot at path, following it as new snapshots are written
+
+    :param content_type:
+    :param path:
+    :param primer:
+    :param check_interval:
+    :return: the SnapshotFile
+    """
+    snapshot_file = SnapshotFile(path, primer, content_type=content_type, check_interval=check_interval)
+    incremental.publish(content_type, snapshot_file)
+    return snapshot_file
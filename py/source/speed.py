@@ -1,14 +1,90 @@
+import os
 import hashlib
+import logging
 import datetime
+import threading
 import zlib
-import gzip
-import StringIO
+import email.utils
+
+log = logging.getLogger('paste')
 
 from ..util import content_type_helper
 
 from ..core.runtime import Runtime
 env = Runtime.get().env
 
+from .cache import LRUCache, compression_cache, shared_bundle_cache
+from .files import write_atomic
+from . import encoding as content_encoding
+from . import metrics
+from . import offload
+
+GZIP_SIBLING_EXTENSION = '.gz'
+# formats that are compressed already, so a content coding only costs cpu
+PRECOMPRESSED_FILE_EXTENSIONS = frozenset(['.woff', '.woff2'])
+WEBP_SIBLING_EXTENSION = '.webp'
+
+# the compression_cache "encoding" of an optimized image
+IMAGE_VARIANT = 'image'
+
+GMT_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+EXPIRES_DELTA = datetime.timedelta(weeks=(52 * 10))
+MAX_AGE = (EXPIRES_DELTA.microseconds + (EXPIRES_DELTA.seconds + EXPIRES_DELTA.days * 24 * 3600) * 10 ** 6) / 10 ** 6
+
+DEFAULT_HEADER_CACHE_MAX_ENTRIES = 4096
+
+# capped by a number of bundles (or etags) rather than bytes
+_header_blocks = LRUCache(
+    max_entries=getattr(env, 'header_cache_max_entries', DEFAULT_HEADER_CACHE_MAX_ENTRIES),
+    name='headers'
+)
+_etags = LRUCache(
+    max_entries=getattr(env, 'header_cache_max_entries', DEFAULT_HEADER_CACHE_MAX_ENTRIES),
+    name='etags'
+)
+metrics.register_cache(_header_blocks)
+metrics.register_cache(_etags)
+
+# images being optimized in the background, so that concurrent requests don't optimize one twice
+_pending_images = set()
+_pending_images_lock = threading.Lock()
+
+# (second, Date, Expires): the date headers only change once a second
+_http_dates_memo = (None, None, None)
+
+
+def _http_dates():
+    global _http_dates_memo
+    now = datetime.datetime.utcnow()
+    second = now.replace(microsecond=0)
+    memo = _http_dates_memo
+    if memo[0] != second:
+        memo = _http_dates_memo = (second, now.strftime(GMT_DATE_FORMAT),
+                                   (now + EXPIRES_DELTA).strftime(GMT_DATE_FORMAT))
+    return now, memo[1], memo[2]
+
+
+def _request_header(request_headers, name):
+    # accept plain dicts, case-insensitive header mappings and wsgi environs
+    value = request_headers.get(name)
+    if value is None:
+        value = request_headers.get(name.lower())
+    if value is None:
+        value = request_headers.get('HTTP_' + name.upper().replace('-', '_'))
+    return value
+
+
+def _etag_matches(if_none_match, etag):
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
 
 class Speed(object):
     @classmethod
@@ -59,8 +135,7 @@ class Speed(object):
         content_type = content_type_helper.filename_to_content_type(filename=path)
 
         if force or content_type is not None:
-            now = datetime.datetime.utcnow()
-            expires = now + datetime.timedelta(weeks=(52 * 10))
+            now, date, expires = _http_dates()
 
             if browser_only == True or proxy_only == False:
                 if checksum is None:
@@ -71,20 +146,113 @@ class Speed(object):
                 elif last_modified is None or not isinstance(last_modified, datetime.datetime):
                     last_modified = now
 
-                gmt_date_format = '%a, %d %b %Y %H:%M:%S GMT'
-                set_header_func("Date", now.strftime(gmt_date_format))
-                set_header_func('ETag', hashlib.md5(checksum + '-' + str(last_modified)).hexdigest())
-                set_header_func("Expires", expires.strftime(gmt_date_format))
+                set_header_func("Date", date)
+                set_header_func('ETag', Speed.etag(checksum, last_modified))
+                set_header_func("Expires", expires)
                 set_header_func("ExpiresDefault", 'access plus 10 years')
-                set_header_func("Last-Modified", last_modified.strftime(gmt_date_format))
+                set_header_func("Last-Modified", last_modified.strftime(GMT_DATE_FORMAT))
 
             if proxy_only is True or browser_only is False:
-                age = expires - datetime.datetime.utcnow()
-
-                set_header_func("Cache-Control", "public, max-age=" + str(
-                    (age.microseconds + (age.seconds + age.days * 24 * 3600) * 10 ** 6) / 10 ** 6))
+                set_header_func("Cache-Control", "public, max-age=%d" % MAX_AGE)
                 set_header_func('Vary', 'Accept-Encoding')
 
+    @classmethod
+    def etag(cls, checksum, last_modified):
+        """
+
+        :param checksum:
+        :param last_modified: a datetime
+        :return:
+        """
+        etag_key = checksum + '-' + str(last_modified)
+        etag = _etags.get(etag_key)
+        if etag is None:
+            etag = hashlib.md5(etag_key).hexdigest()
+            _etags.set(etag_key, etag)
+        return etag
+
+    @classmethod
+    def bundle_headers(cls, jammer):
+        """
+        the caching headers of a bundle that don't depend on the time of the request, computed once per bundle from
+        its checksum and last_modified alone
+
+        :param jammer:
+        :return: a tuple of (name, value)
+        """
+        block_key = (jammer.checksum, jammer.last_modified)
+        headers = _header_blocks.get(block_key)
+        if headers is None:
+            last_modified = datetime.datetime.fromtimestamp(jammer.last_modified)
+            headers = (
+                ('ETag', Speed.etag(jammer.checksum, last_modified)),
+                ('ExpiresDefault', 'access plus 10 years'),
+                ('Last-Modified', last_modified.strftime(GMT_DATE_FORMAT)),
+                ('Cache-Control', 'public, max-age=%d' % MAX_AGE),
+                ('Vary', 'Accept-Encoding'),
+            )
+            _header_blocks.set(block_key, headers)
+        return headers
+
+    @classmethod
+    def set_bundle_headers(cls, jammer, set_header_func):
+        """
+        the jammer equivalent of header_caching(), from the precomputed header block
+
+        :param jammer:
+        :param set_header_func:
+        """
+        if env.compile_mode or not jammer.dependencies:
+            return
+
+        now, date, expires = _http_dates()
+        set_header_func('Date', date)
+        set_header_func('Expires', expires)
+        for name, value in Speed.bundle_headers(jammer):
+            set_header_func(name, value)
+
+    @classmethod
+    def is_not_modified(cls, request_headers, jammer):
+        """
+        decide whether a conditional request can be answered with a 304 from the bundle's checksum and last_modified;
+        the bundle contents are never touched
+
+        :param request_headers: a header mapping or wsgi environ
+        :param jammer:
+        :return:
+        """
+        if env.compile_mode or not jammer.dependencies or not request_headers:
+            return False
+
+        # if-none-match takes precedence over if-modified-since (rfc 7232 section 6)
+        if_none_match = _request_header(request_headers, 'If-None-Match')
+        if if_none_match is not None:
+            return _etag_matches(if_none_match, dict(Speed.bundle_headers(jammer))['ETag'])
+
+        if_modified_since = _request_header(request_headers, 'If-Modified-Since')
+        if if_modified_since:
+            parsed = email.utils.parsedate(if_modified_since)
+            if parsed is None:
+                return False
+            # compare in the same clock that Last-Modified was written in
+            return datetime.datetime.fromtimestamp(jammer.last_modified) <= datetime.datetime(*parsed[:6])
+
+        return False
+
+    @classmethod
+    def conditional_headers(cls, request_headers, jammer, set_header_func):
+        """
+        set the bundle's caching headers and report whether the request is answered by a 304 Not Modified, in which
+        case the handler should send no body
+
+        :param request_headers: a header mapping or wsgi environ
+        :param jammer:
+        :param set_header_func:
+        :return: True to respond 304
+        """
+        Speed.set_bundle_headers(jammer, set_header_func)
+        return Speed.is_not_modified(request_headers, jammer)
+
     @classmethod
     def browser_cache_headers(cls, path, set_header_func, last_modified, checksum=None, force=True):
         """
@@ -111,7 +279,8 @@ class Speed(object):
                              force=force)
 
     @classmethod
-    def compress_utf8(cls, response_body, set_header_func, path=None, skip_content_check=False, accept_encoding=''):
+    def compress_utf8(cls, response_body, set_header_func, path=None, skip_content_check=False, accept_encoding='',
+                      cache_key=None):
         """
 
         :param response_body:
@@ -119,43 +288,362 @@ class Speed(object):
         :param path:
         :param skip_content_check:
         :param accept_encoding:
+        :param cache_key: a key identifying an immutable body e.g. Jammer.uri; each encoding is compressed once per key
         :return:
         """
         if not response_body:
             return response_body
 
-        if ('gzip' in accept_encoding or 'deflate' in accept_encoding) and not Speed.skip_network(len(response_body)):
+        encoding = Speed._response_encoding(len(response_body), path, skip_content_check, accept_encoding)
+        if encoding:
+            response_body = Speed.compress_variant(response_body, encoding, cache_key=cache_key)
+            set_header_func('Content-Encoding', encoding)
+            set_header_func('Vary', 'Accept-Encoding')
+
+        return response_body
+
+    @classmethod
+    def acompress_utf8(cls, response_body, set_header_func, path=None, skip_content_check=False, accept_encoding='',
+                       cache_key=None, callback=None):
+        """
+        compress_utf8 with the compression offloaded to the cpu pool. headers are set from the calling thread before
+        this returns.
+
+        :param response_body:
+        :param set_header_func:
+        :param path:
+        :param skip_content_check:
+        :param accept_encoding:
+        :param cache_key:
+        :param callback: see offload.submit
+        :return: an AsyncResult of the response body
+        """
+        encoding = Speed._response_encoding(len(response_body), path, skip_content_check,
+                                            accept_encoding) if response_body else None
+        if not encoding:
+            return offload.submit(offload.cpu_pool(), lambda: response_body, callback=callback)
+
+        set_header_func('Content-Encoding', encoding)
+        set_header_func('Vary', 'Accept-Encoding')
+        return offload.submit(offload.cpu_pool(), Speed.compress_variant, (response_body, encoding),
+                              {'cache_key': cache_key}, callback=callback)
+
+    @classmethod
+    def _response_encoding(cls, byte_size, path, skip_content_check, accept_encoding):
+        """
+
+        :param byte_size: the uncompressed size, or None when it isn't known
+        :param path:
+        :param skip_content_check:
+        :param accept_encoding:
+        :return: the content coding to compress the response with, or None to send it as is
+        """
+        encoding = content_encoding.negotiate_encoding(accept_encoding)
+        # a client that refuses identity gets a compressed body no matter how small
+        if encoding and (byte_size is None or not Speed.skip_network(byte_size) or
+                         not content_encoding.identity_acceptable(accept_encoding)):
             content_type = content_type_helper.filename_to_content_type(
                 filename=path) if not skip_content_check and path is not None else None
 
             if skip_content_check == True or (
-                        content_type is not None and not content_type.is_image and not content_type.type == helpers._ContentType.Type.WOFF):
-                for encoding in [encoding.strip().lower() for encoding in accept_encoding.split(',')]:
-                    if encoding == 'deflate':
-                        response_body = zlib.compress(response_body)[2:-4]
-                        set_header_func('Content-Encoding', 'deflate')
-                        break
-                    elif encoding == 'gzip':
-                        file_obj = StringIO.StringIO()
-                        gzipped_file = gzip.GzipFile(fileobj=file_obj, mode='wb')
-                        gzipped_file.write(response_body)
-                        gzipped_file.close()
-                        response_body = file_obj.getvalue()
-                        set_header_func('Content-Encoding', 'gzip')
-                        break
+                    content_type is not None and not content_type.is_image and
+                    content_type.file_extension not in PRECOMPRESSED_FILE_EXTENSIONS):
+                return encoding
+        return None
 
-                set_header_func('Vary', 'Accept-Encoding')
+    @classmethod
+    def compress_stream(cls, chunks, set_header_func, path=None, skip_content_check=False, accept_encoding='',
+                        byte_size=None, cache_key=None):
+        """
+        the streaming counterpart of compress_utf8: headers are set immediately and the returned iterator compresses
+        chunks incrementally, so the body is never held in memory whole
 
-        return response_body
+        :param chunks: an iterable of body chunks e.g. Jammer.iter_contents(); buffers are accepted, and are copied
+            to str when they go out uncompressed
+        :param set_header_func:
+        :param path:
+        :param skip_content_check:
+        :param accept_encoding:
+        :param byte_size: the uncompressed size, if known, for the network threshold check
+        :param cache_key: when a compressed variant is already cached under this key, it is served as is
+        :return: an iterator of (possibly compressed) chunks
+        """
+        encoding = Speed._response_encoding(byte_size, path, skip_content_check, accept_encoding)
+        if encoding:
+            set_header_func('Content-Encoding', encoding)
+            set_header_func('Vary', 'Accept-Encoding')
+
+            compressed_body = Speed._cached_variant(cache_key, encoding) if cache_key is not None else None
+            if compressed_body is not None:
+                return iter([compressed_body])
+            return Speed._iter_compressed(chunks, encoding)
+
+        # a wsgi body is an iterable of str; str() of a str is the same object, so only buffers are copied
+        return (str(chunk) for chunk in chunks)
 
     @classmethod
-    def compress_image(cls, response_body, path=None, skip_content_check=False):
+    def acompress_stream(cls, chunks, set_header_func, on_chunk, path=None, skip_content_check=False,
+                         accept_encoding='', byte_size=None, cache_key=None, callback=None):
+        """
+        compress_stream driven from the cpu pool: headers are set before this returns, then each (possibly compressed)
+        chunk is pushed to on_chunk from a pool thread as soon as it is ready
+
+        :param chunks:
+        :param set_header_func:
+        :param on_chunk: called with each response chunk, in order
+        :param path:
+        :param skip_content_check:
+        :param accept_encoding:
+        :param byte_size:
+        :param cache_key:
+        :param callback: called once the stream is done; see offload.submit
+        :return: an AsyncResult of the number of bytes pushed
+        """
+        response_chunks = Speed.compress_stream(chunks, set_header_func, path=path,
+                                                skip_content_check=skip_content_check,
+                                                accept_encoding=accept_encoding, byte_size=byte_size,
+                                                cache_key=cache_key)
+
+        def push():
+            pushed = 0
+            for chunk in response_chunks:
+                on_chunk(chunk)
+                pushed += len(chunk)
+            return pushed
+
+        return offload.submit(offload.cpu_pool(), push, callback=callback)
+
+    @classmethod
+    def _iter_compressed(cls, chunks, encoding):
+        compressor = content_encoding.compressor(encoding)
+        bytes_in = bytes_out = 0
+        for chunk in chunks:
+            bytes_in += len(chunk)
+            compressed_chunk = compressor.compress(chunk)
+            if compressed_chunk:
+                bytes_out += len(compressed_chunk)
+                yield compressed_chunk
+        compressed_chunk = compressor.flush()
+        if compressed_chunk:
+            bytes_out += len(compressed_chunk)
+            yield compressed_chunk
+        metrics.increment('speed.stream.bytes_in', bytes_in)
+        metrics.increment('speed.stream.bytes_out', bytes_out)
+
+    @classmethod
+    def compress_jammer_stream(cls, jammer, set_header_func, accept_encoding=''):
+        """
+
+        :param jammer:
+        :param set_header_func:
+        :param accept_encoding:
+        :return: an iterator of response chunks
+        """
+        return Speed.compress_stream(jammer.iter_contents(view=True), set_header_func, skip_content_check=True,
+                                     accept_encoding=accept_encoding, byte_size=jammer.byte_size,
+                                     cache_key=None if jammer.is_debug else jammer.uri)
+
+    @classmethod
+    def negotiate_encoding(cls, accept_encoding):
+        """
+
+        :param accept_encoding:
+        :return: the content coding to respond with, or None for identity
+        """
+        return content_encoding.negotiate_encoding(accept_encoding)
+
+    @classmethod
+    def compress_variant(cls, response_body, encoding, cache_key=None, level=None):
         """
 
+        :param response_body:
+        :param encoding: one of content_encoding.SERVER_PREFERENCE
+        :param cache_key: when given, the compressed variant is stored under (cache_key, encoding)
+        :param level: defaults to the configured level for encoding
+        :return:
+        """
+        if cache_key is None:
+            return Speed._encode(response_body, encoding, level)
+
+        variant_key = (cache_key, encoding)
+        compressed_body = Speed._cached_variant(cache_key, encoding)
+        if compressed_body is None:
+            compressed_body = Speed._encode(response_body, encoding, level)
+            compression_cache.set(variant_key, compressed_body)
+            if shared_bundle_cache is not None:
+                shared_bundle_cache.set(variant_key, compressed_body)
+        return compressed_body
+
+    @classmethod
+    def _cached_variant(cls, cache_key, encoding):
+        """
+
+        :param cache_key:
+        :param encoding:
+        :return: the compressed variant from this process's cache or the host's shared cache
+        """
+        compressed_body = compression_cache.get((cache_key, encoding))
+        if compressed_body is None and shared_bundle_cache is not None:
+            compressed_body = shared_bundle_cache.get((cache_key, encoding))
+            if compressed_body is not None:
+                # a shared view is only held for the cache's grace period, which a slow client can outlast
+                compressed_body = str(compressed_body)
+        return compressed_body
+
+    @classmethod
+    def _encode(cls, response_body, encoding, level=None):
+        with metrics.timer('speed.compress.' + encoding):
+            compressed_body = content_encoding.encode(response_body, encoding, level)
+        metrics.increment('speed.compress.bytes_in', len(response_body))
+        metrics.increment('speed.compress.bytes_out', len(compressed_body))
+        return compressed_body
+
+    @classmethod
+    def compress_jammer(cls, jammer, set_header_func, accept_encoding=''):
+        """
+
+        :param jammer:
+        :param set_header_func:
+        :param accept_encoding:
+        :return:
+        """
+        # debug uris carry no last_modified prefix, so they can't identify an immutable body
+        return Speed.compress_utf8(jammer.contents, set_header_func, skip_content_check=True,
+                                   accept_encoding=accept_encoding, cache_key=None if jammer.is_debug else jammer.uri)
+
+    @classmethod
+    def write_gzip_siblings(cls, filenames, level=None):
+        """
+        offline step: write a pre-gzipped copy next to each file so a front server can serve it directly
+
+        :param filenames:
+        :param level: defaults to the highest compression level
+        :return: the list of files written
+        """
+        if level is None:
+            level = zlib.Z_BEST_COMPRESSION
+
+        written = []
+        for filename in filenames:
+            sibling = filename + GZIP_SIBLING_EXTENSION
+            if os.path.exists(sibling) and os.path.getmtime(sibling) >= os.path.getmtime(filename):
+                continue
+
+            with open(filename, 'rb') as source_file:
+                compressed_body = content_encoding.encode(source_file.read(), content_encoding.GZIP, level)
+
+            write_atomic(sibling, compressed_body)
+            written.append(sibling)
+        return written
+
+    @classmethod
+    def compress_image(cls, response_body, path=None, skip_content_check=False, cache_key=None):
+        """
+        serve the optimized rendition of a png or jpeg, as primed by optimize_images. an image that hasn't been
+        optimized yet goes out as it is while it is optimized on the cpu pool, so no request waits on the optimizer.
+        the rendition has the same format, so the same caching headers apply.
+
         :param response_body:
         :param path:
         :param skip_content_check:
-        :raise:
+        :param cache_key: a key identifying an immutable image e.g. its path and mtime; the rendition is then also kept
+            in memory, and an image is optimized in the background even when the compressor's on-disk cache is off
+        :return: the response body
+        """
+        if not response_body:
+            return response_body
+
+        if not skip_content_check:
+            content_type = content_type_helper.filename_to_content_type(filename=path) if path is not None else None
+            if content_type is None or not content_type.is_image:
+                return response_body
+
+        # imported here so that serving text doesn't load the compressors
+        from . import compressor
+
+        file_type = compressor.image_optimizer.sniff(response_body)
+        if file_type is None:
+            return response_body
+
+        variant_key = (cache_key, IMAGE_VARIANT)
+        if cache_key is not None:
+            optimized_body = compression_cache.get(variant_key)
+            if optimized_body is not None:
+                return optimized_body
+
+        quality = getattr(env, 'image_jpeg_quality', None)
+        optimized_body = compressor.lookup(response_body, file_type, quality=quality)
+        if optimized_body is None:
+            if cache_key is not None or compressor.caching():
+                Speed._optimize_in_background(response_body, file_type, quality, cache_key)
+            return response_body
+
+        if cache_key is not None:
+            compression_cache.set(variant_key, optimized_body)
+        metrics.increment('speed.image.saved_bytes', len(response_body) - len(optimized_body))
+        return optimized_body
+
+    @classmethod
+    def _optimize_in_background(cls, response_body, file_type, quality, cache_key):
+        pending_key = cache_key if cache_key is not None else (file_type, len(response_body), hash(response_body))
+        with _pending_images_lock:
+            if pending_key in _pending_images:
+                return
+            _pending_images.add(pending_key)
+
+        def done(optimized_body, error):
+            with _pending_images_lock:
+                _pending_images.discard(pending_key)
+            if error is not None:
+                log.warning('could not optimize image: %s' % error)
+            elif cache_key is not None and optimized_body:
+                compression_cache.set((cache_key, IMAGE_VARIANT), optimized_body)
+
+        from . import compressor
+        compressor.compress_async(response_body, file_type, quality=quality, callback=done)
+
+    @classmethod
+    def optimize_images(cls, filenames, workers=None, quality=None, webp_quality=None):
         """
-        raise NotImplementedError
+        offline step: optimize images in a process pool and keep the results in the compressor's content-addressed
+        on-disk cache, keyed by each image's digest and the settings, where compress_image finds them. with
+        webp_quality, a .webp sibling is also written next to each image that has a smaller webp rendition, for a
+        front server to offer clients that accept image/webp.
+
+        :param filenames:
+        :param workers: defaults to the cpu count
+        :param quality: a jpeg quality for lossy re-encoding; defaults to env.image_jpeg_quality, or lossless only
+        :param webp_quality: when given, write webp siblings at this quality
+        :return: (filename, byte size, optimized byte size) for each png or jpeg
+        """
+        from . import compressor
+
+        if quality is None:
+            quality = getattr(env, 'image_jpeg_quality', None)
+        if not compressor.caching():
+            log.warning('the compressor cache is off: optimized images will not be kept for compress_image')
+
+        by_type = {}
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                content = f.read()
+            file_type = compressor.image_optimizer.sniff(content)
+            if file_type is not None:
+                by_type.setdefault(file_type, []).append((filename, content))
+
+        report = []
+        for file_type, images in sorted(by_type.iteritems()):
+            results = compressor.compress_many([content for (filename, content) in images], file_type,
+                                               workers=workers, quality=quality)
+            for result in results:
+                filename, content = images[result.index]
+                optimized_size = len(result.output) if result.returncode == 0 else len(content)
+                report.append((filename, len(content), optimized_size))
 
+            if webp_quality is not None and compressor.image_optimizer.can_encode(compressor.WEBP):
+                results = compressor.compress_many([content for (filename, content) in images], compressor.WEBP,
+                                                   workers=workers, quality=webp_quality)
+                for result in results:
+                    if result.returncode == 0 and result.output:
+                        write_atomic(images[result.index][0] + WEBP_SIBLING_EXTENSION, result.output)
+        return report
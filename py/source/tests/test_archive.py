@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..archive import PrimedArchive
+
+
+class _Module(object):
+    def __init__(self, path, removed=False):
+        super(_Module, self).__init__()
+
+        self.path = path
+        self.removed = removed
+
+
+class _Primer(object):
+    def __init__(self, primed):
+        super(_Primer, self).__init__()
+
+        self.primed = primed
+
+    def read_primed(self, filename):
+        if filename not in self.primed:
+            raise IOError('not primed: %s' % filename)
+        return self.primed[filename]
+
+
+class _Manifest(object):
+    def __init__(self, versions, primed, removed=()):
+        super(_Manifest, self).__init__()
+
+        self.manifest = dict((name, _Module('js/%s.js' % name, name in removed)) for name in versions)
+        self.sorted_deps = [(name, 'js/%s.js' % name, version) for (name, version) in sorted(versions.iteritems())]
+        self.primer = _Primer(primed)
+
+
+class PrimedArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = PrimedArchive(os.path.join(self.directory, 'archive'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.assertFalse(self.archive.has('app.main', 1))
+        self.assertIsNone(self.archive.read('app.main', 1))
+
+        self.assertTrue(self.archive.put('app.main', 1, 'main v1;'))
+        self.assertTrue(self.archive.put('app/util', '2.0', u'util \xe9;'))
+
+        # 1, 1.0 and '1.0' address the same version
+        for version in (1, 1.0, '1.0'):
+            self.assertTrue(self.archive.has('app.main', version))
+            self.assertEqual(self.archive.read('app.main', version), 'main v1;')
+        self.assertEqual(self.archive.read('app/util', 2), u'util \xe9;'.encode('utf-8'))
+        self.assertFalse(self.archive.has('app.main', 2))
+        self.assertEqual((self.archive.hits, self.archive.misses), (4, 1))
+
+    def test_versions_are_never_rewritten(self):
+        self.archive.put('app.main', 1, 'main v1;')
+        self.assertFalse(self.archive.put('app.main', 1.0, 'something else'))
+        self.assertFalse(self.archive.put('app.main', None, 'unversioned'))
+        self.assertEqual(self.archive.read('app.main', 1), 'main v1;')
+
+    def test_identical_content_is_stored_once_by_digest(self):
+        self.archive.put('app.main', 1, 'same;')
+        self.archive.put('app.main', 2, 'same;')
+        self.archive.put('app.other', 1, 'same;')
+
+        blobs = [name for (directory, directories, names) in os.walk(os.path.join(self.archive.directory, 'blobs'))
+                 for name in names]
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(self.archive.read('app.other', 1), 'same;')
+
+    def test_reopened_archive_reads_what_was_written(self):
+        self.archive.put('app.main', 1, 'main v1;')
+        self.assertEqual(PrimedArchive(self.archive.directory).read('app.main', '1'), 'main v1;')
+
+    def test_missing_content_is_a_miss(self):
+        self.archive.put('app.main', 1, 'main v1;')
+        shutil.rmtree(os.path.join(self.archive.directory, 'blobs'))
+        self.assertIsNone(self.archive.read('app.main', 1))
+
+    def test_archive_manifest(self):
+        manifest = _Manifest({'app.main': 2, 'app.util': 1, 'app.gone': 3},
+                             {'js/app.main.js': 'main v2;', 'js/app.util.js': 'util v1;'}, removed=('app.gone',))
+
+        self.assertEqual(self.archive.archive_manifest(manifest, names=['app.main']), 1)
+        self.assertFalse(self.archive.has('app.util', 1))
+        self.assertEqual(self.archive.archive_manifest(manifest), 1)
+        self.assertEqual(self.archive.read('app.util', 1), 'util v1;')
+        self.assertFalse(self.archive.has('app.gone', 3))
+        self.assertEqual(self.archive.archive_manifest(manifest), 0)
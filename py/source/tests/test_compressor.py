@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+from .. import compressor
+from ..compressor import pool as worker_pool
+from ..compressor.cache import CompiledAssetCache
+
+
+class CompiledAssetCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = CompiledAssetCache(os.path.join(self.directory, 'cache'), max_bytes=130)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        key = CompiledAssetCache.key(u'var \xe9;', 'JS', '--flag', 'jar-digest')
+        self.assertEqual(key, CompiledAssetCache.key(u'var \xe9;'.encode('utf-8'), 'js', '--flag', 'jar-digest'))
+        self.assertEqual(len(set([
+            key,
+            CompiledAssetCache.key(u'var a;', 'js', '--flag', 'jar-digest'),
+            CompiledAssetCache.key(u'var \xe9;', 'css', '--flag', 'jar-digest'),
+            CompiledAssetCache.key(u'var \xe9;', 'js', '', 'jar-digest'),
+            CompiledAssetCache.key(u'var \xe9;', 'js', '--flag', 'another-jar-digest'),
+        ])), 5)
+
+    def test_round_trip(self):
+        key = CompiledAssetCache.key('var a = 1;', 'js')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, u'var a=1;\xe9')
+        self.assertEqual(self.cache.get(key), u'var a=1;\xe9'.encode('utf-8'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_prune_removes_the_least_recently_used(self):
+        keys = [CompiledAssetCache.key(str(i), 'js') for i in xrange(3)]
+        for i, key in enumerate(keys):
+            self.cache.set(key, 'x' * 40)
+            # a second apart, oldest first
+            os.utime(self.cache._path(key), (time.time() - 100 + i, time.time() - 100 + i))
+
+        # a hit makes the oldest entry the most recently used
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.cache.set(CompiledAssetCache.key('3', 'js'), 'x' * 40)
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        self.assertEqual(self.cache.prune(max_bytes=0), 3)
+
+    def test_writes_in_flight_are_not_entries(self):
+        key = CompiledAssetCache.key('var a = 1;', 'js')
+        self.cache.set(key, 'var a=1;')
+        with open(os.path.join(os.path.dirname(self.cache._path(key)), '.tmp-in-flight'), 'wb') as f:
+            f.write('x' * 1000)
+        self.assertEqual(self.cache.prune(), 0)
+        self.assertEqual(self.cache.get(key), 'var a=1;')
+
+
+# speaks the shim's protocol: upper-cases its input, exits on "crash" and never answers "hang"
+_FAKE_WORKER = r"""
+import os, sys, time, struct
+
+def read(size):
+    data = ''
+    while len(data) < size:
+        chunk = os.read(0, size - len(data))
+        if not chunk:
+            sys.exit(0)
+        data += chunk
+    return data
+
+def read_int():
+    return struct.unpack('>i', read(4))[0]
+
+while True:
+    arguments = read(read_int())
+    content = read(read_int())
+    if content == 'crash':
+        sys.exit(3)
+    if content == 'hang':
+        time.sleep(60)
+    output = content.upper()
+    os.write(1, struct.pack('>i', 0) + struct.pack('>i', len(output)) + output + struct.pack('>i', 0))
+"""
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self._java_command = worker_pool._java_command
+        worker_pool._java_command = lambda jar: [sys.executable, '-c', _FAKE_WORKER]
+        self.pool = worker_pool.WorkerPool('fake.jar', size=1, timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        worker_pool._java_command = self._java_command
+
+    def pids(self):
+        return [worker['pid'] for worker in self.pool.stats['workers']]
+
+    def test_workers_stay_warm(self):
+        self.assertEqual(self.pool.compress('var a;'), 'VAR A;')
+        pids = self.pids()
+        self.assertEqual(self.pool.compress('var b;'), 'VAR B;')
+        self.assertEqual(self.pids(), pids)
+        self.assertEqual(self.pool.stats['workers'][0]['requests'], 2)
+
+    def test_crashed_worker_is_replaced(self):
+        self.pool.compress('var a;')
+        pids = self.pids()
+
+        self.assertRaises(worker_pool.WorkerError, self.pool.compress, 'crash')
+        self.assertEqual(self.pool.stats['recycled'], 1)
+        self.assertEqual(self.pool.compress('var a;'), 'VAR A;')
+        self.assertNotEqual(self.pids(), pids)
+
+    def test_timed_out_worker_is_replaced(self):
+        self.pool.timeout = 0.5
+        start = time.time()
+        self.assertRaises(worker_pool.WorkerTimeout, self.pool.compress, 'hang')
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.pool.stats['recycled'], 1)
+        self.assertEqual(self.pool.compress('var a;'), 'VAR A;')
+
+
+class _TimingOutPool(object):
+    def __init__(self):
+        super(_TimingOutPool, self).__init__()
+
+        self.timeouts = []
+
+    def request(self, content, arguments='', timeout=None):
+        self.timeouts.append(timeout)
+        raise worker_pool.WorkerTimeout('timed out')
+
+
+class CompressorCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = compressor.configure_cache(self.directory)
+        self._compress = compressor._compress
+
+    def tearDown(self):
+        compressor._compress = self._compress
+        compressor.configure_cache(None)
+        shutil.rmtree(self.directory)
+
+    def test_failed_output_is_not_cached(self):
+        compressor._compress = lambda content, file_type, arguments='', **kwargs: (1, 'var a=', 'syntax error')
+        self.assertEqual(compressor.compress('var a = 1;', compressor.JS), 'var a=')
+        cache_key, output = compressor._cached('var a = 1;', compressor.JS, '')
+        self.assertIsNotNone(cache_key)
+        self.assertIsNone(output)
+
+    def test_unoptimized_image_is_not_cached(self):
+        truncated_png = '\x89PNG\r\n\x1a\n' + '\0\0\0\x0dIHDR'
+        self.assertEqual(compressor.compress(truncated_png, compressor.PNG), truncated_png)
+        self.assertIsNone(compressor.lookup(truncated_png, compressor.PNG))
+
+
+class WorkerPoolTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = _TimingOutPool()
+        self._enabled, self._get_pool = worker_pool.enabled, worker_pool.get_pool
+        worker_pool.enabled = lambda: True
+        worker_pool.get_pool = lambda jar: self.pool
+
+    def tearDown(self):
+        worker_pool.enabled, worker_pool.get_pool = self._enabled, self._get_pool
+
+    def test_item_timeout_applies_to_pool_requests(self):
+        returncode, output, stderr = compressor._compress('var a = 1;', compressor.JS, timeout=5)
+        self.assertEqual(self.pool.timeouts, [5])
+        self.assertEqual(returncode, compressor.TIMEOUT_RETURNCODE)
+
+
+if __name__ == '__main__':
+    unittest.main()
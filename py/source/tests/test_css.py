@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from .. import compressor
+    from ..compressor import css as css_engine
+except ImportError:
+    # the compressor needs pyScss
+    compressor = css_engine = None
+
+
+@unittest.skipIf(css_engine is None, 'pyScss is not installed')
+class CssEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = css_engine.CssEngine(check_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_flatten_inlines_partials(self):
+        mixins = self.write('_mixins.scss', '.a { color: red; }')
+        buttons = self.write('_buttons.scss', '@import "mixins";\n.b { color: blue; }')
+
+        source, imported, unresolved = self.engine.flatten('@import "buttons", "mixins";\n.c { color: green; }',
+                                                           [self.directory])
+
+        self.assertEqual(source, '.a { color: red; }\n.b { color: blue; }\n.a { color: red; }\n.c { color: green; }')
+        self.assertEqual(imported, (os.path.abspath(buttons), os.path.abspath(mixins)))
+        self.assertFalse(unresolved)
+
+    def test_flatten_keeps_plain_css_imports(self):
+        source, imported, unresolved = self.engine.flatten(
+            '@import url(print.css) print;\n@import "http://example.com/a.css";', [self.directory])
+
+        self.assertEqual(source, '@import url(print.css) print;\n@import "http://example.com/a.css";')
+        self.assertEqual(imported, ())
+        self.assertFalse(unresolved)
+
+    def test_flatten_reports_unresolved_imports(self):
+        source, imported, unresolved = self.engine.flatten('@import "missing";', [self.directory])
+
+        self.assertEqual(source, '@import "missing";')
+        self.assertTrue(unresolved)
+
+    def test_flatten_skips_comments_but_not_urls_or_strings(self):
+        self.write('_mixins.scss', '.a { color: red; }')
+        content = ('/* @import "mixins"; */\n'
+                   '// @import "mixins";\n'
+                   '.logo { background: url(http://example.com/a.png); } @import "mixins";\n'
+                   '.quote:before { content: "//"; } @import "mixins";')
+
+        source, imported, unresolved = self.engine.flatten(content, [self.directory])
+
+        self.assertEqual(source, '/* @import "mixins"; */\n'
+                                 '// @import "mixins";\n'
+                                 '.logo { background: url(http://example.com/a.png); } .a { color: red; }\n'
+                                 '.quote:before { content: "//"; } .a { color: red; }')
+        self.assertEqual(len(imported), 1)
+
+    def test_import_cycle(self):
+        self.write('_a.scss', '@import "b";')
+        self.write('_b.scss', '@import "a";')
+
+        self.assertRaises(css_engine.CssError, self.engine.flatten, '@import "a";', [self.directory])
+
+    def test_changed_partial_recompiles_its_dependents(self):
+        mixins = self.write('_mixins.scss', '.a { color: red; }')
+        self.write('_other.scss', '.b { color: blue; }')
+        importer = self.write('importer.scss', '@import "mixins";')
+        other = self.write('other.scss', '@import "other";')
+
+        self.assertIn('red', self.engine.compile('@import "mixins";', path=importer))
+        self.engine.compile('@import "other";', path=other)
+        dependents = self.engine.dependents(mixins)
+        self.assertEqual(len(dependents), 1)
+
+        self.write('_mixins.scss', '.a { color: blue; }')
+        self.assertEqual(self.engine.invalidate([mixins]), dependents)
+        self.assertIn('blue', self.engine.compile('@import "mixins";', path=importer))
+
+    def test_unresolved_output_is_not_cached(self):
+        stylesheet = os.path.join(self.directory, 'stylesheet.scss')
+        self.engine.compile('@import "late";', path=stylesheet)
+
+        self.write('_late.scss', '.late { color: red; }')
+        self.assertIn('red', self.engine.compile('@import "late";', path=stylesheet))
+
+    def test_invalidate_css(self):
+        mixins = self.write('_mixins.scss', '.a { color: red; }')
+        engine = compressor.configure_css(check_interval=0)
+        try:
+            engine.compile('@import "mixins";', path=self.write('a.scss', ''))
+            engine.compile('@import "mixins";\n.b { color: blue; }', path=self.write('b.scss', ''))
+
+            self.assertEqual(compressor.invalidate_css([mixins]), 2)
+            self.assertEqual(compressor.invalidate_css([os.path.join(self.directory, 'unused.scss')]), 0)
+        finally:
+            compressor.configure_css()
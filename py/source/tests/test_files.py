@@ -0,0 +1,38 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+from ..files import FILE_MODE, write_atomic
+
+
+class WriteAtomicTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_creates_missing_directories(self):
+        path = os.path.join(self.directory, 'js', 'app.js.gz')
+        write_atomic(path, 'content')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), 'content')
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['app.js.gz'])
+
+    def test_mode_follows_the_umask(self):
+        path = os.path.join(self.directory, 'app.js.gz')
+        write_atomic(path, 'content')
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0666 & ~umask)
+        self.assertEqual(FILE_MODE, 0666 & ~umask)
+
+    def test_replaces_the_previous_file(self):
+        path = os.path.join(self.directory, 'app.js.gz')
+        write_atomic(path, 'old')
+        write_atomic(path, 'new', fsync=True)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.directory), ['app.js.gz'])
@@ -0,0 +1,178 @@
+import os
+import zlib
+import shutil
+import struct
+import tempfile
+import unittest
+import cStringIO
+
+try:
+    from ..compressor import image as image_optimizer
+except ImportError:
+    # the compressor needs pyScss
+    image_optimizer = None
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:
+    Image = None
+
+from ..speed import Speed, WEBP_SIBLING_EXTENSION
+
+
+def _chunk(chunk_type, data):
+    crc = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+    return struct.pack('>I4s', len(data), chunk_type) + data + struct.pack('>I', crc)
+
+
+def _png(width=16, height=16):
+    # an rgb gradient, filter type 0 on every scanline, stored without compression and split over two IDAT chunks
+    raw = ''.join('\0' + ''.join(chr(x * 16) + chr(y * 16) + chr((x + y) * 8) for x in xrange(width))
+                  for y in xrange(height))
+    idat = zlib.compress(raw, 0)
+    return ''.join([
+        '\x89PNG\r\n\x1a\n',
+        _chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        _chunk('tEXt', 'Comment\0made by hand'),
+        _chunk('IDAT', idat[:len(idat) // 2]),
+        _chunk('IDAT', idat[len(idat) // 2:]),
+        _chunk('tIME', struct.pack('>HBBBBB', 2020, 1, 1, 0, 0, 0)),
+        _chunk('IEND', ''),
+    ])
+
+
+def _segment(marker, data):
+    return '\xff' + chr(marker) + struct.pack('>H', len(data) + 2) + data
+
+
+def _jpeg():
+    # the segment layout of a jpeg; the scan data isn't a real image
+    return ''.join([
+        '\xff\xd8',
+        _segment(0xe0, 'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'),
+        _segment(0xe1, 'Exif\0\0orientation'),
+        _segment(0xe1, 'http://ns.adobe.com/xap/1.0/\0' + '<x:xmpmeta/>' * 20),
+        _segment(0xfe, 'made by hand'),
+        _segment(0xdb, '\0' + '\x01' * 64),
+        _segment(0xda, '\x01\x01\0\0\x3f\0'),
+        'entropy coded \xff\0 data',
+        '\xff\xd9',
+    ])
+
+
+def _png_chunks(content):
+    return list(image_optimizer._iter_png_chunks(content))
+
+
+@unittest.skipIf(image_optimizer is None, 'pyScss is not installed')
+class OptimizeTest(unittest.TestCase):
+    def test_png_keeps_its_pixels(self):
+        content = _png()
+        optimized = image_optimizer.optimize(content)
+
+        self.assertLess(len(optimized), len(content))
+        chunks = _png_chunks(optimized)
+        self.assertEqual([chunk_type for (chunk_type, data) in chunks], ['IHDR', 'IDAT', 'IEND'])
+        self.assertEqual(chunks[0], _png_chunks(content)[0])
+        self.assertEqual(zlib.decompress(chunks[1][1]),
+                         zlib.decompress(''.join(data for (chunk_type, data) in _png_chunks(content)
+                                                 if chunk_type == 'IDAT')))
+
+    def test_optimized_png_is_left_as_it_is(self):
+        optimized = image_optimizer.optimize(_png())
+        self.assertIs(image_optimizer.optimize(optimized), optimized)
+
+    def test_jpeg_loses_only_metadata(self):
+        content = _jpeg()
+        optimized = image_optimizer.optimize(content)
+
+        self.assertEqual(optimized, ''.join([
+            '\xff\xd8',
+            _segment(0xe0, 'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'),
+            _segment(0xe1, 'Exif\0\0orientation'),
+            content[content.index('\xff\xdb'):],
+        ]))
+        self.assertIs(image_optimizer.optimize(optimized), optimized)
+
+    def test_malformed(self):
+        self.assertRaises(image_optimizer.ImageError, image_optimizer.optimize, _png()[:-20])
+        self.assertRaises(image_optimizer.ImageError, image_optimizer.optimize, _jpeg()[:30], image_optimizer.JPEG)
+        self.assertRaises(image_optimizer.ImageError, image_optimizer.optimize, 'GIF89a', image_optimizer.PNG)
+        self.assertIsNone(image_optimizer.sniff('GIF89a'))
+
+
+def _pil_image():
+    image = Image.new('RGB', (64, 64))
+    image.putdata([(x * 4, y * 4, (x + y) * 2) for y in xrange(64) for x in xrange(64)])
+    return image
+
+
+def _save(image, file_type, **options):
+    output = cStringIO.StringIO()
+    image.save(output, file_type, **options)
+    return output.getvalue()
+
+
+def _pixels(content):
+    return list(Image.open(cStringIO.StringIO(content)).convert('RGB').getdata())
+
+
+@unittest.skipIf(image_optimizer is None or Image is None, 'pyScss or PIL is not installed')
+class PilRoundTripTest(unittest.TestCase):
+    def test_png(self):
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Comment', 'x' * 1000)
+        content = _save(_pil_image(), 'PNG', pnginfo=info, compress_level=1)
+
+        optimized = image_optimizer.optimize(content)
+        self.assertLessEqual(len(optimized), len(content))
+        self.assertEqual(_pixels(optimized), _pixels(content))
+
+    def test_jpeg(self):
+        content = _save(_pil_image(), 'JPEG', quality=95)
+
+        optimized = image_optimizer.optimize(content)
+        self.assertLessEqual(len(optimized), len(content))
+        self.assertEqual(_pixels(optimized), _pixels(content))
+
+        self.assertLessEqual(len(image_optimizer.optimize(content, quality=60)), len(content))
+
+    def test_webp(self):
+        if not image_optimizer.can_encode(image_optimizer.WEBP):
+            self.skipTest('PIL has no webp encoder')
+        content = _save(_pil_image(), 'PNG')
+        webp = image_optimizer.to_webp(content)
+        self.assertLess(len(webp), len(content))
+        self.assertEqual(Image.open(cStringIO.StringIO(webp)).size, (64, 64))
+
+
+@unittest.skipIf(image_optimizer is None, 'pyScss is not installed')
+class OptimizeImagesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_report(self):
+        png = self.write('a.png', _png())
+        text = self.write('a.txt', 'not an image')
+
+        report = Speed.optimize_images([png, text], workers=1)
+        self.assertEqual(report, [(png, len(_png()), len(image_optimizer.optimize(_png())))])
+
+    def test_webp_siblings(self):
+        if not image_optimizer.can_encode(image_optimizer.WEBP):
+            self.skipTest('PIL has no webp encoder')
+        png = self.write('a.png', _save(_pil_image(), 'PNG'))
+
+        Speed.optimize_images([png], workers=1, webp_quality=80)
+        self.assertTrue(os.path.exists(png + WEBP_SIBLING_EXTENSION))
+        with open(png + WEBP_SIBLING_EXTENSION, 'rb') as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..incremental import IncrementalManifest, ModuleEntry
+from ..watcher import PollingWatcher
+
+
+class _PrimerManifest(object):
+    def __init__(self, entries):
+        super(_PrimerManifest, self).__init__()
+
+        self.manifest = dict((entry.name, entry) for entry in entries)
+        self.sorted_deps = [(entry.name, entry.path, entry.version) for entry in entries]
+        self.primer = None
+
+
+def _touch(path, content, mtime):
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+class PollingWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'a.js')
+        _touch(self.path, 'var a;', 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reports_changed_mtime(self):
+        watcher = PollingWatcher([self.path])
+        self.assertEqual(watcher.poll(), set())
+
+        # same size, new mtime
+        _touch(self.path, 'var b;', 2000)
+        self.assertEqual(watcher.poll(), set([self.path]))
+        self.assertEqual(watcher.poll(), set())
+
+    def test_reports_removed_and_created_files(self):
+        missing = os.path.join(self.directory, 'b.js')
+        watcher = PollingWatcher([self.path, missing])
+
+        os.remove(self.path)
+        self.assertEqual(watcher.poll(), set([self.path]))
+
+        _touch(missing, 'var b;', 1000)
+        self.assertEqual(watcher.poll(), set([missing]))
+
+
+class IncrementalManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # base <- util <- main, base <- extra, and lone on its own
+        dependencies = [('base', ()), ('util', ('base',)), ('main', ('util',)), ('extra', ('base',)), ('lone', ())]
+        entries = []
+        for name, module_dependencies in dependencies:
+            path = self.path(name)
+            _touch(path, name, 1000)
+            entries.append(ModuleEntry(name, path, 1.0, 1000, len(name), module_dependencies))
+        self.manifest = IncrementalManifest(_PrimerManifest(entries),
+                                            watcher=PollingWatcher([entry.path for entry in entries]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.js')
+
+    def versions(self):
+        return dict((name, entry.version) for (name, entry) in self.manifest.current.manifest.iteritems())
+
+    def test_changed_module_bumps_only_its_dependents(self):
+        previous = self.manifest.current
+        _touch(self.path('util'), 'changed util', 2000)
+
+        self.assertEqual(self.manifest.poll(), set(['util', 'main']))
+        current = self.manifest.current
+        self.assertGreater(current.generation, previous.generation)
+        self.assertEqual(self.versions(), {'base': 1.0, 'util': 2.0, 'main': 2.0, 'extra': 1.0, 'lone': 1.0})
+
+        util = current.manifest['util']
+        self.assertEqual((util.last_modified, util.byte_size), (2000, len('changed util')))
+        self.assertEqual(util.serialized_versions[0]['version'], 1.0)
+        self.assertEqual(current.manifest['main'].last_modified, 2000)
+        self.assertIs(current.manifest['base'], previous.manifest['base'])
+
+        # the previous generation is left as it was, for requests still reading it
+        self.assertEqual(previous.manifest['util'].version, 1.0)
+        self.assertEqual(self.manifest.poll(), set())
+
+    def test_deleted_and_added_again(self):
+        os.remove(self.path('base'))
+        self.assertEqual(self.manifest.poll(), set(['base', 'util', 'main', 'extra']))
+        self.assertTrue(self.manifest.current.manifest['base'].removed)
+        self.assertEqual(self.versions()['lone'], 1.0)
+
+        _touch(self.path('base'), 'base is back', 3000)
+        self.assertEqual(self.manifest.poll(), set(['base', 'util', 'main', 'extra']))
+        base = self.manifest.current.manifest['base']
+        self.assertFalse(base.removed)
+        self.assertEqual((base.version, base.last_modified), (3.0, 3000))
+
+    def test_files_outside_the_manifest_are_ignored(self):
+        unknown = os.path.join(self.directory, 'unknown.js')
+        _touch(unknown, 'var unknown;', 1000)
+        generation = self.manifest.current.generation
+
+        self.assertEqual(self.manifest.apply([unknown]), set())
+        self.assertEqual(self.manifest.current.generation, generation)
+
+    def test_rebuilt_module_picks_up_new_dependencies(self):
+        def rebuild(entry):
+            return entry.replace(dependencies=('lone',)) if entry.name == 'extra' else entry
+        self.manifest.rebuild_module = rebuild
+
+        _touch(self.path('extra'), 'extra now needs lone', 2000)
+        self.assertEqual(self.manifest.poll(), set(['extra']))
+        _touch(self.path('lone'), 'changed lone', 3000)
+        self.assertEqual(self.manifest.poll(), set(['lone', 'extra']))
@@ -0,0 +1,101 @@
+import unittest
+
+from ..index import DependencyIndex, LOADED_BITS_SEPARATOR, encode_bits, decode_bits
+
+
+class _Module(object):
+    def __init__(self, path, version, dependencies=(), last_modified=None, byte_size=None, serialized_versions=()):
+        super(_Module, self).__init__()
+
+        self.path = path
+        self.version = version
+        self.last_modified = last_modified
+        self.byte_size = byte_size
+        self.dependencies = dependencies
+        self.serialized_versions = serialized_versions
+        self.removed = False
+
+
+class _Manifest(object):
+    def __init__(self, names, modules=None):
+        super(_Manifest, self).__init__()
+
+        self.manifest = modules or dict((name, _Module('js/%s.js' % name, 1)) for name in names)
+        self.sorted_deps = [(name, self.manifest[name].path, self.manifest[name].version) for name in names]
+
+
+def _index(count, prefix='m'):
+    return DependencyIndex(_Manifest(['%s%02d' % (prefix, rank) for rank in xrange(count)]))
+
+
+class VersionRecordTest(unittest.TestCase):
+    def setUp(self):
+        main = _Module('js/main.js', '3', last_modified=3000, byte_size=30, serialized_versions=(
+            {'version': 2, 'path': 'js/main-2.js', 'last_modified': 2000, 'byte_size': 20},
+            {'version': '1.0', 'last_modified': 1000},
+            {'version': 2, 'path': 'js/main-2-again.js', 'last_modified': 2500},
+            {'version': 'unversioned', 'last_modified': 500},
+        ))
+        self.index = DependencyIndex(_Manifest(['lib', 'main'], {'lib': _Module('js/lib.js', 1), 'main': main}))
+
+    def test_history_is_indexed_by_name_and_version(self):
+        self.assertEqual(self.index.version_record('main', 2.0), ('js/main-2.js', 2000, 20))
+        # fields missing from a serialized version default to the module's
+        self.assertEqual(self.index.version_record('main', 1.0), ('js/main.js', 1000, 30))
+
+    def test_first_entry_for_a_version_wins(self):
+        self.assertEqual(self.index.version_record('main', 2.0).path, 'js/main-2.js')
+
+    def test_unknown_versions(self):
+        self.assertIsNone(self.index.version_record('main', 4.0))
+        self.assertIsNone(self.index.version_record('lib', 1.0))
+        self.assertIsNone(self.index.version_record('missing', 1.0))
+        self.assertEqual(len(self.index.version_records), 2)
+
+    def test_is_current(self):
+        self.assertTrue(self.index.is_current('main', 3.0))
+        self.assertFalse(self.index.is_current('main', 2.0))
+        self.assertFalse(self.index.is_current('missing', 1.0))
+
+
+class BitsTest(unittest.TestCase):
+    def test_round_trip(self):
+        for bits in (0, 1, 1 << 7, 1 << 8, (1 << 7) | (1 << 8), 1 << 63, 1 << 64, (1 << 200) | 1):
+            self.assertEqual(decode_bits(encode_bits(bits)), bits)
+
+    def test_lowest_rank_first(self):
+        self.assertEqual(encode_bits(1), 'AQ')
+        self.assertEqual(encode_bits(1 << 8), 'AAE')
+
+    def test_malformed(self):
+        for encoded in ('A', 'AAAAA', '!!!', 'AA==', 'AA\n', u'\xe9'):
+            self.assertRaises(ValueError, decode_bits, encoded)
+
+
+class LoadedTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.index = _index(70)
+
+    def test_round_trip(self):
+        bits = self.index.bits(['m00', 'm07', 'm08', 'm63', 'm64', 'm69'])
+        self.assertEqual(bits, (1 << 0) | (1 << 7) | (1 << 8) | (1 << 63) | (1 << 64) | (1 << 69))
+        token = self.index.encode_loaded(bits)
+        self.assertEqual(self.index.decode_loaded(token), bits)
+        self.assertEqual(_index(70).decode_loaded(token), bits)
+
+    def test_empty(self):
+        self.assertEqual(self.index.decode_loaded(self.index.encode_loaded(0)), 0)
+
+    def test_another_rank_layout(self):
+        token = self.index.encode_loaded(1 << 7)
+        self.assertIsNone(_index(71).decode_loaded(token))
+        self.assertIsNone(_index(70, prefix='n').decode_loaded(token))
+
+    def test_malformed(self):
+        tag = self.index.rank_tag
+        for token in (None, '', tag, 'AQ', tag + LOADED_BITS_SEPARATOR + '!!!', tag + LOADED_BITS_SEPARATOR + 'A'):
+            self.assertIsNone(self.index.decode_loaded(token), token)
+
+    def test_bits_past_the_last_rank_are_ignored(self):
+        token = self.index.rank_tag + LOADED_BITS_SEPARATOR + encode_bits((1 << 75) | (1 << 70) | (1 << 69))
+        self.assertEqual(self.index.decode_loaded(token), 1 << 69)
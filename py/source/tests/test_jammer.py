@@ -0,0 +1,177 @@
+import shutil
+import tempfile
+import unittest
+
+from .. import jammer
+from ..archive import PrimedArchive
+
+
+class PrewarmCommandTest(unittest.TestCase):
+    def test_needs_somewhere_to_keep_the_bundles(self):
+        self.assertIsNone(jammer.shared_bundle_cache)
+        with self.assertRaises(SystemExit) as raised:
+            jammer.main(['--content-type', 'js', 'app.main'])
+        self.assertEqual(raised.exception.code, 2)
+
+
+class _Module(object):
+    def __init__(self, name, dependencies=(), version=1, last_modified=None, byte_size=None, serialized_versions=()):
+        super(_Module, self).__init__()
+
+        self.path = 'js/%s.js' % name
+        self.version = version
+        self.last_modified = last_modified
+        self.byte_size = byte_size
+        self.dependencies = dependencies
+        self.serialized_versions = serialized_versions
+        self.removed = False
+
+
+class _Primer(object):
+    def __init__(self, primed):
+        super(_Primer, self).__init__()
+
+        self.primed = primed
+
+    def read_primed(self, filename):
+        return self.primed[filename]
+
+
+class _RankedManifest(object):
+    def __init__(self, modules, primer=None):
+        super(_RankedManifest, self).__init__()
+
+        self.manifest = dict(modules)
+        self.sorted_deps = [(name, module.path, module.version) for (name, module) in modules]
+        self.primer = primer
+
+
+class _ArchivedJammer(jammer.Jammer):
+    # the primer only has the current version of archived.main; version 1 is in the manifest's history
+    content_type_manifest = _RankedManifest([
+        ('archived.lib', _Module('archived.lib', last_modified=1000, byte_size=4)),
+        ('archived.main', _Module('archived.main', ('archived.lib',), version=2, last_modified=2000, byte_size=8,
+                                  serialized_versions=({'version': 1, 'last_modified': 1500, 'byte_size': 8},))),
+    ], primer=_Primer({'js/archived.lib.js': 'lib;', 'js/archived.main.js': 'main v2;'}))
+
+
+class PinnedVersionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._primed_archive = jammer.primed_archive
+        jammer.primed_archive = PrimedArchive(self.directory)
+
+    def tearDown(self):
+        jammer.primed_archive = self._primed_archive
+        shutil.rmtree(self.directory)
+
+    def test_pinned_version_is_read_from_the_archive(self):
+        jammer.primed_archive.put('archived.main', 1, 'main v1;')
+
+        pinned = _ArchivedJammer(dependencies='archived.main+v1', request_path='/jam/archived.main+v1.js',
+                                 content_type='js')
+        self.assertEqual(pinned.checksum, 'archived.main+v1.0')
+        self.assertEqual(pinned.last_modified, 1500)
+        self.assertEqual(pinned.contents, 'main v1;')
+
+        current = _ArchivedJammer(dependencies='archived.main', content_type='js')
+        self.assertEqual(current.checksum, 'archived.lib+v1.0,archived.main+v2.0')
+        self.assertEqual(current.contents, 'lib;main v2;')
+
+
+class _RankedJammer(jammer.Jammer):
+    content_type_manifest = _RankedManifest([
+        ('app.base', _Module('app.base')),
+        ('app.util', _Module('app.util', ('app.base',))),
+        ('app.main', _Module('app.main', ('app.util',))),
+        ('app.extra', _Module('app.extra', ('app.base',))),
+        ('vendor', _Module('vendor')),
+    ])
+
+
+class LoadedBitsTest(unittest.TestCase):
+    def check(self, dependencies, loaded):
+        loaded_deps = set(loaded)
+        expected = _RankedJammer.jam_filter_loaded('js', dependencies, loaded_deps)
+
+        index = _RankedJammer(content_type='js').dependency_index
+        token = index.encode_loaded(index.bits(loaded)) if loaded else None
+        actual, actual_token = _RankedJammer.jam_filter_loaded_bits('js', dependencies, token)
+
+        self.assertEqual([(d.name, d.version) for d in actual.dependencies.values()],
+                         [(d.name, d.version) for d in expected.dependencies.values()])
+        self.assertEqual(set(index.names_from_bits(index.decode_loaded(actual_token))), loaded_deps)
+        return actual
+
+    def test_matches_jam_filter_loaded(self):
+        self.assertEqual(list(self.check('app.main,vendor', ['app.base']).dependencies),
+                         ['app.util', 'app.main', 'vendor'])
+        self.check('app.main', [])
+        self.check('app.extra,app.main', ['app.util', 'app.base'])
+        self.assertEqual(list(self.check('app.main', ['app.base', 'app.util', 'app.main']).dependencies), [])
+
+    def test_stale_token_counts_as_nothing_loaded(self):
+        jammer_, token = _RankedJammer.jam_filter_loaded_bits('js', 'app.util', 'stale.AQ')
+        self.assertEqual(list(jammer_.dependencies), ['app.base', 'app.util'])
+
+
+class _Dependency(object):
+    def __init__(self, name, version):
+        super(_Dependency, self).__init__()
+
+        self.name = name
+        self.version = version
+
+
+class _Index(object):
+    # version 2 is current; version 1 is only in the manifest's history
+    def is_current(self, name, version):
+        return version == 2
+
+    def version_record(self, name, version):
+        return object()
+
+
+class _Archive(object):
+    def __init__(self, archived):
+        super(_Archive, self).__init__()
+
+        self.archived = archived
+
+    def has(self, name, version):
+        return (name, version) in self.archived
+
+
+class _Manifest(object):
+    manifest = {}
+
+
+class _DeltaJammer(jammer.Jammer):
+    dependency_index = _Index()
+    content_type_manifest = _Manifest()
+
+    def __init__(self, dependencies):
+        self.dependencies = jammer.OrderedDict((d.name, d) for d in dependencies)
+
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self._primed_archive = jammer.primed_archive
+
+    def tearDown(self):
+        jammer.primed_archive = self._primed_archive
+
+    def test_no_delta_from_an_unarchived_old_version(self):
+        jammer.primed_archive = None
+        target = _DeltaJammer([_Dependency('app.main', 2)])
+        self.assertIsNone(target._build_delta(_DeltaJammer([_Dependency('app.main', 1)])))
+
+        jammer.primed_archive = _Archive(set())
+        self.assertIsNone(target._build_delta(_DeltaJammer([_Dependency('app.main', 1)])))
+
+    def test_archived_old_versions_are_servable(self):
+        jammer.primed_archive = _Archive(set([('app.main', 1)]))
+        target = _DeltaJammer([])
+        self.assertTrue(target._is_servable(_Dependency('app.main', 1), _Index()))
+        self.assertTrue(target._is_servable(_Dependency('app.main', 2), _Index()))
+        self.assertFalse(target._is_servable(_Dependency('app.lib', 1), _Index()))
@@ -0,0 +1,29 @@
+import unittest
+
+from ..lru import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_byte_bound(self):
+        cache = LRUCache(max_bytes=10)
+        cache.set('a', 'x' * 6)
+        cache.set('b', 'y' * 6)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'y' * 6)
+        self.assertFalse(cache.set('c', 'z' * 11))
+
+    def test_entry_bound(self):
+        cache = LRUCache(name='etags', max_entries=2)
+        cache.set('a', ['unsized'])
+        cache.set('b', 'x' * 1000)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), ['unsized'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats['entries'], 2)
+
+    def test_entry_bound_of_zero_disables(self):
+        cache = LRUCache(max_entries=0)
+        self.assertFalse(cache.set('a', 'x'))
+        self.assertIsNone(cache.get('a'))
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..metrics import Metrics, PrometheusTextExporter
+
+
+class PrometheusTextExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'paste.prom')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_flush_writes_the_textfile(self):
+        metrics = Metrics(prefix='paste')
+        metrics.increment('jam.requests', 3)
+        metrics.gauge('bundles', 2)
+        metrics.timing('jam.contents', 0.5)
+        metrics.timing('jam.contents', 1.5)
+
+        PrometheusTextExporter(metrics, self.path).flush()
+
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        for line in ('# TYPE paste_jam_requests_total counter', 'paste_jam_requests_total 3',
+                     '# TYPE paste_bundles gauge', 'paste_bundles 2',
+                     '# TYPE paste_jam_contents_seconds summary', 'paste_jam_contents_seconds_count 2',
+                     'paste_jam_contents_seconds_sum 2.000000', 'paste_jam_contents_seconds_max 1.500000'):
+            self.assertIn(line, lines)
+        self.assertEqual(os.listdir(self.directory), ['paste.prom'])
+
+    def test_flush_replaces_the_previous_file(self):
+        metrics = Metrics(prefix='paste')
+        exporter = PrometheusTextExporter(metrics, self.path)
+        metrics.gauge('bundles', 1)
+        exporter.flush()
+        metrics.gauge('bundles', 5)
+        exporter.flush()
+
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('paste_bundles 5', lines)
+        self.assertNotIn('paste_bundles 1', lines)
@@ -0,0 +1,41 @@
+import threading
+import unittest
+
+from .. import offload
+
+
+class _Callback(object):
+    def __init__(self):
+        super(_Callback, self).__init__()
+
+        self.calls = []
+
+    def __call__(self, result, error):
+        self.calls.append((result, error, threading.current_thread()))
+
+
+class SubmitTest(unittest.TestCase):
+    def test_result(self):
+        callback = _Callback()
+        async_result = offload.submit(offload.cpu_pool(), divmod, (7, 2), callback=callback)
+
+        self.assertEqual(async_result.get(5), (3, 1))
+        [(result, error, thread)] = callback.calls
+        self.assertEqual((result, error), ((3, 1), None))
+        self.assertIsNot(thread, threading.current_thread())
+
+    def test_kwargs(self):
+        async_result = offload.submit(offload.io_pool(), int, ('ff',), {'base': 16})
+        self.assertEqual(async_result.get(5), 255)
+
+    def test_error_reaches_the_callback_and_get(self):
+        callback = _Callback()
+        async_result = offload.submit(offload.io_pool(), int, ('not a number',), callback=callback)
+
+        self.assertRaises(ValueError, async_result.get, 5)
+        [(result, error, thread)] = callback.calls
+        self.assertIsNone(result)
+        self.assertIsInstance(error, ValueError)
+
+    def test_no_callback(self):
+        self.assertRaises(ZeroDivisionError, offload.submit(offload.cpu_pool(), divmod, (1, 0)).get, 5)
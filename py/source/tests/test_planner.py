@@ -0,0 +1,70 @@
+import unittest
+
+from ..index import get_dependency_index
+from ..planner import Chunk, ChunkPlan, ChunkPlanner, order_chunks
+
+
+class _Module(object):
+    def __init__(self, dependencies=(), byte_size=100):
+        super(_Module, self).__init__()
+
+        self.dependencies = dependencies
+        self.byte_size = byte_size
+        self.serialized_versions = ()
+
+
+class _Manifest(object):
+    def __init__(self, modules):
+        super(_Manifest, self).__init__()
+
+        self.manifest = dict(modules)
+        self.sorted_deps = [(name, name + '.js', 1) for (name, module) in modules]
+
+
+def _names(chunks):
+    return [list(chunk.names) for chunk in chunks]
+
+
+class ChunkOrderTest(unittest.TestCase):
+    def setUp(self):
+        # manifest order puts a before b, but c needs b
+        self.manifest = _Manifest([('a', _Module()), ('b', _Module()), ('c', _Module(dependencies=('b',)))])
+        self.index = get_dependency_index(self.manifest)
+
+    def test_chunks_come_after_their_dependencies(self):
+        plan = ChunkPlanner(self.manifest, request_overhead_bytes=0).plan({'a,c': 10, 'b': 10})
+        covering, uncovered = plan.chunks_for(self.index.bits(['a', 'b', 'c']))
+        self.assertEqual(_names(covering), [['b'], ['a', 'c']])
+        self.assertFalse(uncovered)
+
+    def test_loaded_plans_are_reordered(self):
+        data = ChunkPlan([Chunk(('a', 'c'), 200, 0), Chunk(('b',), 100, 0)]).to_json()
+        plan = ChunkPlan.from_json(data, self.manifest)
+        self.assertEqual(_names(plan.chunks), [['b'], ['a', 'c']])
+
+    def test_cyclic_chunks_are_merged(self):
+        manifest = _Manifest([('a', _Module()), ('b', _Module(dependencies=('a',))), ('c', _Module(dependencies=('b',)))])
+        index = get_dependency_index(manifest)
+        chunks = [Chunk(('a', 'c'), 200, index.bits(['a', 'c'])), Chunk(('b',), 100, index.bits(['b']))]
+        self.assertEqual(_names(order_chunks(chunks, index)), [['a', 'b', 'c']])
+
+
+class ChunkPlannerTest(unittest.TestCase):
+    def test_folded_groups_stay_in_dependency_order(self):
+        modules = []
+        for i in xrange(60):
+            dependencies = ('m%d' % (i - 1),) if i % 3 else ()
+            modules.append(('m%d' % i, _Module(dependencies=dependencies, byte_size=100 + i)))
+        manifest = _Manifest(modules)
+        index = get_dependency_index(manifest)
+        requests = dict((','.join('m%d' % ((page * 7 + k * 11) % 60) for k in xrange(4)), page + 1)
+                        for page in xrange(30))
+
+        plan = ChunkPlanner(manifest, max_chunks=4, max_groups=8).plan(requests)
+        placed = 0
+        for chunk in plan.chunks:
+            needs = 0
+            for name in chunk.names:
+                needs |= index.closure_bits([name])
+            self.assertFalse(needs & ~chunk.bits & ~placed)
+            placed |= chunk.bits
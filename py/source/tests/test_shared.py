@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import shared
+from ..shared import SharedBundleCache, SharedCacheError
+
+
+class SharedBundleCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bundles')
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    def open(self, **kwargs):
+        kwargs.setdefault('max_bytes', 64 * 1024)
+        kwargs.setdefault('slots', 64)
+        kwargs.setdefault('grace', 0)
+        cache = SharedBundleCache(self.path, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_round_trip(self):
+        cache = self.open()
+        self.assertTrue(cache.set(('/js/a.js', 'gzip'), 'a' * 100))
+        self.assertTrue(cache.set(('/js/b.js', 'gzip'), u'b\xe9'))
+        self.assertEqual(str(cache.get(('/js/a.js', 'gzip'))), 'a' * 100)
+        self.assertEqual(str(cache.get(('/js/b.js', 'gzip'))), u'b\xe9'.encode('utf-8'))
+        self.assertIsNone(cache.get(('/js/a.js', 'br')))
+
+    def test_round_trip_across_attachments(self):
+        self.open().set('/js/a.js', 'published once')
+        self.assertEqual(str(self.open().get('/js/a.js')), 'published once')
+
+    def test_ring_reclaims_old_records(self):
+        cache = self.open(max_bytes=4096)
+        for i in xrange(100):
+            self.assertTrue(cache.set('/js/%d.js' % i, str(i) * 200))
+        self.assertEqual(str(cache.get('/js/99.js')), '99' * 200)
+        self.assertIsNone(cache.get('/js/0.js'))
+        self.assertGreater(cache.stats['evictions'], 0)
+
+    def test_oversized_value_is_refused(self):
+        cache = self.open(max_bytes=4096)
+        self.assertFalse(cache.set('/js/big.js', 'x' * 2048))
+        self.assertIsNone(cache.get('/js/big.js'))
+
+    def test_resized_arena_gets_its_own_file(self):
+        small = self.open(max_bytes=4096)
+        small.set('/js/a.js', 'small arena')
+        large = self.open(max_bytes=8192)
+        self.assertNotEqual(small.path, large.path)
+        self.assertIsNone(large.get('/js/a.js'))
+        # the arena mapped by workers still on the old size is left as it was
+        self.assertEqual(str(small.get('/js/a.js')), 'small arena')
+
+    def test_corrupt_header_is_refused(self):
+        cache = self.open()
+        cache.set('/js/a.js', 'content')
+        size = os.path.getsize(cache.path)
+        with open(cache.path, 'r+b') as f:
+            f.write('XXXX')
+        self.assertRaises(SharedCacheError, self.open)
+        self.assertEqual(os.path.getsize(cache.path), size)
+
+    def test_truncated_arena_is_refused(self):
+        cache = self.open()
+        with open(cache.path, 'r+b') as f:
+            f.truncate(shared._HEADER_SIZE)
+        self.assertRaises(SharedCacheError, self.open)
+
+    def test_torn_write_is_a_miss(self):
+        cache = self.open()
+        cache.set('/js/a.js', 'content')
+        # a writer that died mid-update leaves the sequence odd; readers must not trust the index
+        cache._set_q(shared._SEQ_OFFSET, cache._get_q(shared._SEQ_OFFSET) + 1)
+        self.assertIsNone(cache.get('/js/a.js'))
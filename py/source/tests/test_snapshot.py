@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import snapshot
+from ..snapshot import ManifestSnapshot, SnapshotError, SnapshotFile, write_snapshot
+
+
+class _Module(object):
+    def __init__(self, path, version, dependencies=(), serialized_versions=(), byte_size=None, removed=False):
+        super(_Module, self).__init__()
+
+        self.path = path
+        self.version = version
+        self.last_modified = None
+        self.byte_size = byte_size
+        self.dependencies = dependencies
+        self.serialized_versions = serialized_versions
+        self.removed = removed
+
+
+class _Manifest(object):
+    def __init__(self, modules):
+        super(_Manifest, self).__init__()
+
+        self.manifest = dict(modules)
+        self.sorted_deps = [(name, module.path, module.version) for (name, module) in modules]
+
+
+def _manifest():
+    return _Manifest([
+        ('a', _Module('js/a.js', 1, byte_size=10)),
+        ('b', _Module('js/b.js', 2.5, dependencies=('a', 'missing'),
+                      serialized_versions=({'version': 1, 'path': 'js/b-old.js', 'byte_size': 7},))),
+        ('c', _Module('css/c.css', 'v3', dependencies=('a', 'b'), removed=True)),
+    ])
+
+
+class ManifestSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'manifest.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        write_snapshot(_manifest(), self.path, generation=7)
+        loaded = ManifestSnapshot(self.path, None)
+
+        self.assertEqual(loaded.generation, 7)
+        self.assertEqual(loaded.sorted_deps, [('a', 'js/a.js', 1), ('b', 'js/b.js', 2.5), ('c', 'css/c.css', 'v3')])
+        b = loaded.manifest['b']
+        self.assertEqual(b.dependencies, ('a',))
+        self.assertIsNone(b.byte_size)
+        self.assertEqual(b.serialized_versions,
+                         ({'version': 1, 'path': 'js/b-old.js', 'last_modified': None, 'byte_size': 7},))
+        self.assertEqual(loaded.manifest['a'].byte_size, 10)
+        self.assertTrue(loaded.manifest['c'].removed)
+        self.assertEqual(loaded.direct_ranks(), [(), (0,), (0, 1)])
+
+    def test_bad_magic(self):
+        data = snapshot.compile_snapshot(_manifest())
+        with open(self.path, 'wb') as f:
+            f.write('XXXX' + data[4:])
+        self.assertRaises(SnapshotError, ManifestSnapshot, self.path, None)
+
+    def test_truncated(self):
+        data = snapshot.compile_snapshot(_manifest())
+        for size in (0, 16, len(data) - 8):
+            with open(self.path, 'wb') as f:
+                f.write(data[:size])
+            self.assertRaises(SnapshotError, ManifestSnapshot, self.path, None)
+
+    def test_reload_keeps_the_last_good_snapshot(self):
+        write_snapshot(_manifest(), self.path, generation=1)
+        snapshot_file = SnapshotFile(self.path, None, check_interval=0)
+        self.assertEqual(snapshot_file.current.generation, 1)
+
+        with open(self.path + '.new', 'wb') as f:
+            f.write('not a snapshot')
+        os.rename(self.path + '.new', self.path)
+        snapshot_file.reload()
+        self.assertEqual(snapshot_file.current.generation, 1)
@@ -0,0 +1,148 @@
+import os
+import time
+import zlib
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from .. import encoding as content_encoding
+from ..cache import compression_cache
+from ..speed import Speed, GMT_DATE_FORMAT
+
+
+class CompressVariantTest(unittest.TestCase):
+    def setUp(self):
+        self.body = 'var variant = 1;\n' * 1000
+
+    def test_variant_is_compressed_once_per_key(self):
+        compressed = Speed.compress_variant(self.body, 'gzip', cache_key='/jam/1/variant.js')
+        self.assertEqual(compression_cache.get(('/jam/1/variant.js', 'gzip')), compressed)
+
+        # the same object comes back rather than a second compression
+        self.assertIs(Speed.compress_variant(self.body, 'gzip', cache_key='/jam/1/variant.js'),
+                      compressed)
+        self.assertIs(Speed.compress_variant('another body', 'gzip', cache_key='/jam/1/variant.js'),
+                      compressed)
+
+    def test_each_encoding_is_a_variant(self):
+        gzipped = Speed.compress_variant(self.body, 'gzip', cache_key='/jam/2/variant.js')
+        deflated = Speed.compress_variant(self.body, 'deflate', cache_key='/jam/2/variant.js')
+        self.assertNotEqual(gzipped, deflated)
+        self.assertEqual(zlib.decompress(deflated, -zlib.MAX_WBITS), self.body)
+
+    def test_no_key_no_cache(self):
+        before = compression_cache.stats['entries']
+        compressed = Speed.compress_variant(self.body, 'gzip')
+        self.assertIsNot(Speed.compress_variant(self.body, 'gzip'), compressed)
+        self.assertEqual(compression_cache.stats['entries'], before)
+
+    def test_write_gzip_siblings(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'app.js')
+            with open(filename, 'wb') as f:
+                f.write(self.body)
+
+            self.assertEqual(Speed.write_gzip_siblings([filename]), [filename + '.gz'])
+            with open(filename + '.gz', 'rb') as f:
+                self.assertEqual(zlib.decompress(f.read(), 16 + zlib.MAX_WBITS), self.body)
+            # up to date siblings are left as they are
+            self.assertEqual(Speed.write_gzip_siblings([filename]), [])
+        finally:
+            shutil.rmtree(directory)
+
+
+class ResponseEncodingTest(unittest.TestCase):
+    def response_encoding(self, path):
+        headers = {}
+        Speed.compress_utf8('body { color: red; }\n' * 1000, headers.__setitem__, path=path, accept_encoding='gzip')
+        return headers.get('Content-Encoding')
+
+    def test_text_paths_are_compressed(self):
+        for path in ('/static/app.js', '/static/site.css'):
+            self.assertEqual(self.response_encoding(path), content_encoding.GZIP)
+
+    def test_precompressed_paths_are_not(self):
+        for path in ('/static/logo.png', '/static/font.woff'):
+            self.assertIsNone(self.response_encoding(path))
+
+    def test_compress_utf8_sets_headers(self):
+        headers = {}
+        body = 'body { color: red; }\n' * 1000
+        compressed = Speed.compress_utf8(body, headers.__setitem__, path='/static/site.css', accept_encoding='gzip')
+        self.assertEqual(headers.get('Content-Encoding'), content_encoding.GZIP)
+        self.assertLess(len(compressed), len(body))
+
+
+class CompressStreamTest(unittest.TestCase):
+    def test_uncompressed_buffers_go_out_as_str(self):
+        chunks = [buffer('var a = 1;\n'), 'var b = 2;\n']
+        body = list(Speed.compress_stream(chunks, {}.__setitem__, skip_content_check=True))
+        self.assertEqual(body, ['var a = 1;\n', 'var b = 2;\n'])
+        self.assertTrue(all(type(chunk) is str for chunk in body))
+
+    def test_compressed_buffers_go_out_as_str(self):
+        headers = {}
+        chunks = [buffer('var a = 1;\n' * 1000)]
+        body = list(Speed.compress_stream(chunks, headers.__setitem__, skip_content_check=True,
+                                          accept_encoding='gzip'))
+        self.assertEqual(headers.get('Content-Encoding'), content_encoding.GZIP)
+        self.assertTrue(all(type(chunk) is str for chunk in body))
+
+
+
+class _Bundle(object):
+    def __init__(self, checksum, last_modified):
+        super(_Bundle, self).__init__()
+
+        self.checksum = checksum
+        self.last_modified = last_modified
+        self.dependencies = ['app']
+
+
+def _http_date(timestamp):
+    # Last-Modified is written from the bundle's local time
+    return datetime.datetime.fromtimestamp(timestamp).strftime(GMT_DATE_FORMAT)
+
+
+class ConditionalRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.bundle = _Bundle('conditional-checksum', int(time.time()) - 3600)
+        self.etag = dict(Speed.bundle_headers(self.bundle))['ETag']
+
+    def test_if_none_match(self):
+        for if_none_match in (self.etag, '"%s"' % self.etag, 'W/"%s"' % self.etag, '"other", "%s"' % self.etag, '*'):
+            self.assertTrue(Speed.is_not_modified({'If-None-Match': if_none_match}, self.bundle), if_none_match)
+        for if_none_match in ('"other"', 'W/"other", "another"', ''):
+            self.assertFalse(Speed.is_not_modified({'If-None-Match': if_none_match}, self.bundle), if_none_match)
+
+    def test_if_modified_since(self):
+        last_modified = self.bundle.last_modified
+        self.assertTrue(Speed.is_not_modified({'If-Modified-Since': _http_date(last_modified)}, self.bundle))
+        self.assertTrue(Speed.is_not_modified({'If-Modified-Since': _http_date(last_modified + 60)}, self.bundle))
+        self.assertFalse(Speed.is_not_modified({'If-Modified-Since': _http_date(last_modified - 60)}, self.bundle))
+        self.assertFalse(Speed.is_not_modified({'If-Modified-Since': 'not a date'}, self.bundle))
+
+    def test_if_none_match_takes_precedence(self):
+        fresh = _http_date(self.bundle.last_modified + 60)
+        self.assertFalse(Speed.is_not_modified({'If-None-Match': '"other"', 'If-Modified-Since': fresh}, self.bundle))
+        stale = _http_date(self.bundle.last_modified - 60)
+        self.assertTrue(Speed.is_not_modified({'If-None-Match': self.etag, 'If-Modified-Since': stale}, self.bundle))
+
+    def test_wsgi_environ(self):
+        self.assertTrue(Speed.is_not_modified({'HTTP_IF_NONE_MATCH': self.etag}, self.bundle))
+
+    def test_conditional_headers(self):
+        headers = {}
+        self.assertTrue(Speed.conditional_headers({'If-None-Match': self.etag}, self.bundle, headers.__setitem__))
+        self.assertEqual(headers['ETag'], self.etag)
+        self.assertEqual(headers['Last-Modified'], _http_date(self.bundle.last_modified))
+
+        headers = {}
+        self.assertFalse(Speed.conditional_headers({}, self.bundle, headers.__setitem__))
+        self.assertEqual(headers['ETag'], self.etag)
+
+
+if __name__ == '__main__':
+    unittest.main()
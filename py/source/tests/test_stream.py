@@ -0,0 +1,93 @@
+import zlib
+import unittest
+
+from .. import encoding as content_encoding
+from .. import jammer
+from ..cache import bundle_cache, compression_cache
+from ..speed import Speed
+
+
+class _Module(object):
+    def __init__(self, name, content, dependencies=()):
+        super(_Module, self).__init__()
+
+        self.path = 'js/%s.js' % name
+        self.version = 1
+        self.last_modified = 1000
+        self.byte_size = len(content)
+        self.dependencies = dependencies
+        self.serialized_versions = ()
+        self.removed = False
+
+
+class _Primer(object):
+    def __init__(self, primed):
+        super(_Primer, self).__init__()
+
+        self.primed = primed
+
+    def read_primed(self, filename):
+        return self.primed[filename]
+
+
+class _Manifest(object):
+    def __init__(self, contents):
+        super(_Manifest, self).__init__()
+
+        modules = []
+        for name, content in contents:
+            modules.append((name, _Module(name, content, tuple(dependency for (dependency, _) in modules))))
+        self.manifest = dict(modules)
+        self.sorted_deps = [(name, module.path, module.version) for (name, module) in modules]
+        self.primer = _Primer(dict(('js/%s.js' % name, content) for (name, content) in contents))
+
+
+_CONTENTS = [('stream.%d' % i, ''.join('var stream%d_%d = %d;\n' % (i, j, i * j) for j in xrange(500)))
+             for i in xrange(4)]
+
+
+class _StreamJammer(jammer.Jammer):
+    content_type_manifest = _Manifest(_CONTENTS)
+
+
+def _decompress(body, encoding):
+    if encoding == content_encoding.GZIP:
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif encoding == content_encoding.DEFLATE:
+        return zlib.decompress(body, -zlib.MAX_WBITS)
+    elif encoding == content_encoding.BROTLI:
+        return content_encoding.brotli.decompress(body)
+    return content_encoding.zstandard.ZstdDecompressor().decompress(body)
+
+
+class CompressJammerStreamTest(unittest.TestCase):
+    def setUp(self):
+        # a cached bundle or variant is served whole rather than streamed
+        bundle_cache.clear()
+        compression_cache.clear()
+
+    def test_chunks_are_the_primed_dependencies(self):
+        chunks = list(_StreamJammer(dependencies='stream.3', content_type='js').iter_contents())
+        self.assertEqual(chunks, [content for (name, content) in _CONTENTS])
+
+    def test_streamed_body_decompresses_to_the_contents(self):
+        expected = ''.join(content for (name, content) in _CONTENTS)
+
+        for encoding in content_encoding.SERVER_PREFERENCE:
+            jammer_ = _StreamJammer(dependencies='stream.3', content_type='js')
+            headers = {}
+            chunks = list(Speed.compress_jammer_stream(jammer_, headers.__setitem__, accept_encoding=encoding))
+
+            self.assertEqual(headers.get('Content-Encoding'), encoding)
+            self.assertTrue(all(type(chunk) is str for chunk in chunks))
+            self.assertEqual(_decompress(''.join(chunks), encoding), expected)
+
+        self.assertEqual(_StreamJammer(dependencies='stream.3', content_type='js').contents, expected)
+
+    def test_identity(self):
+        jammer_ = _StreamJammer(dependencies='stream.3', content_type='js')
+        headers = {}
+        body = ''.join(Speed.compress_jammer_stream(jammer_, headers.__setitem__, accept_encoding='identity'))
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, _StreamJammer(dependencies='stream.3', content_type='js').contents)
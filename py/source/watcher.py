@@ -0,0 +1,129 @@
+import os
+import logging
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+log = logging.getLogger('paste')
+
+
+def _stat(path):
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    return file_stat.st_mtime, file_stat.st_size
+
+
+class PollingWatcher(object):
+    def __init__(self, paths):
+        """
+        detect changes to a set of files by comparing (mtime, size) on each poll
+
+        :param paths:
+        """
+        super(PollingWatcher, self).__init__()
+
+        self._stats = dict((os.path.abspath(path), None) for path in paths)
+        for path in self._stats:
+            self._stats[path] = _stat(path)
+
+    @property
+    def paths(self):
+        return set(self._stats)
+
+    def add(self, path):
+        path = os.path.abspath(path)
+        self._stats[path] = _stat(path)
+
+    def poll(self):
+        """
+
+        :return: the paths created, modified or removed since the last poll
+        """
+        changed = set()
+        for path, previous in self._stats.iteritems():
+            current = _stat(path)
+            if current != previous:
+                self._stats[path] = current
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+if pyinotify is not None:
+    class _InotifyHandler(pyinotify.ProcessEvent):
+        def my_init(self, changed=None):
+            self.changed = changed
+
+        def process_default(self, event):
+            self.changed.add(event.pathname)
+
+
+class InotifyWatcher(object):
+    MASK = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_CREATE |
+            pyinotify.IN_DELETE | pyinotify.IN_ATTRIB) if pyinotify is not None else 0
+
+    def __init__(self, paths):
+        """
+        detect changes to a set of files from inotify events on their directories
+
+        :param paths:
+        """
+        super(InotifyWatcher, self).__init__()
+
+        self._paths = set()
+        self._directories = set()
+        self._changed = set()
+        self._watch_manager = pyinotify.WatchManager()
+        self._notifier = pyinotify.Notifier(self._watch_manager, default_proc_fun=_InotifyHandler(changed=self._changed),
+                                            timeout=0)
+        for path in paths:
+            self.add(path)
+
+    @property
+    def paths(self):
+        return set(self._paths)
+
+    def add(self, path):
+        path = os.path.abspath(path)
+        self._paths.add(path)
+        directory = os.path.dirname(path)
+        if directory not in self._directories:
+            self._watch_manager.add_watch(directory, self.MASK)
+            self._directories.add(directory)
+
+    def poll(self):
+        """
+
+        :return: the paths created, modified or removed since the last poll
+        """
+        while self._notifier.check_events(timeout=0):
+            self._notifier.read_events()
+            self._notifier.process_events()
+
+        changed = self._changed & self._paths
+        self._changed.clear()
+        return changed
+
+    def close(self):
+        self._notifier.stop()
+
+
+def create_watcher(paths):
+    """
+    an inotify watcher where pyinotify is available, else a polling stand-in
+
+    :param paths:
+    :return:
+    """
+    if pyinotify is not None:
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, pyinotify.WatchManagerError) as e:
+            log.warning('falling back to a polling watcher: %s' % e)
+    return PollingWatcher(paths)